@@ -1,18 +1,19 @@
 from flask import Flask, render_template, request, jsonify
-from google import genai
-from google.genai import types
+from werkzeug.exceptions import RequestEntityTooLarge
+import argparse
+import mimetypes
 import os
+import sys
+import threading
+import time
 import toml
-from pathlib import Path
-import uuid
 
 app = Flask(__name__)
 
 # --- Configuration ---
 CONFIG_FILE = "config.toml"
-UPLOAD_FOLDER = os.path.join("static", "uploads")
 MODEL_NAME = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+WARM_UP = os.getenv("WARM_UP", "on")
 
 
 def load_api_key():
@@ -57,11 +58,63 @@ def parse_int(value, default, min_value, max_value):
         return default
 
 
+def env_number(name, default, min_value, max_value, cast=int):
+    """Environment variable ``name`` as a clamped number; ``default`` if unset or invalid."""
+    value = os.getenv(name)
+    if value is None or not value.strip():
+        return default
+    try:
+        return clamp(cast(value), min_value, max_value)
+    except ValueError:
+        print(f"[WARN] Ignoring invalid {name}={value!r}; using {default}.")
+        return default
+
+
+UPLOAD_MAX_BYTES = env_number("UPLOAD_MAX_MB", 100, 1, 10240) * 1024 * 1024
+app.config["MAX_CONTENT_LENGTH"] = UPLOAD_MAX_BYTES
+
 API_KEY = load_api_key()
 if not API_KEY:
     raise RuntimeError("Cannot start: No API key provided.")
 
-client = genai.Client(api_key=API_KEY)
+client = None
+client_lock = threading.Lock()
+
+
+def get_client():
+    """The GenAI client, created (and the SDK imported) on first use."""
+    global client
+    with client_lock:
+        if client is None:
+            from google import genai
+
+            client = genai.Client(api_key=API_KEY)
+        return client
+
+
+def warm_up():
+    """Import the SDK and build the client off the request path."""
+    started = time.perf_counter()
+    try:
+        get_client()
+    except Exception as exc:
+        print(f"[WARN] Could not warm up the AI client: {exc}")
+        return
+    print(f"[INFO] AI client ready in {time.perf_counter() - started:.2f}s")
+
+
+def start_warm_up():
+    if WARM_UP != "off":
+        threading.Thread(target=warm_up, name="sdk-warm-up", daemon=True).start()
+
+
+def profile_startup():
+    """Print an import-time breakdown of this module, then what the client's first use costs."""
+    from startup_profile import print_breakdown
+
+    started = time.perf_counter()
+    get_client()
+    print_breakdown("app", [("first client (SDK import + client)", time.perf_counter() - started)])
 
 # Chat history (in-memory, per process)
 chat_history = []
@@ -72,9 +125,19 @@ def index():
     return render_template("index.html")
 
 
+def upload_too_large():
+    return jsonify({"reply": f"Upload is larger than the {UPLOAD_MAX_BYTES // (1024 * 1024)} MB limit."}), 413
+
+
 @app.route("/chat", methods=["POST"])
 def chat():
+    # Reject oversized bodies from the header, before werkzeug reads any of them.
+    if (request.content_length or 0) > UPLOAD_MAX_BYTES:
+        return upload_too_large()
     try:
+        # Imported here, not at start-up; a broken SDK install is then an error reply.
+        from google.genai import types
+
         user_message = request.form.get("message", "").strip()
         temperature = parse_float(request.form.get("temperature"), 0.7, 0.0, 2.0)
         top_p = parse_float(request.form.get("top_p"), 0.8, 0.0, 1.0)
@@ -90,23 +153,23 @@ def chat():
 
         if uploaded_file and uploaded_file.filename:
             file_name = uploaded_file.filename
-            file_extension = Path(file_name).suffix
-            temp_filename = f"{uuid.uuid4()}{file_extension}"
-            temp_file_path = os.path.join(UPLOAD_FOLDER, temp_filename)
+            mime_type = uploaded_file.mimetype
+            if not mime_type or mime_type == "application/octet-stream":
+                mime_type = mimetypes.guess_type(file_name)[0] or "application/octet-stream"
 
-            uploaded_file.save(temp_file_path)
+            # werkzeug has already spooled the upload (memory or temp file); send that
+            # stream as-is instead of copying it to disk first.
             try:
-                uploaded_gemini_file = client.files.upload(path=temp_file_path)
-                mime_type = uploaded_gemini_file.mime_type or "application/octet-stream"
+                uploaded_gemini_file = get_client().files.upload(
+                    file=uploaded_file.stream,
+                    config=types.UploadFileConfig(mime_type=mime_type, display_name=file_name),
+                )
                 file_part = types.Part.from_uri(
-                    uploaded_gemini_file.uri,
-                    mime_type=mime_type,
+                    file_uri=uploaded_gemini_file.uri,
+                    mime_type=uploaded_gemini_file.mime_type or mime_type,
                 )
             except Exception as exc:
                 return jsonify({"reply": f"Failed to process file: {exc}"}), 400
-            finally:
-                if os.path.exists(temp_file_path):
-                    os.remove(temp_file_path)
 
         generation_config = types.GenerateContentConfig(
             temperature=temperature,
@@ -121,7 +184,7 @@ def chat():
         if file_part:
             contents.append(file_part)
 
-        response = client.models.generate_content(
+        response = get_client().models.generate_content(
             model=MODEL_NAME,
             contents=contents,
             config=generation_config,
@@ -140,6 +203,8 @@ def chat():
             "file_preview": file_name,
         })
 
+    except RequestEntityTooLarge:
+        return upload_too_large()
     except Exception as exc:
         return jsonify({"reply": f"Error: {exc}"}), 500
 
@@ -151,5 +216,12 @@ def clear():
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="AI Chatbot development server.")
+    parser.add_argument("--profile-startup", action="store_true", help="print an import-time breakdown and exit")
+    args = parser.parse_args()
+    if args.profile_startup:
+        profile_startup()
+        sys.exit(0)
     print("[INFO] Starting AI Chatbot...")
+    start_warm_up()
     app.run(host="0.0.0.0", port=5000, debug=True)
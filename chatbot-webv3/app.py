@@ -1,21 +1,77 @@
-from flask import Flask, render_template, request, jsonify
-from google import genai
-from google.genai import types
+from flask import Flask, Request, Response, render_template, request, jsonify, make_response, stream_with_context
+from attachment_cache import AttachmentCache, file_digest
+from client_pool import ClientPool
+from metrics import Registry
+from response_cache import open_response_cache
+from rate_limit import RateLimited, RateLimiter, backoff_delay, parse_rate_limits, retry_after_seconds
+from routing import Router, error_status, is_retryable, parse_backends
+from session_archive import ArchiveError, export_json, export_ndjson, iter_archive
+from session_store import SessionConflict, open_session_store, summarize
+from token_counter import count_tokens
+from tracing import Tracer, span
+from tracing import current as current_trace
+from werkzeug.exceptions import RequestEntityTooLarge
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import math
+import mimetypes
 import os
+import sys
+import tempfile
+import threading
+import time
 import toml
-from pathlib import Path
 import uuid
 from datetime import datetime
 
+
+class SpooledRequest(Request):
+    # Keep small uploads in memory and roll larger ones to a temp file, so the
+    # parsed stream can be handed straight to the provider upload.
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        spool_bytes = CONFIG["upload_spool_bytes"]
+        if not spool_bytes:
+            # SpooledTemporaryFile(max_size=0) would never roll over; 0 means always use disk.
+            return tempfile.TemporaryFile("w+b")
+        return tempfile.SpooledTemporaryFile(max_size=spool_bytes)
+
+
 app = Flask(__name__)
+app.request_class = SpooledRequest
 
 # --- Configuration ---
 CONFIG_FILE = "config.toml"
-UPLOAD_FOLDER = os.path.join("static", "uploads")
 DEFAULT_PROVIDER = "google"
 DEFAULT_MODEL = "gemini-2.5-flash"
-MAX_HISTORY_MESSAGES = 30
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+DEFAULT_CONTEXT_TOKEN_BUDGET = 8000
+MESSAGE_OVERHEAD_TOKENS = 4
+MODEL_CONTEXT_WINDOWS = (
+    ("gemini", 1_048_576),
+    ("gpt-4.1", 1_047_576),
+    ("gpt-4o", 128_000),
+    ("gpt-3.5", 16_385),
+    ("claude", 200_000),
+)
+DEFAULT_CONTEXT_WINDOW = 8192
+PROVIDERS = ("google", "openai", "anthropic")
+MESSAGE_PAGE_SIZE = 50
+MAX_MESSAGE_PAGE_SIZE = 500
+MAX_SEQ = 2**63 - 1
+IMPORT_BATCH_SIZE = 200
+COMMIT_ATTEMPTS = 5
+LOCK_LEASE_SECONDS = 600
+LOCK_POLL_SECONDS = 0.02
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+TTFT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 0.75, 1, 1.5, 2, 3, 5, 10, 20)
+TOKEN_RATE_BUCKETS = (1, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300, 500)
+SIZE_BUCKETS = tuple(1024 * 4**power for power in range(10))
+FALLBACK_MODELS = {
+    "openai": "gpt-4o-mini",
+    "anthropic": "claude-3-5-sonnet-20241022",
+}
 
 
 def load_config():
@@ -32,11 +88,50 @@ def load_config():
 
     return {
         "google_api_key": get_value("GOOGLE_API_KEY"),
+        "google_base_url": get_value("GOOGLE_BASE_URL"),
         "openai_api_key": get_value("OPENAI_API_KEY"),
         "openai_base_url": get_value("OPENAI_BASE_URL"),
         "anthropic_api_key": get_value("ANTHROPIC_API_KEY"),
+        "anthropic_base_url": get_value("ANTHROPIC_BASE_URL"),
         "default_provider": get_value("CHAT_PROVIDER", DEFAULT_PROVIDER),
         "default_model": get_value("GEMINI_MODEL", DEFAULT_MODEL),
+        "client_pool_size": parse_int(get_value("CLIENT_POOL_SIZE"), 8, 1, 256),
+        "client_idle_seconds": parse_int(get_value("CLIENT_IDLE_SECONDS"), 300, 0, 86400),
+        "session_store": get_value("SESSION_STORE", "sqlite"),
+        "session_db": get_value("SESSION_DB", "sessions.db"),
+        "context_token_budget": parse_int(
+            get_value("CONTEXT_TOKEN_BUDGET"), DEFAULT_CONTEXT_TOKEN_BUDGET, 0, 2_000_000
+        ),
+        "response_cache": get_value("RESPONSE_CACHE", "off"),
+        "response_cache_db": get_value("RESPONSE_CACHE_DB", "response_cache.db"),
+        "response_cache_size": parse_int(get_value("RESPONSE_CACHE_SIZE"), 1000, 1, 1_000_000),
+        "response_cache_ttl": parse_int(get_value("RESPONSE_CACHE_TTL"), 86400, 1, 365 * 86400),
+        "upload_max_bytes": parse_int(get_value("UPLOAD_MAX_MB"), 100, 1, 2048) * 1024 * 1024,
+        "upload_spool_bytes": parse_int(get_value("UPLOAD_SPOOL_MB"), 4, 0, 1024) * 1024 * 1024,
+        "import_max_bytes": parse_int(get_value("IMPORT_MAX_MB"), 4096, 1, 1_000_000) * 1024 * 1024,
+        "import_max_session_bytes": parse_int(get_value("IMPORT_MAX_SESSION_MB"), 64, 1, 100_000) * 1024 * 1024,
+        "attachment_cache": get_value("ATTACHMENT_CACHE", "on"),
+        "attachment_cache_db": get_value("ATTACHMENT_CACHE_DB", "attachments.db"),
+        "attachment_ttl_hours": parse_int(get_value("ATTACHMENT_TTL_HOURS"), 47, 1, 24 * 365),
+        "warm_up": get_value("WARM_UP", "on"),
+        "session_lock_timeout": parse_float(get_value("SESSION_LOCK_TIMEOUT"), 120.0, 0.0, 3600.0),
+        "coalesce": get_value("COALESCE", "on"),
+        "metrics": get_value("METRICS", "on"),
+        "metrics_dir": get_value("METRICS_DIR"),
+        "tracing": get_value("TRACING", "off"),
+        "trace_server_timing": get_value("TRACE_SERVER_TIMING", "off"),
+        "trace_control_file": get_value("TRACE_CONTROL_FILE", "tracing.json"),
+        "trace_log": get_value("TRACE_LOG"),
+        "trace_admin_token": get_value("TRACE_ADMIN_TOKEN"),
+        "routing": get_value("ROUTING", "off"),
+        "routing_backends": parse_backends(get_value("ROUTING_BACKENDS")),
+        "routing_timeout": parse_float(get_value("ROUTING_TIMEOUT"), 60.0, 0.0, 3600.0),
+        "hedge_after": parse_float(get_value("HEDGE_AFTER"), 2.0, 0.0, 600.0),
+        "rate_limit": get_value("RATE_LIMIT", "off"),
+        "rate_limits": parse_rate_limits(get_value("RATE_LIMITS")),
+        "rate_limit_max_wait": parse_float(get_value("RATE_LIMIT_MAX_WAIT"), 10.0, 0.0, 600.0),
+        "rate_limit_queue": parse_int(get_value("RATE_LIMIT_QUEUE"), 32, 0, 100_000),
+        "rate_limit_retries": parse_int(get_value("RATE_LIMIT_RETRIES"), 2, 0, 10),
     }
 
 
@@ -44,6 +139,13 @@ def iso_now():
     return datetime.utcnow().isoformat() + "Z"
 
 
+def parse_iso(value):
+    try:
+        return datetime.fromisoformat(str(value).rstrip("Z"))
+    except ValueError:
+        return None
+
+
 def clamp(value, min_value, max_value):
     return max(min_value, min(value, max_value))
 
@@ -62,22 +164,45 @@ def parse_int(value, default, min_value, max_value):
         return default
 
 
-def estimate_tokens(text):
-    if not text:
-        return 0
-    return max(1, len(text.split()))
+CONFIG = load_config()
+app.config["MAX_CONTENT_LENGTH"] = CONFIG["upload_max_bytes"]
 
+client_pool = ClientPool(
+    max_size=CONFIG["client_pool_size"],
+    idle_timeout=CONFIG["client_idle_seconds"],
+)
 
-CONFIG = load_config()
 
-google_client = None
-if CONFIG["google_api_key"]:
-    google_client = genai.Client(api_key=CONFIG["google_api_key"])
+def client_loop(use_async):
+    # Async clients hold connections bound to the event loop that opened them.
+    return asyncio.get_running_loop() if use_async else None
 
 
-def get_openai_client(base_url=None):
+def get_google_client():
+    # One client serves both sync calls and ``.aio``.
     try:
-        from openai import OpenAI
+        from google import genai
+        from google.genai import types
+    except ImportError as exc:
+        raise RuntimeError("Google GenAI SDK not installed. Install google-genai in requirements.") from exc
+
+    api_key = CONFIG["google_api_key"]
+    if not api_key:
+        raise RuntimeError("GOOGLE_API_KEY is not configured.")
+
+    base_url = CONFIG["google_base_url"]
+    return client_pool.get(
+        ("google", api_key, base_url, None),
+        lambda: genai.Client(
+            api_key=api_key,
+            http_options=types.HttpOptions(base_url=base_url) if base_url else None,
+        ),
+    )
+
+
+def get_openai_client(base_url=None, use_async=False):
+    try:
+        from openai import AsyncOpenAI, OpenAI
     except ImportError as exc:
         raise RuntimeError("OpenAI SDK not installed. Install openai in requirements.") from exc
 
@@ -85,10 +210,15 @@ def get_openai_client(base_url=None):
     if not api_key:
         raise RuntimeError("OPENAI_API_KEY is not configured.")
 
-    return OpenAI(api_key=api_key, base_url=base_url or CONFIG["openai_base_url"])
+    base_url = base_url or CONFIG["openai_base_url"]
+    client_class = AsyncOpenAI if use_async else OpenAI
+    return client_pool.get(
+        ("openai", api_key, base_url, client_loop(use_async)),
+        lambda: client_class(api_key=api_key, base_url=base_url),
+    )
 
 
-def get_anthropic_client():
+def get_anthropic_client(use_async=False):
     try:
         import anthropic
     except ImportError as exc:
@@ -98,43 +228,85 @@ def get_anthropic_client():
     if not api_key:
         raise RuntimeError("ANTHROPIC_API_KEY is not configured.")
 
-    return anthropic.Anthropic(api_key=api_key)
+    base_url = CONFIG["anthropic_base_url"]
+    client_class = anthropic.AsyncAnthropic if use_async else anthropic.Anthropic
+    return client_pool.get(
+        ("anthropic", api_key, base_url, client_loop(use_async)),
+        lambda: client_class(api_key=api_key, base_url=base_url),
+    )
+
+
+PROVIDER_CLIENTS = (
+    ("google", get_google_client),
+    ("openai", get_openai_client),
+    ("anthropic", get_anthropic_client),
+)
+
+
+def warm_up():
+    """Import the SDK and build the client of every configured provider, off the request path."""
+    started = time.perf_counter()
+    for provider, get_client in PROVIDER_CLIENTS:
+        if not CONFIG[f"{provider}_api_key"]:
+            continue
+        try:
+            get_client()
+        except Exception as exc:
+            print(f"[WARN] Could not warm up the {provider} client: {exc}")
+    print(f"[INFO] Provider clients ready in {time.perf_counter() - started:.2f}s")
+
+
+def start_warm_up():
+    if CONFIG["warm_up"] != "off":
+        threading.Thread(target=warm_up, name="sdk-warm-up", daemon=True).start()
+
+
+def profile_startup():
+    """Print an import-time breakdown of this module, then what each provider's first use costs."""
+    from startup_profile import print_breakdown
+
+    phases = []
+    for provider, get_client in PROVIDER_CLIENTS:
+        if not CONFIG[f"{provider}_api_key"]:
+            continue
+        started = time.perf_counter()
+        try:
+            get_client()
+        except Exception as exc:
+            print(f"[WARN] Could not create the {provider} client: {exc}")
+            continue
+        phases.append((f"first {provider} client (SDK import + client)", time.perf_counter() - started))
+    print_breakdown("app", phases)
 
 
-def create_session(title=None, provider=None, model=None):
-    session_id = str(uuid.uuid4())
+def new_session(title=None, provider=None, model=None, messages=None, created_at=None, updated_at=None):
     now = iso_now()
-    session_title = title or "New Chat"
-    sessions[session_id] = {
-        "id": session_id,
-        "title": session_title,
+    return {
+        "id": str(uuid.uuid4()),
+        "title": title or "New Chat",
         "provider": provider or CONFIG["default_provider"],
         "model": model or CONFIG["default_model"],
-        "created_at": now,
-        "updated_at": now,
-        "messages": [],
+        "created_at": created_at or now,
+        "updated_at": updated_at or now,
+        "messages": messages or [],
     }
-    return sessions[session_id]
 
 
-def list_sessions():
-    return sorted(
-        sessions.values(),
-        key=lambda item: item["updated_at"],
-        reverse=True,
-    )
+def create_session(**fields):
+    return store.create(new_session(**fields))
 
 
-def session_summary(session):
-    return {
-        "id": session["id"],
-        "title": session["title"],
-        "provider": session["provider"],
-        "model": session["model"],
-        "created_at": session["created_at"],
-        "updated_at": session["updated_at"],
-        "message_count": len(session["messages"]),
-    }
+def ensure_session():
+    # Several workers may find the store empty at once; only one of them creates the session.
+    store.create_if_empty(new_session())
+
+
+def archived(session):
+    return {key: value for key, value in session.items() if key != "revision"}
+
+
+def list_sessions():
+    return store.list_sessions()
 
 
 def normalize_messages(messages):
@@ -158,18 +330,57 @@ def normalize_messages(messages):
     return normalized
 
 
+def message_tokens(msg, provider):
+    counts = msg.get("token_count")
+    if not isinstance(counts, dict):
+        counts = msg["token_count"] = {}
+    if provider not in counts:
+        counts[provider] = count_tokens(msg.get("content"), provider) + MESSAGE_OVERHEAD_TOKENS
+    return counts[provider]
+
+
+def context_budget(turn):
+    model = turn["model"].lower()
+    window = next(
+        (size for prefix, size in MODEL_CONTEXT_WINDOWS if model.startswith(prefix)),
+        DEFAULT_CONTEXT_WINDOW,
+    )
+    prompt_tokens = count_tokens(turn["message"], turn["provider"]) + MESSAGE_OVERHEAD_TOKENS
+    available = window - turn["max_tokens"] - prompt_tokens
+    return max(0, min(CONFIG["context_token_budget"], available))
+
+
+def build_context(messages, budget, provider):
+    """Pick the newest messages that fit in ``budget`` tokens, returned oldest first."""
+    selected = []
+    used = 0
+    for msg in reversed(messages):
+        cost = message_tokens(msg, provider)
+        if used + cost > budget:
+            break
+        selected.append(msg)
+        used += cost
+    selected.reverse()
+    # Providers expect the conversation to open with a user turn.
+    while selected and selected[0]["role"] != "user":
+        selected.pop(0)
+    return selected
+
+
 def build_google_contents(history, user_text, file_part):
+    from google.genai import types
+
     contents = []
     for msg in history:
         role = "user" if msg["role"] == "user" else "model"
         contents.append(types.Content(
             role=role,
-            parts=[types.Part.from_text(msg["content"])]
+            parts=[types.Part.from_text(text=msg["content"])]
         ))
 
     parts = []
     if user_text:
-        parts.append(types.Part.from_text(user_text))
+        parts.append(types.Part.from_text(text=user_text))
     if file_part:
         parts.append(file_part)
     if parts:
@@ -210,8 +421,1017 @@ def maybe_autotitle(session, user_message):
     session["title"] = " ".join(words[:6])
 
 
-sessions = {}
-create_session()
+def upload_too_large():
+    limit_mb = CONFIG["upload_max_bytes"] // (1024 * 1024)
+    return {"reply": f"Upload is larger than the {limit_mb} MB limit."}, 413
+
+
+def rate_limited(exc):
+    """429 payload, status and Retry-After header for a request the rate limiter turned away."""
+    retry_after = max(1, math.ceil(exc.retry_after))
+    return {"reply": f"Error: {exc}", "retry_after": retry_after}, 429, {"Retry-After": str(retry_after)}
+
+
+def error_event(exc):
+    event = {"type": "error", "reply": f"Error: {exc}"}
+    if isinstance(exc, RateLimited):
+        event["retry_after"] = max(1, math.ceil(exc.retry_after))
+    return ndjson(event)
+
+
+def upload_mime_type(file_name, declared=None):
+    if declared and declared != "application/octet-stream":
+        return declared
+    return mimetypes.guess_type(file_name)[0] or "application/octet-stream"
+
+
+def attachment_key(digest):
+    # Uploaded files belong to the API key's project, so the account is part of the key.
+    account = f'{CONFIG["google_api_key"]}|{CONFIG["google_base_url"] or ""}'
+    return f"google:{hashlib.sha256(account.encode('utf-8')).hexdigest()[:16]}:{digest}"
+
+
+def attachment_expiry(uploaded):
+    # Reuse a file until an hour before the provider deletes it.
+    if uploaded.expiration_time:
+        return uploaded.expiration_time.timestamp() - 3600
+    return time.time() + CONFIG["attachment_ttl_hours"] * 3600
+
+
+def upload_to_google(file_name, file_stream, mime_type=None, model=""):
+    """Send an already-parsed upload stream to the Gemini Files API without copying it to disk.
+
+    Files already uploaded with the same content are reused from the attachment cache.
+    """
+    from google.genai import types
+
+    started = time.perf_counter()
+    key = None
+    if attachment_cache is not None:
+        key = attachment_key(file_digest(file_stream))
+        cached = attachment_cache.get(key)
+        if cached:
+            upload_seconds.observe(time.perf_counter() - started, "google", model, "hit")
+            return types.Part.from_uri(file_uri=cached["uri"], mime_type=cached["mime_type"])
+
+    uploaded = get_google_client().files.upload(
+        file=file_stream,
+        config=types.UploadFileConfig(
+            mime_type=upload_mime_type(file_name, mime_type),
+            display_name=file_name,
+        ),
+    )
+    mime_type = uploaded.mime_type or "application/octet-stream"
+    if key:
+        attachment_cache.put(
+            key,
+            uploaded.name,
+            uploaded.uri,
+            mime_type,
+            uploaded.size_bytes or 0,
+            attachment_expiry(uploaded),
+        )
+    upload_seconds.observe(time.perf_counter() - started, "google", model, "miss" if key else "off")
+    return types.Part.from_uri(file_uri=uploaded.uri, mime_type=mime_type)
+
+
+def stream_size(stream):
+    """Size of a seekable upload stream (spooled in memory or on disk), or None."""
+    try:
+        position = stream.tell()
+        size = stream.seek(0, os.SEEK_END)
+        stream.seek(position)
+        return size
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def parse_chat_turn(form, file_name=None, file_stream=None, file_type=None):
+    """Validate a /chat form and upload any attachment.
+
+    Returns ``(turn, None)`` on success or ``(None, (payload, status))``.
+    """
+    session_id = form.get("session_id")
+    with span("session"):
+        session = store.get(session_id) if session_id else None
+        if not session:
+            session = create_session()
+
+    provider = (form.get("provider") or session["provider"]).strip()
+    if not provider:
+        provider = CONFIG["default_provider"]
+    if provider not in PROVIDERS:
+        return None, ({"reply": "Unknown provider selected."}, 400)
+    if provider == "google" and not CONFIG["google_api_key"]:
+        return None, ({"reply": "GOOGLE_API_KEY is not configured."}, 400)
+
+    model_name = (form.get("model") or session["model"]).strip() or FALLBACK_MODELS.get(
+        provider, CONFIG["default_model"]
+    )
+    user_message = form.get("message", "").strip()
+
+    if not user_message and not file_name:
+        return None, ({"reply": "Please enter a message or attach a file."}, 400)
+
+    file_part = None
+    if file_name:
+        if provider != "google":
+            return None, ({"reply": "File uploads are only supported for Google GenAI."}, 400)
+
+        try:
+            with span("upload", bytes=stream_size(file_stream)):
+                file_part = upload_to_google(file_name, file_stream, file_type, model_name)
+        except Exception as exc:
+            record_error(provider, model_name, "upload", exc)
+            return None, ({"reply": f"Failed to process file: {exc}"}, 400)
+
+    return {
+        "session": session,
+        "provider": provider,
+        "model": model_name,
+        "openai_base_url": (form.get("openai_base_url") or "").strip(),
+        "message": user_message,
+        "file_name": file_name,
+        "file_part": file_part,
+        "temperature": parse_float(form.get("temperature"), 0.7, 0.0, 2.0),
+        "top_p": parse_float(form.get("top_p"), 0.8, 0.0, 1.0),
+        "top_k": parse_int(form.get("top_k"), 40, 1, 100),
+        "max_tokens": parse_int(form.get("max_tokens"), 1024, 1, 4096),
+        "stream": form.get("stream") in ("1", "true"),
+        "cache": (form.get("cache") or "").strip().lower(),
+        "received_at": datetime.utcnow(),
+    }, None
+
+
+def attempt_timeout():
+    """Per-call SDK timeout while routing is on, so abandoned attempts do not run forever."""
+    return router.timeout if router.enabled else None
+
+
+def attempt_client(client, turn):
+    # A routed attempt with another backend behind it moves on instead of retrying
+    # in the SDK; with the rate limiter on, limited_call does the retrying.
+    if turn.get("fallback") or rate_limiter.enabled:
+        return client.with_options(max_retries=0)
+    return client
+
+
+def build_generation_config(turn):
+    from google.genai import types
+
+    timeout = attempt_timeout()
+    return types.GenerateContentConfig(
+        temperature=turn["temperature"],
+        top_p=turn["top_p"],
+        top_k=turn["top_k"],
+        max_output_tokens=turn["max_tokens"],
+        http_options=types.HttpOptions(timeout=int(timeout * 1000)) if timeout else None,
+    )
+
+
+def google_usage(usage_metadata):
+    if not usage_metadata:
+        return None
+    return {
+        "prompt": getattr(usage_metadata, "prompt_token_count", None),
+        "output": getattr(usage_metadata, "candidates_token_count", None),
+        "total": getattr(usage_metadata, "total_token_count", None),
+    }
+
+
+def openai_usage(usage):
+    if not usage:
+        return None
+    return {
+        "prompt": getattr(usage, "prompt_tokens", None),
+        "output": getattr(usage, "completion_tokens", None),
+        "total": getattr(usage, "total_tokens", None),
+    }
+
+
+def anthropic_usage(usage):
+    if not usage:
+        return None
+    return {
+        "prompt": getattr(usage, "input_tokens", None),
+        "output": getattr(usage, "output_tokens", None),
+        "total": (getattr(usage, "input_tokens", 0) or 0) + (getattr(usage, "output_tokens", 0) or 0),
+    }
+
+
+def google_request(turn, history):
+    with span("messages"):
+        return {
+            "model": turn["model"],
+            "contents": build_google_contents(history, turn["message"], turn["file_part"]),
+            "config": build_generation_config(turn),
+        }
+
+
+def openai_request(turn, history):
+    with span("messages"):
+        kwargs = {
+            "model": turn["model"],
+            "messages": build_openai_messages(history, turn["message"]),
+            "temperature": turn["temperature"],
+            "top_p": turn["top_p"],
+            "max_tokens": turn["max_tokens"],
+        }
+    if attempt_timeout():
+        kwargs["timeout"] = attempt_timeout()
+    return kwargs
+
+
+def anthropic_request(turn, history):
+    with span("messages"):
+        kwargs = {
+            "model": turn["model"],
+            "max_tokens": turn["max_tokens"],
+            "temperature": turn["temperature"],
+            "top_p": turn["top_p"],
+            "messages": build_anthropic_messages(history, turn["message"]),
+        }
+    if attempt_timeout():
+        kwargs["timeout"] = attempt_timeout()
+    return kwargs
+
+
+def google_reply(response):
+    reply = response.text.strip() if response.text else ""
+    return reply or "No response generated.", google_usage(getattr(response, "usage_metadata", None))
+
+
+def openai_reply(response):
+    reply = (response.choices[0].message.content or "").strip()
+    return reply or "No response generated.", openai_usage(response.usage)
+
+
+def anthropic_reply(response):
+    reply = "".join(block.text for block in response.content if block.type == "text").strip()
+    return reply or "No response generated.", anthropic_usage(response.usage)
+
+
+def openai_chunk_text(chunk):
+    if chunk.choices and chunk.choices[0].delta.content:
+        return chunk.choices[0].delta.content
+    return None
+
+
+def generate_reply(turn, history):
+    """Run one blocking generation and return (reply, usage)."""
+    provider = turn["provider"]
+    if provider == "google":
+        kwargs = google_request(turn, history)
+        with span("provider"):
+            response = get_google_client().models.generate_content(**kwargs)
+        with span("usage"):
+            return google_reply(response)
+    if provider == "openai":
+        client = attempt_client(get_openai_client(base_url=turn["openai_base_url"] or None), turn)
+        kwargs = openai_request(turn, history)
+        with span("provider"):
+            response = client.chat.completions.create(**kwargs)
+        with span("usage"):
+            return openai_reply(response)
+    client = attempt_client(get_anthropic_client(), turn)
+    kwargs = anthropic_request(turn, history)
+    with span("provider"):
+        response = client.messages.create(**kwargs)
+    with span("usage"):
+        return anthropic_reply(response)
+
+
+def stream_reply(turn, history):
+    """Yield ("delta", text) events as the provider produces them, then one ("usage", usage) event."""
+    provider = turn["provider"]
+    if provider == "google":
+        usage = None
+        for chunk in get_google_client().models.generate_content_stream(**google_request(turn, history)):
+            if chunk.text:
+                yield "delta", chunk.text
+            usage = google_usage(getattr(chunk, "usage_metadata", None)) or usage
+        yield "usage", usage
+
+    elif provider == "openai":
+        usage = None
+        client = attempt_client(get_openai_client(base_url=turn["openai_base_url"] or None), turn)
+        with client.chat.completions.create(
+            **openai_request(turn, history),
+            stream=True,
+            stream_options={"include_usage": True},
+        ) as stream:
+            for chunk in stream:
+                text = openai_chunk_text(chunk)
+                if text:
+                    yield "delta", text
+                usage = openai_usage(getattr(chunk, "usage", None)) or usage
+        yield "usage", usage
+
+    else:
+        client = attempt_client(get_anthropic_client(), turn)
+        with client.messages.stream(**anthropic_request(turn, history)) as stream:
+            for text in stream.text_stream:
+                yield "delta", text
+            final_message = stream.get_final_message()
+        yield "usage", anthropic_usage(final_message.usage)
+
+
+async def agenerate_reply(turn, history):
+    """Async counterpart of generate_reply using the SDKs' asyncio clients."""
+    provider = turn["provider"]
+    if provider == "google":
+        kwargs = google_request(turn, history)
+        with span("provider"):
+            response = await get_google_client().aio.models.generate_content(**kwargs)
+        with span("usage"):
+            return google_reply(response)
+    if provider == "openai":
+        client = attempt_client(get_openai_client(base_url=turn["openai_base_url"] or None, use_async=True), turn)
+        kwargs = openai_request(turn, history)
+        with span("provider"):
+            response = await client.chat.completions.create(**kwargs)
+        with span("usage"):
+            return openai_reply(response)
+    client = attempt_client(get_anthropic_client(use_async=True), turn)
+    kwargs = anthropic_request(turn, history)
+    with span("provider"):
+        response = await client.messages.create(**kwargs)
+    with span("usage"):
+        return anthropic_reply(response)
+
+
+async def astream_reply(turn, history):
+    """Async counterpart of stream_reply."""
+    provider = turn["provider"]
+    if provider == "google":
+        usage = None
+        stream = await get_google_client().aio.models.generate_content_stream(**google_request(turn, history))
+        async for chunk in stream:
+            if chunk.text:
+                yield "delta", chunk.text
+            usage = google_usage(getattr(chunk, "usage_metadata", None)) or usage
+        yield "usage", usage
+
+    elif provider == "openai":
+        usage = None
+        client = attempt_client(get_openai_client(base_url=turn["openai_base_url"] or None, use_async=True), turn)
+        async with await client.chat.completions.create(
+            **openai_request(turn, history),
+            stream=True,
+            stream_options={"include_usage": True},
+        ) as stream:
+            async for chunk in stream:
+                text = openai_chunk_text(chunk)
+                if text:
+                    yield "delta", text
+                usage = openai_usage(getattr(chunk, "usage", None)) or usage
+        yield "usage", usage
+
+    else:
+        client = attempt_client(get_anthropic_client(use_async=True), turn)
+        async with client.messages.stream(**anthropic_request(turn, history)) as stream:
+            async for text in stream.text_stream:
+                yield "delta", text
+            final_message = await stream.get_final_message()
+        yield "usage", anthropic_usage(final_message.usage)
+
+
+def backend_configured(provider):
+    return bool(CONFIG[f"{provider}_api_key"])
+
+
+def route_candidates(turn):
+    """The requested provider/model, then the ROUTING_BACKENDS alternates able to serve this turn."""
+    if not router.enabled:
+        return [turn]
+    candidates = [dict(turn)]
+    seen = {(turn["provider"], turn["model"])}
+    for provider, model in CONFIG["routing_backends"]:
+        model = model or FALLBACK_MODELS.get(provider, CONFIG["default_model"])
+        if (provider, model) in seen or provider not in PROVIDERS or not backend_configured(provider):
+            continue
+        # Attachments are Gemini file URIs; other providers cannot read them.
+        if turn["file_part"] and provider != "google":
+            continue
+        seen.add((provider, model))
+        candidates.append({**turn, "provider": provider, "model": model, "openai_base_url": ""})
+    for candidate in candidates[:-1]:
+        candidate["fallback"] = True
+    return candidates
+
+
+def check_admission(turn):
+    """Turn a request away before it takes the session lock if no backend could admit it in time."""
+    if not rate_limiter.enabled:
+        return
+    rejections = []
+    for candidate in route_candidates(turn):
+        try:
+            rate_limiter.check(candidate["provider"], candidate["model"])
+            return
+        except RateLimited as exc:
+            rejections.append(exc)
+    raise min(rejections, key=lambda exc: exc.retry_after)
+
+
+def retry_delay(turn, exc, attempt, deadline):
+    """Seconds to wait before retrying a failed provider attempt; re-raises when it should not be retried.
+
+    An upstream 429 cools the provider/model down for every request instead, and
+    the next admission waits that out.
+    """
+    provider, model = turn["provider"], turn["model"]
+    if error_status(exc) == 429:
+        delay = backoff_delay(attempt, retry_after_seconds(exc))
+        rate_limiter.throttled(provider, model, delay)
+        if attempt >= rate_limiter.retries:
+            raise RateLimited(f"{provider} is throttling requests: {exc}", delay) from exc
+        return 0.0
+    delay = backoff_delay(attempt)
+    if attempt >= rate_limiter.retries or not is_retryable(exc) or time.monotonic() + delay > deadline:
+        raise exc
+    return delay
+
+
+def limited_call(turn, call):
+    """Run one provider attempt for ``turn`` once the rate limiter admits it, retrying transient errors."""
+    if not rate_limiter.enabled:
+        return call()
+    deadline = time.monotonic() + rate_limiter.max_wait
+    for attempt in range(rate_limiter.retries + 1):
+        with span("admission"):
+            rate_limiter.acquire(turn["provider"], turn["model"], deadline)
+        try:
+            return call()
+        except Exception as exc:
+            delay = retry_delay(turn, exc, attempt, deadline)
+        time.sleep(delay)
+
+
+async def alimited_call(turn, call):
+    """Async ``limited_call``; ``call`` is a coroutine function."""
+    if not rate_limiter.enabled:
+        return await call()
+    deadline = time.monotonic() + rate_limiter.max_wait
+    for attempt in range(rate_limiter.retries + 1):
+        with span("admission"):
+            await rate_limiter.aacquire(turn["provider"], turn["model"], deadline)
+        try:
+            return await call()
+        except Exception as exc:
+            delay = retry_delay(turn, exc, attempt, deadline)
+        await asyncio.sleep(delay)
+
+
+def note_backend(turn, backend):
+    if (backend["provider"], backend["model"]) != (turn["provider"], turn["model"]):
+        turn["served_by"] = {"provider": backend["provider"], "model": backend["model"]}
+        current_trace().annotate(served_by=turn["served_by"])
+
+
+def routed_reply(turn, history):
+    """generate_reply under the routing policy (a plain call when ROUTING is off)."""
+    backend, result = router.run(
+        route_candidates(turn),
+        lambda candidate: limited_call(candidate, lambda: generate_reply(candidate, history)),
+    )
+    note_backend(turn, backend)
+    return result
+
+
+def routed_stream(turn, history):
+    """stream_reply under the routing policy.
+
+    Attempts race to their first event; once text has reached the client the
+    winning stream is relayed to the end, with no further failover.
+    """
+    def open_stream(candidate):
+        def attempt():
+            events = stream_reply(candidate, history)
+            return next(events), events
+
+        return limited_call(candidate, attempt)
+
+    backend, (first, events) = router.run(
+        route_candidates(turn), open_stream, discard=lambda opened: opened[1].close()
+    )
+    note_backend(turn, backend)
+    yield first
+    yield from events
+
+
+async def arouted_reply(turn, history):
+    backend, result = await router.arun(
+        route_candidates(turn),
+        lambda candidate: alimited_call(candidate, lambda: agenerate_reply(candidate, history)),
+    )
+    note_backend(turn, backend)
+    return result
+
+
+async def arouted_stream(turn, history):
+    async def open_stream(candidate):
+        async def attempt():
+            events = astream_reply(candidate, history)
+            return await events.__anext__(), events
+
+        return await alimited_call(candidate, attempt)
+
+    async def discard(opened):
+        await opened[1].aclose()
+
+    backend, (first, events) = await router.arun(route_candidates(turn), open_stream, discard=discard)
+    note_backend(turn, backend)
+    yield first
+    async for event in events:
+        yield event
+
+
+def response_cache_key(turn, history):
+    """Hash everything that shapes the reply, with whitespace collapsed in message text."""
+    def text(value):
+        return " ".join((value or "").split())
+
+    payload = {
+        "provider": turn["provider"],
+        "model": turn["model"],
+        "base_url": turn["openai_base_url"] if turn["provider"] == "openai" else "",
+        "params": [turn["temperature"], turn["top_p"], turn["top_k"], turn["max_tokens"]],
+        "context": [[msg["role"], text(msg["content"])] for msg in history],
+        "message": text(turn["message"]),
+    }
+    encoded = json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def use_response_cache(turn):
+    # Sampled replies differ run to run, so only greedy requests are cached unless the
+    # client sends cache=force. Attachments are never cached.
+    if response_cache is None or turn["file_part"] is not None or turn["cache"] == "off":
+        return False
+    return turn["temperature"] == 0 or turn["cache"] == "force"
+
+
+def lookup_cached_reply(turn, history):
+    """Return ``(key, hit)``: ``key`` is None when the cache does not apply and
+    ``hit`` is ``(reply, usage)`` with usage flagged ``cached`` on a hit."""
+    if response_cache is None:
+        return None, None
+    if not use_response_cache(turn):
+        cache_stats["bypassed"] += 1
+        return None, None
+    key = response_cache_key(turn, history)
+    hit = response_cache.get(key)
+    if hit is None:
+        return key, None
+    reply, usage = hit
+    return key, (reply, {**(usage or {}), "cached": True})
+
+
+def store_cached_reply(key, reply, usage):
+    if key and reply != "No response generated.":
+        response_cache.put(key, reply, usage)
+
+
+def replay_cached_reply(reply, usage):
+    yield "delta", reply
+    yield "usage", usage
+
+
+async def areplay_cached_reply(reply, usage):
+    yield "delta", reply
+    yield "usage", usage
+
+
+def commit_turn(session, turn, reply, usage):
+    if not usage:
+        usage = {
+            "prompt": count_tokens(turn["message"], turn["provider"]),
+            "output": count_tokens(reply, turn["provider"]),
+            "total": None,
+            "estimated": True,
+        }
+
+    new_messages = [
+        {
+            "role": "user",
+            "content": turn["message"],
+            "timestamp": iso_now(),
+            "file": turn["file_name"],
+        },
+        {
+            "role": "assistant",
+            "content": reply,
+            "timestamp": iso_now(),
+            "tokens": usage,
+        },
+    ]
+    for msg in new_messages:
+        message_tokens(msg, turn["provider"])
+    session["messages"].extend(new_messages)
+    session["provider"] = turn["provider"]
+    session["model"] = turn["model"]
+    session["updated_at"] = iso_now()
+    for attempt in range(1, COMMIT_ATTEMPTS + 1):
+        maybe_autotitle(session, turn["message"])
+        try:
+            # The last attempt is unconditional so the turn is never dropped.
+            version = store.append_messages(
+                session["id"],
+                new_messages,
+                expected_revision=session["revision"] if attempt < COMMIT_ATTEMPTS else None,
+                title=session["title"],
+                provider=session["provider"],
+                model=session["model"],
+                updated_at=session["updated_at"],
+            )
+            break
+        except SessionConflict:
+            # Another request (a turn in another worker, a rename, a clear) wrote
+            # the session after this one read it. Its messages stay where they
+            # are and ours go after them; take its header so a new title is kept.
+            current = store.get_summary(session["id"])
+            if current is None:
+                raise RuntimeError("Session was deleted.")
+            session["title"] = current["title"]
+            session["revision"] = current["revision"]
+    if version is None:
+        raise RuntimeError("Session was deleted.")
+    session["message_count"] = version
+    return usage
+
+
+def public_message(seq, msg):
+    message = {key: value for key, value in msg.items() if key != "token_count"}
+    message["seq"] = seq
+    return message
+
+
+def chat_payload(session, turn, reply, usage):
+    """Describe a committed turn as a delta: the two new messages and the session's new version."""
+    version = session["message_count"]
+    new_messages = session["messages"][-2:]
+    first_seq = version - len(new_messages)
+    payload = {
+        "reply": reply,
+        "file_preview": turn["file_name"],
+        "session_id": session["id"],
+        "session": summarize(session, version),
+        "messages": [public_message(first_seq + offset, msg) for offset, msg in enumerate(new_messages)],
+        "version": version,
+        "usage": usage,
+    }
+    if turn.get("served_by"):
+        payload["served_by"] = turn["served_by"]
+    return payload
+
+
+class SessionBusy(RuntimeError):
+    pass
+
+
+def lock_session(session_id):
+    """Wait for the session's turn lock (shared by all workers); return the owner token."""
+    owner = uuid.uuid4().hex
+    deadline = time.monotonic() + CONFIG["session_lock_timeout"]
+    delay = LOCK_POLL_SECONDS
+    waited = False
+    while not store.try_lock(session_id, owner, LOCK_LEASE_SECONDS):
+        if time.monotonic() >= deadline:
+            turn_stats["lock_timeouts"] += 1
+            raise SessionBusy("Another reply is still being generated for this chat.")
+        waited = True
+        time.sleep(delay)
+        delay = min(delay * 2, 0.5)
+    if waited:
+        turn_stats["serialized"] += 1
+    return owner
+
+
+def refresh_turn(turn):
+    """Bring ``turn["session"]`` up to date once its lock is held.
+
+    Returns the payload of an earlier turn for this same message that was still
+    in flight when this request arrived (a double submit, or the same message
+    from a second tab), in which case no new generation is needed. A message sent
+    again after its reply was saved is a new turn, however soon it follows.
+    """
+    session = turn["session"]
+    current = store.get_summary(session["id"])
+    if current is None:
+        raise RuntimeError("Session was deleted.")
+    if current["revision"] != session["revision"]:
+        session = store.get(session["id"])
+        if session is None:
+            raise RuntimeError("Session was deleted.")
+        turn["session"] = session
+
+    if CONFIG["coalesce"] == "off":
+        return None
+    messages = session["messages"]
+    for index in range(len(messages) - 2, -1, -1):
+        user_msg, reply_msg = messages[index], messages[index + 1]
+        if user_msg.get("role") != "user" or reply_msg.get("role") != "assistant":
+            continue
+        # Messages are stamped when the turn is saved, so a turn saved after this
+        # request arrived was being generated alongside it; older ones were not.
+        saved_at = parse_iso(user_msg.get("timestamp"))
+        try:
+            if saved_at is None or saved_at < turn["received_at"]:
+                return None
+        except TypeError:
+            return None
+        if user_msg.get("content") == turn["message"] and user_msg.get("file") == turn["file_name"]:
+            break
+    else:
+        return None
+    turn_stats["coalesced"] += 1
+    session["message_count"] = len(messages)
+    payload = chat_payload(session, turn, reply_msg["content"], reply_msg.get("tokens"))
+    payload["messages"] = [public_message(index, user_msg), public_message(index + 1, reply_msg)]
+    payload["coalesced"] = True
+    return payload
+
+
+STREAM_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def ndjson(event):
+    return json.dumps(event) + "\n"
+
+
+def trace_provider_stream(trace, started, first_token_at):
+    """Record a streamed provider call as one span; its time to first token is an attribute."""
+    ttft_ms = round((first_token_at - started) * 1000, 3) if first_token_at else None
+    trace.add("provider", started, time.perf_counter(), stream=True, ttft_ms=ttft_ms)
+
+
+class ChatTurn:
+    """The steps of one /chat turn, shared by the Flask app and ``asgi.py``.
+
+    The front ends hold the session lock, call the blocking steps (from a worker
+    thread under asyncio), drive the provider call and turn the outcome into a
+    response; the context, cache, commit, metrics and tracing all happen here.
+    ``stage`` names the step in progress, for error reporting.
+    """
+
+    def __init__(self, turn, started, trace):
+        self.turn = turn
+        self.started = started
+        self.trace = trace
+        self.stage = "lock"
+        self.session = None
+        self.history = None
+        self.cache_key = None
+        self.cached = None
+        self.generation_started = None
+        self.first_token_at = None
+        self.parts = []
+        self.usage = None
+
+    def prepare(self):
+        """Refresh the session, build the context and look up the cache; the lock must be held.
+
+        Returns the payload of a coalesced duplicate, or None if a reply is needed.
+        """
+        self.stage = "context"
+        with span("context"):
+            duplicate = refresh_turn(self.turn)
+            if duplicate:
+                return duplicate
+            self.session = self.turn["session"]
+            self.history = build_context(self.session["messages"], context_budget(self.turn), self.turn["provider"])
+        with span("cache"):
+            self.cache_key, self.cached = lookup_cached_reply(self.turn, self.history)
+        self.stage = "generate"
+        self.generation_started = time.perf_counter()
+        return None
+
+    def events(self):
+        return replay_cached_reply(*self.cached) if self.cached else routed_stream(self.turn, self.history)
+
+    def aevents(self):
+        return areplay_cached_reply(*self.cached) if self.cached else arouted_stream(self.turn, self.history)
+
+    def receive(self, kind, value):
+        """Take one streamed event; return the NDJSON line to send for it, if any."""
+        if kind != "delta":
+            self.usage = value
+            return None
+        self.first_token_at = self.first_token_at or time.perf_counter()
+        self.parts.append(value)
+        return ndjson({"type": "delta", "text": value})
+
+    def streamed_reply(self):
+        reply = "".join(self.parts).strip() or "No response generated."
+        if not self.cached:
+            trace_provider_stream(self.trace, self.generation_started, self.first_token_at)
+            observe_generation(self.turn, self.generation_started, reply, self.usage, self.first_token_at)
+        return reply, self.usage
+
+    def generated(self, reply, usage):
+        """Record a blocking provider call that returned ``reply``."""
+        observe_generation(self.turn, self.generation_started, reply, usage)
+        return reply, usage
+
+    def commit(self, reply, usage):
+        """Save the turn and cache the reply; return the response payload. The lock must be held."""
+        self.stage = "commit"
+        with span("commit"):
+            usage = commit_turn(self.session, self.turn, reply, usage)
+        # A reply from an alternate backend must not answer later requests for this model.
+        if not self.cached and not self.turn.get("served_by"):
+            with span("cache_store"):
+                store_cached_reply(self.cache_key, reply, usage)
+        with span("serialize"):
+            return chat_payload(self.session, self.turn, reply, usage)
+
+    def finish(self, coalesced=False):
+        outcome = "coalesced" if coalesced else "cached" if self.cached else "generated"
+        finish_chat(self.turn, self.started, outcome)
+
+    def fail(self, exc):
+        record_error(self.turn.get("provider"), self.turn.get("model"), self.stage, exc)
+
+
+def coalesced_events(duplicate):
+    return [ndjson({"type": "delta", "text": duplicate["reply"]}), ndjson({"type": "done", **duplicate})]
+
+
+def stream_chat_response(turn, started, trace):
+    """Relay provider deltas as NDJSON lines, then commit the finished turn.
+
+    The session lock is taken inside the generator so it is always released
+    by the generator's ``finally``, even if the client goes away.
+    """
+    def generate():
+        chat_turn = ChatTurn(turn, started, trace)
+        owner = None
+        with tracer.activate(trace):
+            try:
+                with span("lock"):
+                    owner = lock_session(turn["session"]["id"])
+                duplicate = chat_turn.prepare()
+                if duplicate:
+                    yield from coalesced_events(duplicate)
+                    chat_turn.finish(coalesced=True)
+                    return
+                for kind, value in chat_turn.events():
+                    line = chat_turn.receive(kind, value)
+                    if line:
+                        yield line
+                payload = chat_turn.commit(*chat_turn.streamed_reply())
+                yield ndjson({"type": "done", **payload})
+                chat_turn.finish()
+            except Exception as exc:
+                chat_turn.fail(exc)
+                yield error_event(exc)
+            finally:
+                if owner:
+                    store.unlock(turn["session"]["id"], owner)
+                tracer.finish(trace, status=200)
+
+    return Response(generate(), mimetype="application/x-ndjson", headers=STREAM_HEADERS)
+
+
+metrics = Registry(enabled=CONFIG["metrics"] != "off", directory=CONFIG["metrics_dir"])
+chat_seconds = metrics.histogram(
+    "chatbot_chat_duration_seconds",
+    "Time to answer a /chat request, including our own work around the provider call.",
+    ("provider", "model", "mode"),
+    LATENCY_BUCKETS,
+)
+upstream_seconds = metrics.histogram(
+    "chatbot_upstream_latency_seconds",
+    "Provider call duration, from sending the request to the last token.",
+    ("provider", "model", "mode"),
+    LATENCY_BUCKETS,
+)
+first_token_seconds = metrics.histogram(
+    "chatbot_time_to_first_token_seconds",
+    "Streaming provider calls: time until the first text delta.",
+    ("provider", "model"),
+    TTFT_BUCKETS,
+)
+token_rate = metrics.histogram(
+    "chatbot_output_tokens_per_second",
+    "Output tokens per second of generation (after the first token when streaming).",
+    ("provider", "model"),
+    TOKEN_RATE_BUCKETS,
+)
+request_bytes = metrics.histogram(
+    "chatbot_request_size_bytes",
+    "Size of /chat request bodies, attachments included.",
+    ("provider", "model"),
+    SIZE_BUCKETS,
+)
+upload_seconds = metrics.histogram(
+    "chatbot_upload_duration_seconds",
+    "Time to hash and upload an attachment; cache is hit, miss or off.",
+    ("provider", "model", "cache"),
+    LATENCY_BUCKETS,
+)
+chat_requests = metrics.counter(
+    "chatbot_chat_requests_total",
+    "/chat requests by outcome: generated, cached, coalesced or error.",
+    ("provider", "model", "outcome"),
+)
+chat_errors = metrics.counter(
+    "chatbot_errors_total",
+    "Errors returned as an \"Error: ...\" reply, by stage and exception type.",
+    ("provider", "model", "stage", "error"),
+)
+backend_failures = metrics.counter(
+    "chatbot_backend_failures_total",
+    "Routed provider attempts that failed or timed out, by backend and exception type.",
+    ("provider", "model", "error"),
+)
+metrics.gauge("chatbot_sessions", "Sessions in the session store.", lambda: store.count())
+
+tracer = Tracer(
+    enabled=CONFIG["tracing"] != "off",
+    server_timing=CONFIG["trace_server_timing"] != "off",
+    control_file=CONFIG["trace_control_file"],
+    log_file=CONFIG["trace_log"],
+)
+
+router = Router(
+    mode=CONFIG["routing"],
+    timeout=CONFIG["routing_timeout"],
+    hedge_after=CONFIG["hedge_after"],
+    on_failure=lambda candidate, exc: backend_failures.inc(
+        candidate["provider"], candidate["model"], type(exc).__name__
+    ),
+)
+
+rate_limiter = RateLimiter(
+    enabled=CONFIG["rate_limit"] != "off",
+    limits=CONFIG["rate_limits"],
+    max_wait=CONFIG["rate_limit_max_wait"],
+    max_queue=CONFIG["rate_limit_queue"],
+    retries=CONFIG["rate_limit_retries"],
+)
+
+
+def record_error(provider, model, stage, exc):
+    provider, model = provider or "unknown", model or "unknown"
+    current_trace().annotate(outcome="error", stage=stage, error=type(exc).__name__)
+    chat_errors.inc(provider, model, stage, type(exc).__name__)
+    chat_requests.inc(provider, model, "error")
+
+
+def observe_generation(turn, started, reply, usage, first_token_at=None):
+    """Record latency, time to first token and output rate of one provider call.
+
+    Its tokens are also charged to the backend's tokens-per-minute budget.
+    """
+    now = time.perf_counter()
+    served = turn.get("served_by") or turn
+    provider, model = served["provider"], served["model"]
+    upstream_seconds.observe(now - started, provider, model, "stream" if first_token_at else "blocking")
+    generating = now - started
+    if first_token_at:
+        first_token_seconds.observe(first_token_at - started, provider, model)
+        generating = now - first_token_at
+    output_tokens = (usage or {}).get("output") or count_tokens(reply, provider)
+    if generating > 0 and output_tokens:
+        token_rate.observe(output_tokens / generating, provider, model)
+    rate_limiter.charge(provider, model, (usage or {}).get("total") or output_tokens)
+
+
+def finish_chat(turn, started, outcome):
+    mode = "stream" if turn["stream"] else "blocking"
+    current_trace().annotate(outcome=outcome)
+    chat_seconds.observe(time.perf_counter() - started, turn["provider"], turn["model"], mode)
+    chat_requests.inc(turn["provider"], turn["model"], outcome)
+
+
+store = open_session_store(CONFIG["session_store"], CONFIG["session_db"])
+response_cache = open_response_cache(
+    CONFIG["response_cache"],
+    CONFIG["response_cache_db"],
+    max_entries=CONFIG["response_cache_size"],
+    ttl=CONFIG["response_cache_ttl"],
+)
+cache_stats = {"bypassed": 0}
+turn_stats = {"serialized": 0, "coalesced": 0, "lock_timeouts": 0}
+attachment_cache = None
+if CONFIG["attachment_cache"] != "off":
+    attachment_cache = AttachmentCache(CONFIG["attachment_cache_db"])
+ensure_session()
+
+
+def create_app():
+    """WSGI factory for production servers, e.g. ``gunicorn -c gunicorn.conf.py "app:create_app()"``.
+
+    Sessions, cached replies and attachment URIs are kept in SQLite, so every
+    worker process sees the same state; clients and config are per process.
+    """
+    if CONFIG["session_store"] == "memory":
+        print("[WARN] SESSION_STORE=memory is per process; use sqlite when running more than one worker.")
+    metrics.start()
+    start_warm_up()
+    return app
 
 
 @app.route("/")
@@ -223,7 +1443,7 @@ def index():
 def get_sessions():
     sessions_list = list_sessions()
     return jsonify({
-        "sessions": [session_summary(item) for item in sessions_list],
+        "sessions": sessions_list,
         "active_session_id": sessions_list[0]["id"] if sessions_list else None,
     })
 
@@ -241,15 +1461,36 @@ def create_session_route():
 
 @app.route("/sessions/<session_id>", methods=["GET"])
 def get_session_route(session_id):
-    session = sessions.get(session_id)
+    session = store.get(session_id)
     if not session:
         return jsonify({"error": "Session not found."}), 404
     return jsonify(session)
 
 
+@app.route("/sessions/<session_id>/messages", methods=["GET"])
+def get_session_messages(session_id):
+    summary = store.get_summary(session_id)
+    if not summary:
+        return jsonify({"error": "Session not found."}), 404
+    before = parse_int(request.args.get("before"), None, 0, MAX_SEQ)
+    since = parse_int(request.args.get("since"), None, 0, MAX_SEQ)
+    limit = parse_int(request.args.get("limit"), MESSAGE_PAGE_SIZE, 1, MAX_MESSAGE_PAGE_SIZE)
+    # Fetch one extra message to learn whether older history remains.
+    messages = store.get_messages(session_id, before=before, since=since, limit=limit + 1) or []
+    has_more = len(messages) > limit
+    if has_more:
+        messages = messages[1:]
+    return jsonify({
+        "session": summary,
+        "messages": [public_message(seq, msg) for seq, msg in messages],
+        "version": summary["message_count"],
+        "has_more": has_more,
+    })
+
+
 @app.route("/sessions/<session_id>/rename", methods=["POST"])
 def rename_session(session_id):
-    session = sessions.get(session_id)
+    session = store.get_summary(session_id)
     if not session:
         return jsonify({"error": "Session not found."}), 404
     data = request.get_json(silent=True) or {}
@@ -257,262 +1498,283 @@ def rename_session(session_id):
     if title:
         session["title"] = title
         session["updated_at"] = iso_now()
+        store.update(session_id, title=title, updated_at=session["updated_at"])
     return jsonify(session)
 
 
 @app.route("/sessions/<session_id>", methods=["DELETE"])
 def delete_session(session_id):
-    session = sessions.pop(session_id, None)
-    if not session:
+    if not store.delete(session_id):
         return jsonify({"error": "Session not found."}), 404
-    if not sessions:
-        create_session()
+    ensure_session()
     return jsonify({
         "status": "deleted",
-        "sessions": [session_summary(item) for item in list_sessions()],
+        "sessions": list_sessions(),
     })
 
 
 @app.route("/sessions/<session_id>/clear", methods=["POST"])
 def clear_session(session_id):
-    session = sessions.get(session_id)
+    session = store.get_summary(session_id)
     if not session:
         return jsonify({"error": "Session not found."}), 404
     session["messages"] = []
+    session["message_count"] = 0
     session["updated_at"] = iso_now()
+    store.clear_messages(session_id, updated_at=session["updated_at"])
     return jsonify(session)
 
 
 @app.route("/sessions/<session_id>/export", methods=["GET"])
 def export_session(session_id):
-    session = sessions.get(session_id)
+    session = store.get(session_id)
     if not session:
         return jsonify({"error": "Session not found."}), 404
     return jsonify({
         "version": "v3",
-        "sessions": [session],
+        "sessions": [archived(session)],
     })
 
 
 @app.route("/sessions/export", methods=["GET"])
 def export_all_sessions():
-    return jsonify({
-        "version": "v3",
-        "sessions": list_sessions(),
-    })
-
+    # One session is loaded and serialized at a time, however large the archive.
+    sessions = (store.get(item["id"]) for item in list_sessions())
+    sessions = (archived(session) for session in sessions if session)
+    if request.args.get("format") == "ndjson":
+        body, mimetype, filename = export_ndjson(sessions), "application/x-ndjson", "chat-sessions.ndjson"
+    else:
+        body, mimetype, filename = export_json(sessions), "application/json", "chat-sessions.json"
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+    )
 
-@app.route("/sessions/import", methods=["POST"])
-def import_sessions():
-    data = None
-    if "file" in request.files:
-        try:
-            data = request.files["file"].read().decode("utf-8")
-        except Exception as exc:
-            return jsonify({"error": f"Failed to read file: {exc}"}), 400
 
-    if data:
-        try:
-            import json
-            payload = json.loads(data)
-        except Exception as exc:
-            return jsonify({"error": f"Invalid JSON: {exc}"}), 400
-    else:
-        payload = request.get_json(silent=True) or {}
-
-    sessions_data = []
-    if isinstance(payload, dict):
-        if "sessions" in payload:
-            sessions_data = payload.get("sessions") or []
-        elif "messages" in payload:
-            sessions_data = [payload]
-    elif isinstance(payload, list):
-        sessions_data = payload
-
-    if not sessions_data:
-        return jsonify({"error": "No sessions found to import."}), 400
+def import_archive(stream, imported_ids):
+    """Import sessions from an archive stream ``IMPORT_BATCH_SIZE`` at a time.
 
-    imported_ids = []
-    for entry in sessions_data:
+    New ids are appended to ``imported_ids``; yields after each committed batch.
+    """
+    batch = []
+    for entry in iter_archive(stream, CONFIG["import_max_session_bytes"]):
         if not isinstance(entry, dict):
             continue
-        new_session = create_session(
+        batch.append(new_session(
             title=entry.get("title") or "Imported Chat",
             provider=entry.get("provider"),
             model=entry.get("model"),
-        )
-        new_session["messages"] = normalize_messages(entry.get("messages", []))
-        new_session["created_at"] = entry.get("created_at") or iso_now()
-        new_session["updated_at"] = entry.get("updated_at") or iso_now()
-        imported_ids.append(new_session["id"])
+            messages=normalize_messages(entry.get("messages", [])),
+            created_at=entry.get("created_at"),
+            updated_at=entry.get("updated_at"),
+        ))
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            store.create_many(batch)
+            imported_ids.extend(session["id"] for session in batch)
+            batch = []
+            yield
+    if batch:
+        store.create_many(batch)
+        imported_ids.extend(session["id"] for session in batch)
+        yield
 
-    return jsonify({
-        "imported": imported_ids,
-        "sessions": [session_summary(item) for item in list_sessions()],
-    })
 
+def import_error(exc, imported_ids):
+    message = f"Invalid archive: {exc}"
+    if imported_ids:
+        message += f" ({len(imported_ids)} sessions were imported before the error)"
+    return {"error": message}
 
-@app.route("/chat", methods=["POST"])
-def chat():
-    try:
-        session_id = request.form.get("session_id")
-        session = sessions.get(session_id)
-        if not session:
-            session = create_session()
-            session_id = session["id"]
 
-        provider = (request.form.get("provider") or session["provider"]).strip()
-        if not provider:
-            provider = CONFIG["default_provider"]
-        model_name = (request.form.get("model") or session["model"]).strip()
-        openai_base_url = (request.form.get("openai_base_url") or "").strip()
-
-        user_message = request.form.get("message", "").strip()
-        temperature = parse_float(request.form.get("temperature"), 0.7, 0.0, 2.0)
-        top_p = parse_float(request.form.get("top_p"), 0.8, 0.0, 1.0)
-        top_k = parse_int(request.form.get("top_k"), 40, 1, 100)
-        max_tokens = parse_int(request.form.get("max_tokens"), 1024, 1, 4096)
+@app.route("/sessions/import", methods=["POST"])
+def import_sessions():
+    """Import a v3 JSON or NDJSON archive from an uploaded file or the request body.
 
-        uploaded_file = request.files.get("file")
-        file_part = None
-        file_name = None
+    With ``?progress=1`` the response is NDJSON: a ``progress`` line per committed
+    batch, then a ``done`` (or ``error``) line.
+    """
+    request.max_content_length = CONFIG["import_max_bytes"]
+    imported_ids = []
 
-        if not user_message and (not uploaded_file or uploaded_file.filename == ""):
-            return jsonify({"reply": "Please enter a message or attach a file."}), 400
+    def archive_stream():
+        upload = request.files.get("file")
+        return upload.stream if upload else request.stream
 
-        if uploaded_file and uploaded_file.filename:
-            if provider != "google":
-                return jsonify({"reply": "File uploads are only supported for Google GenAI."}), 400
-
-            file_name = uploaded_file.filename
-            file_extension = Path(file_name).suffix
-            temp_filename = f"{uuid.uuid4()}{file_extension}"
-            temp_file_path = os.path.join(UPLOAD_FOLDER, temp_filename)
-            uploaded_file.save(temp_file_path)
+    if request.args.get("progress") in ("1", "true"):
+        # The body is parsed inside the generator: the view's request context is
+        # closed (and its parsed files with it) before streaming starts.
+        def generate():
             try:
-                if not google_client:
-                    raise RuntimeError("GOOGLE_API_KEY is not configured.")
-                uploaded_gemini_file = google_client.files.upload(path=temp_file_path)
-                mime_type = uploaded_gemini_file.mime_type or "application/octet-stream"
-                file_part = types.Part.from_uri(
-                    uploaded_gemini_file.uri,
-                    mime_type=mime_type,
-                )
-            except Exception as exc:
-                return jsonify({"reply": f"Failed to process file: {exc}"}), 400
-            finally:
-                if os.path.exists(temp_file_path):
-                    os.remove(temp_file_path)
+                for _ in import_archive(archive_stream(), imported_ids):
+                    yield ndjson({"type": "progress", "imported": len(imported_ids)})
+            except ArchiveError as exc:
+                yield ndjson({"type": "error", **import_error(exc, imported_ids)})
+                return
+            if not imported_ids:
+                yield ndjson({"type": "error", "error": "No sessions found to import."})
+                return
+            yield ndjson({"type": "done", "imported": imported_ids, "sessions": list_sessions()})
+
+        return Response(stream_with_context(generate()), mimetype="application/x-ndjson", headers=STREAM_HEADERS)
 
-        history = session["messages"][-MAX_HISTORY_MESSAGES:]
+    try:
+        for _ in import_archive(archive_stream(), imported_ids):
+            pass
+    except ArchiveError as exc:
+        return jsonify(import_error(exc, imported_ids)), 400
+    if not imported_ids:
+        return jsonify({"error": "No sessions found to import."}), 400
 
-        generation_config = types.GenerateContentConfig(
-            temperature=temperature,
-            top_p=top_p,
-            top_k=top_k,
-            max_output_tokens=max_tokens,
-        )
+    return jsonify({
+        "imported": imported_ids,
+        "sessions": list_sessions(),
+    })
 
-        reply = ""
-        usage = None
 
-        if provider == "google":
-            if not google_client:
-                return jsonify({"reply": "GOOGLE_API_KEY is not configured."}), 400
-            model_name = model_name or CONFIG["default_model"]
-            contents = build_google_contents(history, user_message, file_part)
-            response = google_client.models.generate_content(
-                model=model_name,
-                contents=contents,
-                config=generation_config,
-            )
-            reply = response.text.strip() if response.text else "No response generated."
-            usage_metadata = getattr(response, "usage_metadata", None)
-            if usage_metadata:
-                usage = {
-                    "prompt": getattr(usage_metadata, "prompt_token_count", None),
-                    "output": getattr(usage_metadata, "candidates_token_count", None),
-                    "total": getattr(usage_metadata, "total_token_count", None),
-                }
-        elif provider == "openai":
-            if uploaded_file:
-                return jsonify({"reply": "File uploads are not supported for OpenAI compatible providers."}), 400
-            client = get_openai_client(base_url=openai_base_url or None)
-            messages = build_openai_messages(history, user_message)
-            model_name = model_name or "gpt-4o-mini"
-            response = client.chat.completions.create(
-                model=model_name,
-                messages=messages,
-                temperature=temperature,
-                top_p=top_p,
-                max_tokens=max_tokens,
-            )
-            reply = response.choices[0].message.content.strip()
-            if response.usage:
-                usage = {
-                    "prompt": getattr(response.usage, "prompt_tokens", None),
-                    "output": getattr(response.usage, "completion_tokens", None),
-                    "total": getattr(response.usage, "total_tokens", None),
-                }
-        elif provider == "anthropic":
-            if uploaded_file:
-                return jsonify({"reply": "File uploads are not supported for Anthropic."}), 400
-            client = get_anthropic_client()
-            messages = build_anthropic_messages(history, user_message)
-            model_name = model_name or "claude-3-5-sonnet-20241022"
-            response = client.messages.create(
-                model=model_name,
-                max_tokens=max_tokens,
-                temperature=temperature,
-                top_p=top_p,
-                messages=messages,
-            )
-            reply = "".join(block.text for block in response.content if block.type == "text").strip()
-            usage = {
-                "prompt": getattr(response.usage, "input_tokens", None),
-                "output": getattr(response.usage, "output_tokens", None),
-                "total": getattr(response.usage, "input_tokens", 0) + getattr(response.usage, "output_tokens", 0),
-            }
-        else:
-            return jsonify({"reply": "Unknown provider selected."}), 400
+@app.route("/stats", methods=["GET"])
+def stats():
+    return jsonify({
+        "sessions": store.count(),
+        "client_pool": {"size": len(client_pool), "hits": client_pool.hits, "misses": client_pool.misses},
+        "response_cache": {
+            "enabled": response_cache is not None,
+            **cache_stats,
+            **(response_cache.stats() if response_cache is not None else {}),
+        },
+        "attachment_cache": {
+            "enabled": attachment_cache is not None,
+            **(attachment_cache.stats() if attachment_cache is not None else {}),
+        },
+        "turns": turn_stats,
+        "routing": {"mode": router.mode, **router.stats},
+        "rate_limit": {"enabled": rate_limiter.enabled, **rate_limiter.stats},
+    })
 
-        if not usage:
-            usage = {
-                "prompt": estimate_tokens(user_message),
-                "output": estimate_tokens(reply),
-                "total": None,
-            }
 
-        user_entry = {
-            "role": "user",
-            "content": user_message,
-            "timestamp": iso_now(),
-            "file": file_name,
-        }
-        session["messages"].append(user_entry)
-        session["messages"].append({
-            "role": "assistant",
-            "content": reply,
-            "timestamp": iso_now(),
-            "tokens": usage,
-        })
-        session["provider"] = provider
-        session["model"] = model_name
-        session["updated_at"] = iso_now()
-        maybe_autotitle(session, user_message)
-
-        return jsonify({
-            "reply": reply,
-            "file_preview": file_name,
-            "session_id": session_id,
-            "session": session,
-            "usage": usage,
-        })
+@app.route("/metrics", methods=["GET"])
+def metrics_route():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/tracing", methods=["GET", "POST"])
+def tracing_route():
+    """Read or switch tracing for every worker, e.g. ``POST {"enabled": true, "server_timing": false}``."""
+    if request.method == "POST":
+        # Switching is refused outright unless a token is configured: tracing makes every
+        # worker write log lines and the control file.
+        token = CONFIG["trace_admin_token"]
+        if not token:
+            return jsonify({"error": "Set TRACE_ADMIN_TOKEN to switch tracing at runtime."}), 403
+        if not hmac.compare_digest(request.headers.get("X-Admin-Token", ""), token):
+            return jsonify({"error": "Invalid admin token."}), 403
+        changes = request.get_json(silent=True)
+        if not isinstance(changes, dict):
+            return jsonify({"error": "Expected a JSON object."}), 400
+        unknown = sorted(set(changes) - set(tracer.defaults))
+        if unknown:
+            return jsonify({"error": f"Unknown tracing settings: {', '.join(unknown)}."}), 400
+        invalid = sorted(key for key, value in changes.items() if not isinstance(value, bool))
+        if invalid:
+            return jsonify({"error": f"Expected true or false for: {', '.join(invalid)}."}), 400
+        try:
+            return jsonify(tracer.configure(**changes))
+        except OSError as exc:
+            return jsonify({"error": f"Could not save tracing settings: {exc}"}), 500
+    return jsonify(tracer.settings())
 
+
+@app.route("/chat", methods=["POST"])
+def chat():
+    trace = tracer.start("POST /chat")
+    with tracer.activate(trace):
+        response = make_response(handle_chat(trace))
+    if trace.server_timing:
+        # For a streamed reply this covers only the work done before the first byte.
+        response.headers["Server-Timing"] = trace.server_timing_header()
+    if not response.is_streamed:
+        tracer.finish(trace, status=response.status_code)
+    return response
+
+
+def handle_chat(trace):
+    started = time.perf_counter()
+    # Reject oversized bodies from the header, before werkzeug reads any of them.
+    if (request.content_length or 0) > CONFIG["upload_max_bytes"]:
+        record_error(None, None, "request", RequestEntityTooLarge())
+        payload, status = upload_too_large()
+        return jsonify(payload), status
+    turn = {}
+    chat_turn = None
+    stage = "request"
+    try:
+        with span("parse"):
+            uploaded_file = request.files.get("file")
+            form = request.form
+        if uploaded_file and uploaded_file.filename:
+            turn, error = parse_chat_turn(
+                form,
+                uploaded_file.filename,
+                uploaded_file.stream,
+                uploaded_file.mimetype,
+            )
+        else:
+            turn, error = parse_chat_turn(form)
+        if error:
+            return jsonify(error[0]), error[1]
+        request_bytes.observe(request.content_length or 0, turn["provider"], turn["model"])
+        trace.annotate(provider=turn["provider"], model=turn["model"], session_id=turn["session"]["id"])
+        stage = "rate_limit"
+        check_admission(turn)
+
+        if turn["stream"]:
+            return stream_chat_response(turn, started, trace)
+
+        session_id = turn["session"]["id"]
+        chat_turn = ChatTurn(turn, started, trace)
+        with span("lock"):
+            owner = lock_session(session_id)
+        try:
+            duplicate = chat_turn.prepare()
+            if duplicate:
+                chat_turn.finish(coalesced=True)
+                return jsonify(duplicate)
+            if chat_turn.cached:
+                reply, usage = chat_turn.cached
+            else:
+                reply, usage = chat_turn.generated(*routed_reply(turn, chat_turn.history))
+            payload = chat_turn.commit(reply, usage)
+        finally:
+            store.unlock(session_id, owner)
+        chat_turn.finish()
+        return jsonify(payload)
+
+    except SessionBusy as exc:
+        record_error(turn.get("provider"), turn.get("model"), "lock", exc)
+        return jsonify({"reply": f"Error: {exc}"}), 409
+    except RateLimited as exc:
+        record_error(turn.get("provider"), turn.get("model"), "rate_limit", exc)
+        payload, status, headers = rate_limited(exc)
+        return jsonify(payload), status, headers
+    except RequestEntityTooLarge as exc:
+        record_error(turn.get("provider"), turn.get("model"), "request", exc)
+        payload, status = upload_too_large()
+        return jsonify(payload), status
     except Exception as exc:
+        if chat_turn:
+            chat_turn.fail(exc)
+        else:
+            record_error(turn.get("provider"), turn.get("model"), stage, exc)
         return jsonify({"reply": f"Error: {exc}"}), 500
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="AI Chatbot V3 development server.")
+    parser.add_argument("--profile-startup", action="store_true", help="print an import-time breakdown and exit")
+    args = parser.parse_args()
+    if args.profile_startup:
+        profile_startup()
+        sys.exit(0)
     print("[INFO] Starting AI Chatbot V3...")
+    start_warm_up()
     app.run(host="0.0.0.0", port=5001, debug=True)
@@ -0,0 +1,215 @@
+"""ASGI entry point for chatbot-webv3.
+
+``/chat`` runs natively on asyncio with the async variants of the provider
+SDKs, so a slow generation holds a coroutine rather than a worker thread. All
+other routes are cheap session/store operations and are served by the Flask
+app through a WSGI bridge, so both entry points expose the same API.
+
+Run with:
+    uvicorn asgi:app --host 0.0.0.0 --port 5001
+    uvicorn asgi:app --host 0.0.0.0 --port 5001 --workers 4
+    gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker asgi:app
+"""
+import asyncio
+import time
+import uuid
+
+import anyio
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from python_multipart.multipart import parse_options_header
+from starlette.formparsers import MultiPartException, MultiPartParser
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+import app as webapp
+from tracing import span
+
+class UploadTooLarge(Exception):
+    pass
+
+
+async def read_form(request):
+    """``request.form()``, with uploads kept in memory only up to UPLOAD_SPOOL_MB."""
+    content_type, _ = parse_options_header(request.headers.get("content-type"))
+    if content_type != b"multipart/form-data":
+        return await request.form()
+    parser = MultiPartParser(request.headers, request.stream())
+    # starlette always spools; a 1-byte limit rolls every upload over to disk when UPLOAD_SPOOL_MB = 0.
+    parser.spool_max_size = webapp.CONFIG["upload_spool_bytes"] or 1
+    return await parser.parse()
+
+
+def limited_request(request, limit):
+    """Re-wrap ``request`` so reading more than ``limit`` body bytes raises UploadTooLarge."""
+    received = 0
+
+    async def receive():
+        nonlocal received
+        message = await request.receive()
+        received += len(message.get("body", b""))
+        if received > limit:
+            raise UploadTooLarge()
+        return message
+
+    return Request(request.scope, receive)
+
+
+async def shielded(func, *args):
+    """``run_in_threadpool`` that finishes even if the request is cancelled meanwhile.
+
+    Under ASGI < 2.4 a client disconnect cancels the response task; an unshielded
+    unlock would then never run and leave the session locked for the whole lease.
+    """
+    with anyio.CancelScope(shield=True):
+        return await run_in_threadpool(func, *args)
+
+
+async def alock_session(session_id):
+    """``webapp.lock_session`` that waits on the event loop instead of a thread."""
+    owner = uuid.uuid4().hex
+    deadline = time.monotonic() + webapp.CONFIG["session_lock_timeout"]
+    delay = webapp.LOCK_POLL_SECONDS
+    waited = False
+    while not await shielded(webapp.store.try_lock, session_id, owner, webapp.LOCK_LEASE_SECONDS):
+        if time.monotonic() >= deadline:
+            webapp.turn_stats["lock_timeouts"] += 1
+            raise webapp.SessionBusy("Another reply is still being generated for this chat.")
+        waited = True
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 0.5)
+    if waited:
+        webapp.turn_stats["serialized"] += 1
+    return owner
+
+
+async def stream_events(turn, started, trace):
+    chat_turn = webapp.ChatTurn(turn, started, trace)
+    owner = None
+    with webapp.tracer.activate(trace):
+        try:
+            with span("lock"):
+                owner = await alock_session(turn["session"]["id"])
+            duplicate = await run_in_threadpool(chat_turn.prepare)
+            if duplicate:
+                for line in webapp.coalesced_events(duplicate):
+                    yield line
+                chat_turn.finish(coalesced=True)
+                return
+            async for kind, value in chat_turn.aevents():
+                line = chat_turn.receive(kind, value)
+                if line:
+                    yield line
+            payload = await run_in_threadpool(chat_turn.commit, *chat_turn.streamed_reply())
+            yield webapp.ndjson({"type": "done", **payload})
+            chat_turn.finish()
+        except Exception as exc:
+            chat_turn.fail(exc)
+            yield webapp.error_event(exc)
+        finally:
+            if owner:
+                await shielded(webapp.store.unlock, turn["session"]["id"], owner)
+            webapp.tracer.finish(trace, status=200)
+
+
+async def chat(request):
+    trace = webapp.tracer.start("POST /chat")
+    with webapp.tracer.activate(trace):
+        response = await handle_chat(request, trace)
+    if trace.server_timing:
+        # For a streamed reply this covers only the work done before the first byte.
+        response.headers["Server-Timing"] = trace.server_timing_header()
+    if not isinstance(response, StreamingResponse):
+        webapp.tracer.finish(trace, status=response.status_code)
+    return response
+
+
+async def handle_chat(request, trace):
+    started = time.perf_counter()
+    limit = webapp.CONFIG["upload_max_bytes"]
+    content_length = int(request.headers.get("content-length") or 0)
+    if content_length > limit:
+        webapp.record_error(None, None, "request", UploadTooLarge())
+        return JSONResponse(*webapp.upload_too_large())
+    turn = {}
+    chat_turn = None
+    form = None
+    stage = "request"
+    try:
+        with span("parse"):
+            form = await read_form(limited_request(request, limit))
+        upload = form.get("file")
+        if getattr(upload, "filename", None):
+            turn, error = await run_in_threadpool(
+                webapp.parse_chat_turn, form, upload.filename, upload.file, upload.content_type
+            )
+        else:
+            turn, error = await run_in_threadpool(webapp.parse_chat_turn, form)
+        if error:
+            return JSONResponse(error[0], status_code=error[1])
+        webapp.request_bytes.observe(content_length, turn["provider"], turn["model"])
+        trace.annotate(provider=turn["provider"], model=turn["model"], session_id=turn["session"]["id"])
+        stage = "rate_limit"
+        webapp.check_admission(turn)
+
+        if turn["stream"]:
+            return StreamingResponse(
+                stream_events(turn, started, trace),
+                media_type="application/x-ndjson",
+                headers=webapp.STREAM_HEADERS,
+            )
+
+        session_id = turn["session"]["id"]
+        chat_turn = webapp.ChatTurn(turn, started, trace)
+        with span("lock"):
+            owner = await alock_session(session_id)
+        try:
+            duplicate = await run_in_threadpool(chat_turn.prepare)
+            if duplicate:
+                chat_turn.finish(coalesced=True)
+                return JSONResponse(duplicate)
+            if chat_turn.cached:
+                reply, usage = chat_turn.cached
+            else:
+                reply, usage = chat_turn.generated(*await webapp.arouted_reply(turn, chat_turn.history))
+            payload = await run_in_threadpool(chat_turn.commit, reply, usage)
+        finally:
+            await shielded(webapp.store.unlock, session_id, owner)
+        chat_turn.finish()
+        return JSONResponse(payload)
+
+    except webapp.SessionBusy as exc:
+        webapp.record_error(turn.get("provider"), turn.get("model"), "lock", exc)
+        return JSONResponse({"reply": f"Error: {exc}"}, status_code=409)
+    except webapp.RateLimited as exc:
+        webapp.record_error(turn.get("provider"), turn.get("model"), "rate_limit", exc)
+        payload, status, headers = webapp.rate_limited(exc)
+        return JSONResponse(payload, status_code=status, headers=headers)
+    except UploadTooLarge as exc:
+        webapp.record_error(turn.get("provider"), turn.get("model"), "request", exc)
+        return JSONResponse(*webapp.upload_too_large())
+    except MultiPartException as exc:
+        webapp.record_error(None, None, "request", exc)
+        return JSONResponse({"reply": f"Invalid form: {exc.message}"}, status_code=400)
+    except Exception as exc:
+        if chat_turn:
+            chat_turn.fail(exc)
+        else:
+            webapp.record_error(turn.get("provider"), turn.get("model"), stage, exc)
+        return JSONResponse({"reply": f"Error: {exc}"}, status_code=500)
+    finally:
+        # Any attachment has been uploaded by now; release its spooled temp file.
+        if form is not None:
+            await form.close()
+
+
+def create_app():
+    return Starlette(routes=[
+        Route("/chat", chat, methods=["POST"]),
+        Mount("/", WSGIMiddleware(webapp.create_app())),
+    ])
+
+
+app = create_app()
@@ -0,0 +1,95 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def file_digest(stream):
+    """SHA-256 of a seekable stream's remaining bytes; the position is restored afterwards."""
+    start = stream.tell()
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+        digest.update(chunk)
+    stream.seek(start)
+    return digest.hexdigest()
+
+
+class AttachmentCache:
+    """Maps attachment content hashes to files already uploaded to a provider.
+
+    Rows live in SQLite so the mapping survives restarts and is shared between
+    workers. Each row expires when the provider deletes the uploaded file, and
+    records how often it was reused so the bytes saved can be reported.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS attachments (
+            key TEXT PRIMARY KEY,
+            name TEXT,
+            uri TEXT NOT NULL,
+            mime_type TEXT NOT NULL,
+            size_bytes INTEGER NOT NULL DEFAULT 0,
+            expires_at REAL NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS idx_attachments_expires_at ON attachments (expires_at);
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._connect().executescript(self.SCHEMA)
+        self.hits = 0
+        self.misses = 0
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT name, uri, mime_type, size_bytes, expires_at FROM attachments WHERE key = ? AND expires_at > ?",
+            (key, time.time()),
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        conn.execute("UPDATE attachments SET hits = hits + 1 WHERE key = ?", (key,))
+        return dict(row)
+
+    def put(self, key, name, uri, mime_type, size_bytes, expires_at):
+        conn = self._connect()
+        conn.execute("DELETE FROM attachments WHERE expires_at <= ?", (time.time(),))
+        conn.execute(
+            "INSERT OR REPLACE INTO attachments (key, name, uri, mime_type, size_bytes, expires_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (key, name, uri, mime_type, size_bytes, expires_at),
+        )
+
+    def stats(self):
+        row = self._connect().execute(
+            "SELECT COUNT(*), COALESCE(SUM(hits), 0), COALESCE(SUM(hits * size_bytes), 0) "
+            "FROM attachments WHERE expires_at > ?",
+            (time.time(),),
+        ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "entries": row[0],
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "reused_uploads": row[1],
+            "bytes_saved": row[2],
+        }
@@ -0,0 +1,106 @@
+"""Cost of the /metrics instrumentation.
+
+Three measurements:
+
+* ``observe``/``inc``: nanoseconds per call on a labelled histogram and counter;
+* ``render``: time to produce the exposition text for ``--series`` label sets
+  per metric (what a scrape costs);
+* ``/chat``: mean request time with metrics on and off, against the local fake
+  provider with no added latency, in alternating batches so drift affects both.
+
+Usage:
+    python bench/bench_metrics.py
+    python bench/bench_metrics.py --requests 2000 --series 200
+"""
+import argparse
+import os
+import sys
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+from harness import start_fake_provider, stop_process  # noqa: E402
+from metrics import Registry  # noqa: E402
+
+
+def time_per_call(function, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        function()
+    return (time.perf_counter() - start) / calls
+
+
+def bench_primitives(args):
+    registry = Registry()
+    histogram = registry.histogram("h_seconds", "h", ("provider", "model"), (0.1, 0.5, 1, 5, 10, 30, 60))
+    counter = registry.counter("c_total", "c", ("provider", "model", "outcome"))
+    observe = time_per_call(lambda: histogram.observe(0.7, "openai", "gpt-4o-mini"), args.calls)
+    inc = time_per_call(lambda: counter.inc("openai", "gpt-4o-mini", "generated"), args.calls)
+    registry.enabled = False
+    disabled = time_per_call(lambda: histogram.observe(0.7, "openai", "gpt-4o-mini"), args.calls)
+    print(f"histogram.observe   {observe * 1e9:8.0f} ns/call")
+    print(f"counter.inc         {inc * 1e9:8.0f} ns/call")
+    print(f"observe (disabled)  {disabled * 1e9:8.0f} ns/call")
+
+    registry.enabled = True
+    for index in range(args.series):
+        histogram.observe(index % 7, "openai", f"model-{index}")
+        counter.inc("openai", f"model-{index}", "generated")
+    render = time_per_call(registry.render, 20)
+    print(f"render              {render * 1e3:8.2f} ms for {args.series} series per metric")
+
+
+def bench_chat(args):
+    os.environ.update(
+        OPENAI_API_KEY="fake",
+        OPENAI_BASE_URL=f"http://127.0.0.1:{args.provider_port}/v1",
+        SESSION_STORE="memory",
+        CHAT_PROVIDER="openai",
+    )
+    provider = start_fake_provider(args.provider_port, "--latency", "0", "--token-rate", "0")
+    try:
+        import app as webapp
+
+        client = webapp.app.test_client()
+        # Warm up imports, the SDK client and its connection before timing anything.
+        for index in range(20):
+            client.post("/chat", data={"provider": "openai", "model": "fake-model", "message": f"warm-up {index}"})
+        totals = {True: 0.0, False: 0.0}
+        counts = {True: 0, False: 0}
+        batch = max(1, args.requests // 20)
+        for round_index in range(args.requests // batch):
+            enabled = round_index % 2 == 0
+            webapp.metrics.enabled = enabled
+            # A fresh session per batch keeps the history (and so the request) the same size.
+            session_id = client.post("/sessions", json={}).get_json()["id"]
+            form = {"provider": "openai", "model": "fake-model", "session_id": session_id, "cache": "off"}
+            start = time.perf_counter()
+            for index in range(batch):
+                client.post("/chat", data={**form, "message": f"metrics bench {round_index}-{index}"})
+            totals[enabled] += time.perf_counter() - start
+            counts[enabled] += batch
+    finally:
+        stop_process(provider)
+
+    on = totals[True] / counts[True]
+    off = totals[False] / counts[False]
+    print(f"/chat metrics on    {on * 1e3:8.3f} ms/request ({counts[True]} requests)")
+    print(f"/chat metrics off   {off * 1e3:8.3f} ms/request ({counts[False]} requests)")
+    print(f"overhead            {(on - off) * 1e6:8.1f} us/request ({(on - off) / off:+.2%})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200_000)
+    parser.add_argument("--series", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--provider-port", type=int, default=9100)
+    args = parser.parse_args()
+    os.chdir(APP_DIR)
+    bench_primitives(args)
+    bench_chat(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Tail latency of /chat with ROUTING off, failover and hedge, on fake providers.
+
+The primary backend (OpenAI wire format) answers in ``--latency`` seconds but
+``--slow-rate`` of its requests take ``--slow-latency``; the alternate
+(Anthropic wire format) always answers in ``--latency``. Each mode gets a fresh
+server and the same request mix; the table shows latency percentiles, errors
+and how often the alternate answered.
+
+Usage:
+    python bench/bench_routing.py
+    python bench/bench_routing.py --server wsgi --slow-rate 0.1 --hedge-after 0.5
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+from harness import (
+    fake_provider_env,
+    percentile,
+    server_command,
+    start_fake_provider,
+    start_process,
+    stop_process,
+    wait_until_ready,
+)
+
+
+async def run_mode(args):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+    errors = 0
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", timeout=300, limits=limits) as client:
+        # One request per backend first, so SDK imports and connections are not timed.
+        await client.post("/chat", data={"message": "warm-up", "provider": "anthropic", "model": "fake-alternate"})
+        await client.post("/chat", data={"message": "warm-up", "provider": "openai", "model": "fake-primary"})
+        before = (await client.get("/stats")).json()["routing"]
+
+        async def one(index):
+            nonlocal errors
+            form = {"message": f"routing {index}", "provider": "openai", "model": "fake-primary", "cache": "off"}
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post("/chat", data=form)
+                if response.status_code != 200:
+                    errors += 1
+                    return
+                latencies.append(time.perf_counter() - start)
+
+        await asyncio.gather(*(one(index) for index in range(args.requests)))
+        after = (await client.get("/stats")).json()["routing"]
+    wins = after["alternate_wins"] - before["alternate_wins"]
+    return latencies, errors, wins
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", choices=("wsgi", "asgi"), default="asgi")
+    parser.add_argument("--modes", default="off,failover,hedge")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--slow-rate", type=float, default=0.05)
+    parser.add_argument("--slow-latency", type=float, default=5.0)
+    parser.add_argument("--timeout", type=float, default=1.0, help="ROUTING_TIMEOUT")
+    parser.add_argument("--hedge-after", type=float, default=0.5, help="HEDGE_AFTER")
+    parser.add_argument("--port", type=int, default=5056)
+    parser.add_argument("--primary-port", type=int, default=9101)
+    parser.add_argument("--alternate-port", type=int, default=9102)
+    args = parser.parse_args()
+
+    primary = start_fake_provider(
+        args.primary_port, "--latency", str(args.latency),
+        "--slow-rate", str(args.slow_rate), "--slow-latency", str(args.slow_latency), "--seed", "1",
+    )
+    alternate = start_fake_provider(args.alternate_port, "--latency", str(args.latency))
+    print(f"{'mode':>9}{'p50':>8}{'p95':>8}{'p99':>8}{'max':>8}{'err':>5}{'alt wins':>10}")
+    try:
+        for mode in args.modes.split(","):
+            env = fake_provider_env(args.primary_port, "openai")
+            env.update(
+                ANTHROPIC_BASE_URL=f"http://127.0.0.1:{args.alternate_port}",
+                ROUTING=mode,
+                ROUTING_BACKENDS="anthropic:fake-alternate",
+                ROUTING_TIMEOUT=str(args.timeout),
+                HEDGE_AFTER=str(args.hedge_after),
+                # One process (threaded under gunicorn) so /stats sees every request.
+                GUNICORN_THREADS=str(args.concurrency),
+            )
+            server = start_process(server_command(args.server, args.port), env=env)
+            try:
+                wait_until_ready(f"http://127.0.0.1:{args.port}/sessions")
+                latencies, errors, wins = asyncio.run(run_mode(args))
+            finally:
+                stop_process(server)
+            print(
+                f"{mode:>9}{percentile(latencies, 0.50):>8.3f}{percentile(latencies, 0.95):>8.3f}"
+                f"{percentile(latencies, 0.99):>8.3f}{max(latencies, default=0.0):>8.3f}{errors:>5}{wins:>10}"
+            )
+    finally:
+        stop_process(primary)
+        stop_process(alternate)
+
+
+if __name__ == "__main__":
+    main()
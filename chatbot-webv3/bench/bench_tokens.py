@@ -0,0 +1,127 @@
+"""Compare token_counter estimates with provider-reported usage, and time it.
+
+Fixtures are provider-reported output token counts for known reply texts. Two
+shapes are accepted:
+
+* a chatbot-webv3 export (``/sessions/export``); every assistant message whose
+  ``tokens.output`` came from the provider (no ``"estimated": true``) is used,
+  with the session's provider;
+* JSONL lines of ``{"provider": "openai", "text": "...", "tokens": 123}``.
+
+``bench/fixtures/openai_o200k.jsonl`` is a labelled set to start from: chat-style
+replies (prose, code, tables, numbers, CJK, emoji) plus paragraphs and functions from
+this repo, counted with OpenAI's ``o200k_base`` encoding.
+
+Usage:
+    python bench/bench_tokens.py chat-sessions.json more.jsonl
+    python bench/bench_tokens.py --fit chat-sessions.json
+    python bench/bench_tokens.py bench/fixtures/openai_o200k.jsonl
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from token_counter import PROFILES, TokenCounter, count_text  # noqa: E402
+
+
+def word_split_estimate(text):
+    return max(1, len(text.split())) if text else 0
+
+
+def load_fixtures(path):
+    with open(path, "r", encoding="utf-8") as f:
+        raw = f.read()
+    try:
+        payload = json.loads(raw)
+    except json.JSONDecodeError:
+        payload = [json.loads(line) for line in raw.splitlines() if line.strip()]
+
+    if isinstance(payload, dict):
+        payload = payload.get("sessions") or [payload]
+
+    records = []
+    for entry in payload:
+        if "text" in entry:
+            records.append((entry.get("provider"), entry["text"], int(entry["tokens"])))
+            continue
+        for msg in entry.get("messages") or []:
+            tokens = msg.get("tokens") or {}
+            if msg.get("role") != "assistant" or tokens.get("estimated") or not tokens.get("output"):
+                continue
+            records.append((entry.get("provider"), msg.get("content") or "", int(tokens["output"])))
+    return records
+
+
+def report_accuracy(records, fit):
+    by_provider = defaultdict(list)
+    skipped = 0
+    for provider, text, actual in records:
+        if actual <= 0:
+            # Nothing to compare against (and it would divide by zero).
+            skipped += 1
+            continue
+        by_provider[provider or "unknown"].append((text, actual))
+    if skipped:
+        print(f"Skipped {skipped} fixture(s) with no reported tokens.")
+
+    print(f"{'provider':<12}{'n':>6}{'mape':>9}{'bias':>8}{'old mape':>10}{'old bias':>10}")
+    for provider, items in sorted(by_provider.items()):
+        profile = PROFILES.get(provider, PROFILES["openai"])
+        actual_total = sum(actual for _, actual in items)
+        estimates = [count_text(text, profile) for text, _ in items]
+        old = [word_split_estimate(text) for text, _ in items]
+        mape = sum(abs(est - actual) / actual for est, (_, actual) in zip(estimates, items)) / len(items)
+        old_mape = sum(abs(est - actual) / actual for est, (_, actual) in zip(old, items)) / len(items)
+        bias = sum(estimates) / actual_total
+        old_bias = sum(old) / actual_total
+        print(f"{provider:<12}{len(items):>6}{mape:>8.1%}{bias:>8.2f}{old_mape:>9.1%}{old_bias:>10.2f}")
+        if fit:
+            print(f"{'':<12}suggested scale: {profile['scale'] / bias:.3f}")
+
+
+def report_speed(samples, iterations):
+    counter = TokenCounter()
+    texts = samples or ["The quick brown fox jumps over the lazy dog. " * 40]
+    short = "Hello there, how are you?"
+
+    def per_call(fn, items):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            for text in items:
+                fn(text)
+        return (time.perf_counter() - start) / (iterations * len(items)) * 1e6
+
+    profile = PROFILES["openai"]
+    counter.count(texts[0], "openai")
+    print(f"uncached  {per_call(lambda text: count_text(text, profile), texts):8.2f} us/call")
+    print(f"cached    {per_call(lambda text: counter.count(text, 'openai'), texts):8.2f} us/call")
+    print(f"short     {per_call(lambda text: counter.count(text, 'openai'), [short]):8.2f} us/call")
+    print(f"old split {per_call(word_split_estimate, texts):8.2f} us/call")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("fixtures", nargs="*", help="export JSON or JSONL fixture files")
+    parser.add_argument("--fit", action="store_true", help="print a fitted scale factor per provider")
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    records = []
+    for path in args.fixtures:
+        records.extend(load_fixtures(path))
+
+    if records:
+        report_accuracy(records, args.fit)
+        print()
+    else:
+        print("No fixtures given; skipping the accuracy report.\n")
+    report_speed([text for _, text, _ in records[:200]], args.iterations)
+
+
+if __name__ == "__main__":
+    main()
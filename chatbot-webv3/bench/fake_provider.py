@@ -0,0 +1,368 @@
+"""Local stand-in for the OpenAI, Anthropic and Gemini generation APIs.
+
+Speaks enough of each wire format for the official SDKs, including streaming:
+
+* OpenAI   POST /v1/chat/completions            (``stream: true`` -> SSE chunks)
+* Anthropic POST /v1/messages                   (``stream: true`` -> SSE events)
+* Gemini   POST /v1beta/models/{m}:generateContent
+           POST /v1beta/models/{m}:streamGenerateContent?alt=sse
+           POST /upload/v1beta/files            (resumable File API upload)
+
+Usage:
+    python bench/fake_provider.py --port 9100 --latency 0.5 --token-rate 50 --error-rate 0.05
+    python bench/fake_provider.py --port 9100 --latency 0.2 --slow-rate 0.05 --slow-latency 5
+
+Then point the app at it:
+    OPENAI_BASE_URL=http://127.0.0.1:9100/v1
+    ANTHROPIC_BASE_URL=http://127.0.0.1:9100
+    GOOGLE_BASE_URL=http://127.0.0.1:9100/
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = (
+    "the quick brown fox jumps over a lazy dog while the fake provider streams "
+    "canned tokens back so benchmarks measure our server instead of the network"
+).split()
+
+
+class FakeProviderSettings:
+    latency = 0.5
+    token_rate = 0.0
+    reply_tokens = 40
+    error_rate = 0.0
+    error_status = 500
+    slow_rate = 0.0
+    slow_latency = 5.0
+
+
+settings = FakeProviderSettings()
+stats_lock = threading.Lock()
+stats = {"requests": 0, "errors": 0, "streams": 0, "uploads": 0, "upload_bytes": 0}
+uploads = {}
+
+
+def reply_words():
+    return [WORDS[index % len(WORDS)] for index in range(settings.reply_tokens)]
+
+
+def count_prompt_tokens(value):
+    if isinstance(value, str):
+        return len(value.split())
+    if isinstance(value, dict):
+        return sum(count_prompt_tokens(item) for item in value.values())
+    if isinstance(value, list):
+        return sum(count_prompt_tokens(item) for item in value)
+    return 0
+
+
+class FakeProviderHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without TCP_NODELAY every
+    # keep-alive response waits ~40 ms on the client's delayed ACK.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.rstrip("/") in ("", "/stats"):
+            with stats_lock:
+                self.send_json(200, dict(stats))
+            return
+        self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length)
+        path = self.path.split("?", 1)[0].rstrip("/")
+        if path.startswith("/upload/"):
+            self.handle_upload(path, raw)
+            return
+        body = json.loads(raw or b"{}")
+
+        if path.endswith("/chat/completions"):
+            api = "openai"
+        elif path.endswith("/messages"):
+            api = "anthropic"
+        elif ":generateContent" in path or ":streamGenerateContent" in path:
+            api = "google"
+        else:
+            self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+
+        with stats_lock:
+            stats["requests"] += 1
+        slow = settings.slow_rate and random.random() < settings.slow_rate
+        time.sleep(settings.slow_latency if slow else settings.latency)
+        if settings.error_rate and random.random() < settings.error_rate:
+            with stats_lock:
+                stats["errors"] += 1
+            self.send_error_payload(api)
+            return
+
+        words = reply_words()
+        prompt_tokens = count_prompt_tokens(body.get("messages") or body.get("contents") or [])
+        streaming = body.get("stream") or ":streamGenerateContent" in path
+        if streaming:
+            with stats_lock:
+                stats["streams"] += 1
+            getattr(self, f"stream_{api}")(body, path, words, prompt_tokens)
+        else:
+            time.sleep(len(words) / settings.token_rate if settings.token_rate else 0)
+            getattr(self, f"reply_{api}")(body, path, words, prompt_tokens)
+
+    # --- OpenAI chat completions ---
+
+    def reply_openai(self, body, path, words, prompt_tokens):
+        self.send_json(200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": " ".join(words)},
+                "finish_reason": "stop",
+            }],
+            "usage": self.openai_usage(prompt_tokens, len(words)),
+        })
+
+    def stream_openai(self, body, path, words, prompt_tokens):
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+        }
+        self.start_stream()
+        for index, word in enumerate(words):
+            self.pace()
+            text = word if index == 0 else " " + word
+            self.write_event({**chunk, "choices": [{"index": 0, "delta": {"content": text}, "finish_reason": None}]})
+        self.write_event({**chunk, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        if (body.get("stream_options") or {}).get("include_usage"):
+            self.write_event({**chunk, "choices": [], "usage": self.openai_usage(prompt_tokens, len(words))})
+        self.write_chunk(b"data: [DONE]\n\n")
+        self.end_stream()
+
+    def openai_usage(self, prompt_tokens, output_tokens):
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": output_tokens,
+            "total_tokens": prompt_tokens + output_tokens,
+        }
+
+    # --- Anthropic messages ---
+
+    def reply_anthropic(self, body, path, words, prompt_tokens):
+        self.send_json(200, {
+            "id": f"msg_{uuid.uuid4().hex}",
+            "type": "message",
+            "role": "assistant",
+            "model": body.get("model", "fake"),
+            "content": [{"type": "text", "text": " ".join(words)}],
+            "stop_reason": "end_turn",
+            "stop_sequence": None,
+            "usage": {"input_tokens": prompt_tokens, "output_tokens": len(words)},
+        })
+
+    def stream_anthropic(self, body, path, words, prompt_tokens):
+        self.start_stream()
+        self.write_event({
+            "type": "message_start",
+            "message": {
+                "id": f"msg_{uuid.uuid4().hex}",
+                "type": "message",
+                "role": "assistant",
+                "model": body.get("model", "fake"),
+                "content": [],
+                "stop_reason": None,
+                "stop_sequence": None,
+                "usage": {"input_tokens": prompt_tokens, "output_tokens": 1},
+            },
+        }, event="message_start")
+        self.write_event({
+            "type": "content_block_start",
+            "index": 0,
+            "content_block": {"type": "text", "text": ""},
+        }, event="content_block_start")
+        for index, word in enumerate(words):
+            self.pace()
+            text = word if index == 0 else " " + word
+            self.write_event({
+                "type": "content_block_delta",
+                "index": 0,
+                "delta": {"type": "text_delta", "text": text},
+            }, event="content_block_delta")
+        self.write_event({"type": "content_block_stop", "index": 0}, event="content_block_stop")
+        self.write_event({
+            "type": "message_delta",
+            "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+            "usage": {"output_tokens": len(words)},
+        }, event="message_delta")
+        self.write_event({"type": "message_stop"}, event="message_stop")
+        self.end_stream()
+
+    # --- Gemini generateContent ---
+
+    def reply_google(self, body, path, words, prompt_tokens):
+        self.send_json(200, self.google_chunk(path, " ".join(words), prompt_tokens, len(words), final=True))
+
+    def stream_google(self, body, path, words, prompt_tokens):
+        self.start_stream()
+        for index, word in enumerate(words):
+            self.pace()
+            text = word if index == 0 else " " + word
+            final = index == len(words) - 1
+            self.write_event(self.google_chunk(path, text, prompt_tokens, index + 1, final=final))
+        self.end_stream()
+
+    def google_chunk(self, path, text, prompt_tokens, output_tokens, final):
+        candidate = {"content": {"role": "model", "parts": [{"text": text}]}, "index": 0}
+        if final:
+            candidate["finishReason"] = "STOP"
+        return {
+            "candidates": [candidate],
+            "usageMetadata": {
+                "promptTokenCount": prompt_tokens,
+                "candidatesTokenCount": output_tokens,
+                "totalTokenCount": prompt_tokens + output_tokens,
+            },
+            "modelVersion": path.rsplit("/", 1)[-1].split(":", 1)[0],
+        }
+
+    # --- Gemini resumable file upload ---
+
+    def handle_upload(self, path, raw):
+        command = self.headers.get("X-Goog-Upload-Command", "")
+        if command == "start":
+            upload_id = uuid.uuid4().hex
+            uploads[upload_id] = {
+                "mime_type": self.headers.get("X-Goog-Upload-Header-Content-Type"),
+                "display_name": (json.loads(raw or b"{}").get("file") or {}).get("displayName"),
+                "size": 0,
+            }
+            host = self.headers.get("Host", "127.0.0.1")
+            self.send_json(200, {}, {"x-goog-upload-url": f"http://{host}/upload/session/{upload_id}"})
+            return
+
+        upload_id = path.rsplit("/", 1)[-1]
+        upload = uploads.get(upload_id)
+        if upload is None:
+            self.send_json(404, {"error": {"code": 404, "message": "Unknown upload", "status": "NOT_FOUND"}})
+            return
+        upload["size"] += len(raw)
+        if "finalize" not in command:
+            self.send_json(200, {}, {"x-goog-upload-status": "active"})
+            return
+
+        del uploads[upload_id]
+        with stats_lock:
+            stats["uploads"] += 1
+            stats["upload_bytes"] += upload["size"]
+        time.sleep(settings.latency)
+        name = f"files/{upload_id[:12]}"
+        host = self.headers.get("Host", "127.0.0.1")
+        self.send_json(200, {"file": {
+            "name": name,
+            "displayName": upload["display_name"],
+            "mimeType": upload["mime_type"],
+            "sizeBytes": str(upload["size"]),
+            "uri": f"http://{host}/v1beta/{name}",
+            "state": "ACTIVE",
+            "expirationTime": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() + 48 * 3600)),
+        }}, {"x-goog-upload-status": "final"})
+
+    # --- transport helpers ---
+
+    def send_error_payload(self, api):
+        status = settings.error_status
+        message = f"Injected error from fake provider ({status})"
+        if api == "anthropic":
+            payload = {"type": "error", "error": {"type": "api_error", "message": message}}
+        elif api == "google":
+            payload = {"error": {"code": status, "message": message, "status": "UNAVAILABLE"}}
+        else:
+            payload = {"error": {"message": message, "type": "server_error", "code": None}}
+        headers = {"Retry-After": "1"} if status == 429 else {}
+        self.send_json(status, payload, headers)
+
+    def pace(self):
+        if settings.token_rate:
+            time.sleep(1 / settings.token_rate)
+
+    def start_stream(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def end_stream(self):
+        self.write_chunk(b"")
+
+    def write_event(self, payload, event=None):
+        prefix = f"event: {event}\n" if event else ""
+        self.write_chunk(f"{prefix}data: {json.dumps(payload)}\n\n".encode("utf-8"))
+
+    def write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class FakeProviderServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds before the first token")
+    parser.add_argument("--token-rate", type=float, default=0.0, help="tokens per second after the first (0 = instant)")
+    parser.add_argument("--reply-tokens", type=int, default=40, help="words per reply")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests that fail")
+    parser.add_argument("--error-status", type=int, default=500, help="HTTP status for injected failures")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="fraction of requests that are slow")
+    parser.add_argument("--slow-latency", type=float, default=5.0, help="seconds before the first token when slow")
+    parser.add_argument("--seed", type=int, default=None, help="random seed for error injection")
+    args = parser.parse_args()
+
+    settings.latency = args.latency
+    settings.token_rate = args.token_rate
+    settings.reply_tokens = max(1, args.reply_tokens)
+    settings.error_rate = args.error_rate
+    settings.error_status = args.error_status
+    settings.slow_rate = args.slow_rate
+    settings.slow_latency = args.slow_latency
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    server = FakeProviderServer((args.host, args.port), FakeProviderHandler)
+    print(f"[INFO] Fake provider on http://{args.host}:{args.port} (latency {args.latency}s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
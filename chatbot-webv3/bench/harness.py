@@ -0,0 +1,100 @@
+"""Process and statistics helpers shared by the benchmark scripts."""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def start_process(args, env=None):
+    return subprocess.Popen(
+        args,
+        cwd=APP_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def stop_process(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def wait_until_ready(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def start_fake_provider(port, *extra_args):
+    process = start_process([sys.executable, "bench/fake_provider.py", "--port", str(port), *extra_args])
+    wait_until_ready(f"http://127.0.0.1:{port}/stats")
+    return process
+
+
+def fake_provider_env(port, provider):
+    """Environment that points every provider SDK at the fake provider."""
+    workdir = tempfile.mkdtemp(prefix="chatbot-bench-")
+    return dict(
+        os.environ,
+        OPENAI_API_KEY="fake",
+        ANTHROPIC_API_KEY="fake",
+        GOOGLE_API_KEY="fake",
+        OPENAI_BASE_URL=f"http://127.0.0.1:{port}/v1",
+        ANTHROPIC_BASE_URL=f"http://127.0.0.1:{port}",
+        GOOGLE_BASE_URL=f"http://127.0.0.1:{port}/",
+        CHAT_PROVIDER=provider,
+        SESSION_DB=os.path.join(workdir, "sessions.db"),
+    )
+
+
+def server_command(server, port, workers=1):
+    """Command for the production entry points: uvicorn for asgi, gunicorn sync workers for wsgi."""
+    if server == "asgi":
+        command = [sys.executable, "-m", "uvicorn", "asgi:app", "--port", str(port), "--log-level", "warning"]
+        return command + (["--workers", str(workers)] if workers > 1 else [])
+    return [
+        sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py",
+        "-w", str(workers), "-b", f"127.0.0.1:{port}", "app:create_app()",
+    ]
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def process_tree_rss(pid):
+    """Resident set size in bytes of ``pid`` and its children (Linux /proc only)."""
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+            with open(f"/proc/{current}/task/{current}/children") as f:
+                pending.extend(int(child) for child in f.read().split())
+        except (FileNotFoundError, ProcessLookupError, PermissionError):
+            continue
+    return total or None
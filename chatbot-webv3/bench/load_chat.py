@@ -0,0 +1,92 @@
+"""Concurrency load test for /chat against the local fake provider.
+
+Starts bench/fake_provider.py and the server under test, then keeps
+``--concurrency`` chat requests in flight until ``--requests`` have completed.
+
+Usage:
+    python bench/load_chat.py --server wsgi --workers 8 --concurrency 200
+    python bench/load_chat.py --server asgi --concurrency 200
+
+``wsgi`` runs ``gunicorn "app:create_app()"`` with sync workers (one request per worker);
+``asgi`` runs ``uvicorn asgi:app`` in a single process.
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+from harness import (
+    fake_provider_env,
+    percentile,
+    server_command,
+    start_fake_provider,
+    start_process,
+    stop_process,
+    wait_until_ready,
+)
+
+
+async def run_load(args):
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", timeout=300, limits=limits) as client:
+        async def one(index):
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post("/chat", data={
+                    "message": f"load test message {index}",
+                    "provider": "openai",
+                    "model": "fake-model",
+                    "stream": "1" if args.stream else "0",
+                })
+                await response.aread()
+                latencies.append(time.perf_counter() - start)
+                if response.status_code != 200 or b'"error"' in response.content:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(index) for index in range(args.requests)))
+        elapsed = time.perf_counter() - start
+
+    return latencies, errors, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", choices=("wsgi", "asgi"), default="asgi")
+    parser.add_argument("--workers", type=int, default=8, help="gunicorn workers for --server wsgi")
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--latency", type=float, default=1.0, help="fake provider reply delay in seconds")
+    parser.add_argument("--stream", action="store_true", help="request NDJSON streaming replies")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--provider-port", type=int, default=9100)
+    args = parser.parse_args()
+
+    provider = start_fake_provider(args.provider_port, "--latency", str(args.latency))
+    server = start_process(
+        server_command(args.server, args.port, args.workers if args.server == "wsgi" else 1),
+        env=fake_provider_env(args.provider_port, "openai"),
+    )
+    try:
+        wait_until_ready(f"http://127.0.0.1:{args.port}/sessions")
+        latencies, errors, elapsed = asyncio.run(run_load(args))
+    finally:
+        stop_process(server)
+        stop_process(provider)
+
+    label = f"{args.server} ({args.workers} workers)" if args.server == "wsgi" else "asgi (1 process)"
+    print(f"server       {label}")
+    print(f"concurrency  {args.concurrency}, provider latency {args.latency:.2f}s")
+    print(f"requests     {len(latencies)} ({errors} errors) in {elapsed:.2f}s")
+    print(f"throughput   {len(latencies) / elapsed:.1f} req/s")
+    print(f"latency      p50 {percentile(latencies, 0.50):.3f}s  p95 {percentile(latencies, 0.95):.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""Benchmark suite for chatbot-webv3 against the local fake provider.
+
+Starts bench/fake_provider.py and the server under test, seeds a few sessions,
+then drives each scenario at every concurrency level and reports p50/p95/p99
+latency, throughput, errors and the server's peak RSS.
+
+Scenarios:
+    chat         POST /chat (blocking JSON reply)
+    chat-stream  POST /chat with stream=1; also reports time to first byte
+    sessions     GET /sessions
+    session      GET /sessions/<id>
+    upload       POST /chat with a ``--upload-kb`` attachment (``--provider google``,
+                 not run by default)
+
+Usage:
+    python bench/run_bench.py --server asgi --provider openai --levels 1,10,50
+    python bench/run_bench.py --json results.json
+    python bench/run_bench.py --baseline results.json --tolerance 0.2
+
+With ``--baseline`` the run exits non-zero when p95 latency grows, or
+throughput drops, by more than the tolerance for any scenario/level.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import httpx
+
+from harness import (
+    fake_provider_env,
+    percentile,
+    process_tree_rss,
+    server_command,
+    start_fake_provider,
+    start_process,
+    stop_process,
+    wait_until_ready,
+)
+
+SCENARIOS = ("chat", "chat-stream", "sessions", "session", "upload")
+DEFAULT_SCENARIOS = ("chat", "chat-stream", "sessions", "session")
+
+
+def chat_form(args, index, stream):
+    return {
+        "message": f"benchmark message {index}",
+        "provider": args.provider,
+        "model": args.model,
+        "stream": "1" if stream else "0",
+    }
+
+
+async def send(client, scenario, args, index, session_ids):
+    """Issue one request; return (latency, time to first byte, ok)."""
+    start = time.perf_counter()
+    if scenario in ("chat", "chat-stream"):
+        stream = scenario == "chat-stream"
+        request = client.build_request("POST", "/chat", data=chat_form(args, index, stream))
+    elif scenario == "upload":
+        request = client.build_request(
+            "POST",
+            "/chat",
+            data=chat_form(args, index, stream=False),
+            files={"file": ("bench.pdf", args.upload_payload, "application/pdf")},
+        )
+    elif scenario == "sessions":
+        request = client.build_request("GET", "/sessions")
+    else:
+        request = client.build_request("GET", f"/sessions/{session_ids[index % len(session_ids)]}")
+
+    response = await client.send(request, stream=True)
+    first_byte = None
+    body = b""
+    async for chunk in response.aiter_bytes():
+        if first_byte is None:
+            first_byte = time.perf_counter() - start
+        body += chunk
+    await response.aclose()
+    ok = response.status_code == 200 and b'"type": "error"' not in body
+    return time.perf_counter() - start, first_byte, ok
+
+
+async def run_scenario(client, scenario, level, args, session_ids, server_pid):
+    latencies = []
+    first_bytes = []
+    errors = 0
+    peak_rss = process_tree_rss(server_pid) or 0
+    semaphore = asyncio.Semaphore(level)
+    done = asyncio.Event()
+
+    async def sample_rss():
+        nonlocal peak_rss
+        while not done.is_set():
+            peak_rss = max(peak_rss, process_tree_rss(server_pid) or 0)
+            await asyncio.sleep(0.2)
+
+    async def one(index):
+        nonlocal errors
+        async with semaphore:
+            try:
+                latency, first_byte, ok = await send(client, scenario, args, index, session_ids)
+            except httpx.HTTPError:
+                errors += 1
+                return
+            latencies.append(latency)
+            if first_byte is not None:
+                first_bytes.append(first_byte)
+            if not ok:
+                errors += 1
+
+    sampler = asyncio.create_task(sample_rss())
+    start = time.perf_counter()
+    await asyncio.gather(*(one(index) for index in range(args.requests)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await sampler
+
+    return {
+        "scenario": scenario,
+        "concurrency": level,
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "p50": percentile(latencies, 0.50),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+        "ttfb_p50": percentile(first_bytes, 0.50),
+        "peak_rss_mb": peak_rss / (1024 * 1024),
+    }
+
+
+async def run_suite(args, server_pid):
+    limits = httpx.Limits(max_connections=max(args.levels), max_keepalive_connections=max(args.levels))
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", timeout=300, limits=limits) as client:
+        session_ids = []
+        for index in range(args.seed_sessions):
+            response = await client.post("/chat", data=chat_form(args, index, stream=False))
+            session_ids.append(response.json()["session_id"])
+
+        results = []
+        for scenario in args.scenarios:
+            for level in args.levels:
+                result = await run_scenario(client, scenario, level, args, session_ids, server_pid)
+                print_result(result)
+                results.append(result)
+        return results
+
+
+def print_header():
+    print(
+        f"{'scenario':<12}{'conc':>6}{'reqs':>7}{'err':>5}{'req/s':>9}"
+        f"{'p50':>9}{'p95':>9}{'p99':>9}{'ttfb':>9}{'rss MB':>9}"
+    )
+
+
+def print_result(result):
+    print(
+        f"{result['scenario']:<12}{result['concurrency']:>6}{result['requests']:>7}{result['errors']:>5}"
+        f"{result['throughput']:>9.1f}{result['p50']:>9.3f}{result['p95']:>9.3f}{result['p99']:>9.3f}"
+        f"{result['ttfb_p50']:>9.3f}{result['peak_rss_mb']:>9.1f}"
+    )
+
+
+def compare_to_baseline(results, baseline_path, tolerance):
+    with open(baseline_path, "r") as f:
+        baseline = {(item["scenario"], item["concurrency"]): item for item in json.load(f)["results"]}
+
+    regressions = []
+    for result in results:
+        previous = baseline.get((result["scenario"], result["concurrency"]))
+        if not previous:
+            continue
+        if previous["p95"] and result["p95"] > previous["p95"] * (1 + tolerance):
+            regressions.append(f"{result['scenario']}@{result['concurrency']}: p95 "
+                               f"{previous['p95']:.3f}s -> {result['p95']:.3f}s")
+        if previous["throughput"] and result["throughput"] < previous["throughput"] * (1 - tolerance):
+            regressions.append(f"{result['scenario']}@{result['concurrency']}: throughput "
+                               f"{previous['throughput']:.1f} -> {result['throughput']:.1f} req/s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", choices=("wsgi", "asgi"), default="asgi")
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn workers for --server wsgi")
+    parser.add_argument("--provider", choices=("openai", "anthropic", "google"), default="openai")
+    parser.add_argument("--model", default="fake-model")
+    parser.add_argument("--levels", default="1,10,50", help="comma-separated concurrency levels")
+    parser.add_argument("--scenarios", default=",".join(DEFAULT_SCENARIOS))
+    parser.add_argument("--upload-kb", type=int, default=1024, help="attachment size for the upload scenario")
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario and level")
+    parser.add_argument("--seed-sessions", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.2, help="fake provider time to first token")
+    parser.add_argument("--token-rate", type=float, default=200.0, help="fake provider tokens per second")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--provider-port", type=int, default=9100)
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="compare with a previous --json file")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    args = parser.parse_args()
+    args.levels = [int(level) for level in args.levels.split(",") if level]
+    args.scenarios = [name for name in args.scenarios.split(",") if name]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    if "upload" in args.scenarios and args.provider != "google":
+        parser.error("the upload scenario needs --provider google")
+    args.upload_payload = os.urandom(args.upload_kb * 1024)
+
+    provider = start_fake_provider(
+        args.provider_port,
+        "--latency", str(args.latency),
+        "--token-rate", str(args.token_rate),
+        "--error-rate", str(args.error_rate),
+    )
+    server = start_process(
+        server_command(args.server, args.port, args.workers if args.server == "wsgi" else 1),
+        env=fake_provider_env(args.provider_port, args.provider),
+    )
+    try:
+        wait_until_ready(f"http://127.0.0.1:{args.port}/sessions")
+        print_header()
+        results = asyncio.run(run_suite(args, server.pid))
+    finally:
+        stop_process(server)
+        stop_process(provider)
+
+    if args.json:
+        skipped = ("json", "baseline", "upload_payload")
+        with open(args.json, "w") as f:
+            json.dump({"settings": {k: v for k, v in vars(args).items() if k not in skipped},
+                       "results": results}, f, indent=2)
+        print(f"\n[OK] Results written to {args.json}")
+
+    if args.baseline:
+        regressions = compare_to_baseline(results, args.baseline, args.tolerance)
+        if regressions:
+            print("\n[FAIL] Regressions against baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("\n[OK] No regressions against baseline.")
+
+
+if __name__ == "__main__":
+    main()
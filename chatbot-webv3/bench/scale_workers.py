@@ -0,0 +1,160 @@
+"""Throughput of chatbot-webv3 as worker processes are added, on the fake provider.
+
+For each worker count the server is started through its production entry point
+(gunicorn sync workers for ``wsgi``, ``uvicorn --workers`` for ``asgi``) against
+one shared SQLite session database, and two phases run:
+
+    throughput  ``--requests`` chats on ``--sessions`` sessions, ``--concurrency`` in flight
+    same-session  ``--burst`` concurrent chats on a single session; afterwards the
+                  session must hold exactly two messages per successful chat
+
+Usage:
+    python bench/scale_workers.py --workers 1,2,4,8
+    python bench/scale_workers.py --server asgi --workers 1,2 --latency 0.05
+
+A non-zero ``lost`` count (or any missing seq) in the same-session phase makes
+the run exit with status 1.
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+import httpx
+
+from harness import (
+    fake_provider_env,
+    percentile,
+    server_command,
+    start_fake_provider,
+    start_process,
+    stop_process,
+    wait_until_ready,
+)
+
+
+def chat_form(index, session_id=None):
+    form = {"message": f"scaling message {index}", "provider": "openai", "model": "fake-model", "stream": "0"}
+    if session_id:
+        form["session_id"] = session_id
+    return form
+
+
+async def throughput_phase(client, args):
+    session_ids = []
+    for index in range(args.sessions):
+        response = await client.post("/chat", data=chat_form(index))
+        session_ids.append(response.json()["session_id"])
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+    errors = 0
+
+    async def one(index):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                response = await client.post("/chat", data=chat_form(index, session_ids[index % len(session_ids)]))
+            except httpx.HTTPError:
+                errors += 1
+                return
+            if response.status_code != 200:
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(index) for index in range(args.requests)))
+    elapsed = time.perf_counter() - start
+    return latencies, errors, elapsed
+
+
+async def same_session_phase(client, args):
+    """Fire ``--burst`` chats at one session at once; return (ok, lost, seq_gaps)."""
+    session_id = (await client.post("/sessions", json={})).json()["id"]
+
+    async def one(index):
+        try:
+            response = await client.post("/chat", data=chat_form(index, session_id))
+        except httpx.HTTPError:
+            return False
+        return response.status_code == 200
+
+    results = await asyncio.gather(*(one(index) for index in range(args.burst)))
+    ok = sum(results)
+
+    page = (await client.get(f"/sessions/{session_id}/messages", params={"limit": 500})).json()
+    seqs = [message["seq"] for message in page["messages"]]
+    contents = {message["content"] for message in page["messages"] if message["role"] == "user"}
+    lost = ok - len(contents)
+    gaps = seqs != list(range(len(seqs))) or page["version"] != 2 * ok
+    return ok, lost, gaps
+
+
+async def run_level(args):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", timeout=300, limits=limits) as client:
+        latencies, errors, elapsed = await throughput_phase(client, args)
+        ok, lost, gaps = await same_session_phase(client, args)
+    return {
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "p50": percentile(latencies, 0.50),
+        "p95": percentile(latencies, 0.95),
+        "errors": errors,
+        "burst_ok": ok,
+        "lost": lost,
+        "gaps": gaps,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", choices=("wsgi", "asgi"), default="wsgi")
+    parser.add_argument("--workers", default="1,2,4,8", help="comma-separated worker counts")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--burst", type=int, default=20, help="concurrent chats on one session")
+    parser.add_argument("--latency", type=float, default=0.2, help="fake provider time to first token")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--provider-port", type=int, default=9100)
+    args = parser.parse_args()
+    worker_counts = [int(count) for count in args.workers.split(",") if count]
+    if args.burst * 2 > 500:
+        parser.error("--burst is limited to 250 so the session fits in one page of messages")
+
+    provider = start_fake_provider(args.provider_port, "--latency", str(args.latency))
+    print(f"{'workers':>8}{'req/s':>9}{'scale':>8}{'p50':>9}{'p95':>9}{'err':>5}{'burst':>7}{'lost':>6}")
+    failed = False
+    base = None
+    try:
+        for workers in worker_counts:
+            # A fresh database per worker count, shared by that server's workers.
+            server = start_process(
+                server_command(args.server, args.port, workers),
+                env=fake_provider_env(args.provider_port, "openai"),
+            )
+            try:
+                wait_until_ready(f"http://127.0.0.1:{args.port}/sessions")
+                result = asyncio.run(run_level(args))
+            finally:
+                stop_process(server)
+            base = base or result["throughput"]
+            failed = failed or result["lost"] != 0 or result["gaps"]
+            print(
+                f"{workers:>8}{result['throughput']:>9.1f}{result['throughput'] / base:>7.2f}x"
+                f"{result['p50']:>9.3f}{result['p95']:>9.3f}{result['errors']:>5}"
+                f"{result['burst_ok']:>7}{result['lost']:>6}" + ("  seq gap!" if result["gaps"] else "")
+            )
+    finally:
+        stop_process(provider)
+
+    if failed:
+        print("\n[FAIL] Messages were lost or misnumbered in the same-session phase.")
+        sys.exit(1)
+    print("\n[OK] Every same-session chat was stored, with contiguous seq numbers.")
+
+
+if __name__ == "__main__":
+    main()
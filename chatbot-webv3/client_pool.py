@@ -0,0 +1,117 @@
+import asyncio
+import inspect
+import threading
+import time
+from collections import OrderedDict
+
+
+def close_client(key, client):
+    """Close a provider SDK client, ignoring errors.
+
+    Async clients close with a coroutine, which is scheduled on the event loop
+    in ``key`` that opened their connections; if that loop is gone there is
+    nothing left to close on.
+    """
+    close = getattr(client, "close", None)
+    if close is None:
+        return
+    try:
+        result = close()
+        if inspect.isawaitable(result):
+            loop = next((part for part in key if isinstance(part, asyncio.AbstractEventLoop)), None)
+            if loop is not None and loop.is_running():
+                asyncio.run_coroutine_threadsafe(result, loop)
+            elif inspect.iscoroutine(result):
+                result.close()
+    except Exception:
+        pass
+
+
+class ClientPool:
+    """Bounded LRU registry of provider SDK clients.
+
+    Clients are keyed by (provider, api key, base url) so each distinct endpoint
+    keeps one warm HTTP connection pool. ``factory`` runs outside the lock, so a
+    slow SDK import for one provider does not hold up lookups for the others;
+    when two threads build the same client, the first one in wins and the other
+    is closed. Entries idle for longer than ``idle_timeout`` seconds, or pushed
+    out by ``max_size``, are dropped from the registry and closed ``close_delay``
+    seconds later, which leaves requests still holding the client time to finish.
+    """
+
+    def __init__(self, max_size=8, idle_timeout=300, close_delay=300, closer=close_client):
+        self.max_size = max(1, max_size)
+        self.idle_timeout = idle_timeout
+        self.close_delay = close_delay
+        self.closer = closer
+        self._clients = OrderedDict()
+        self._retired = []
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, factory):
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            expired = self._take_expired(now)
+            entry = self._clients.get(key)
+            if entry is not None:
+                self.hits += 1
+                entry[1] = now
+                self._clients.move_to_end(key)
+            else:
+                self.misses += 1
+        self._close(expired)
+        if entry is not None:
+            return entry[0]
+
+        client = factory()
+        now = time.monotonic()
+        unused = []
+        with self._lock:
+            entry = self._clients.get(key)
+            if entry is None:
+                self._clients[key] = [client, now]
+                while len(self._clients) > self.max_size:
+                    old_key, (old_client, _) = self._clients.popitem(last=False)
+                    self._retired.append((now, old_key, old_client))
+            else:
+                # Another thread built this client first; keep theirs.
+                entry[1] = now
+                self._clients.move_to_end(key)
+                unused.append((key, client))
+                client = entry[0]
+            expired = self._take_expired(now)
+        self._close(unused + expired)
+        return client
+
+    def clear(self):
+        with self._lock:
+            closing = [(key, client) for key, (client, _) in self._clients.items()]
+            closing += [(key, client) for _, key, client in self._retired]
+            self._clients.clear()
+            self._retired = []
+        self._close(closing)
+
+    def __len__(self):
+        return len(self._clients)
+
+    def _evict_idle(self, now):
+        if self.idle_timeout:
+            while self._clients:
+                key, (client, last_used) = next(iter(self._clients.items()))
+                if now - last_used < self.idle_timeout:
+                    break
+                del self._clients[key]
+                self._retired.append((now, key, client))
+
+    def _take_expired(self, now):
+        expired = [(key, client) for retired_at, key, client in self._retired if now - retired_at >= self.close_delay]
+        if expired:
+            self._retired = [item for item in self._retired if now - item[0] < self.close_delay]
+        return expired
+
+    def _close(self, clients):
+        for key, client in clients:
+            self.closer(key, client)
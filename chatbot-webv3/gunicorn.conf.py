@@ -0,0 +1,31 @@
+"""Production server settings for chatbot-webv3.
+
+    gunicorn -c gunicorn.conf.py "app:create_app()"
+    gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker asgi:app
+
+Sync workers handle one request at a time, so size WEB_CONCURRENCY for the
+number of generations you want in flight; with the uvicorn worker each process
+handles many. Session state lives in SESSION_DB and is shared by all workers.
+"""
+import glob
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:5001")
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv("GUNICORN_THREADS", "1"))
+# Provider calls can take minutes for long replies.
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "300"))
+graceful_timeout = 30
+keepalive = 5
+# Each worker imports the app itself, so SDK clients and their connection
+# pools are never shared across a fork.
+preload_app = False
+
+
+def on_starting(server):
+    # Per-worker metric snapshots from a previous run would be added to this one's.
+    directory = os.getenv("METRICS_DIR")
+    if directory:
+        for path in glob.glob(os.path.join(directory, "metrics-*.json")):
+            os.remove(path)
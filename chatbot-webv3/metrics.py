@@ -0,0 +1,220 @@
+"""Minimal Prometheus-style metrics: labelled counters and histograms, text exposition.
+
+Each process keeps its own series in memory; an observation is a dict lookup
+and a couple of additions under a lock. With ``directory`` set, every process
+also writes its series to ``<directory>/metrics-<pid>.json`` every few seconds,
+and ``render`` adds up the files of all processes, so any worker can answer a
+scrape for the whole server.
+"""
+import atexit
+import glob
+import json
+import math
+import os
+import threading
+from bisect import bisect_left
+
+MAX_SERIES = 500
+OVERFLOW_LABEL = "other"
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names, values, extra=()):
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in (*zip(names, values), *extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, registry, name, help_text, labels=()):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _key(self, values):
+        if values in self._series:
+            return values
+        key = tuple(str(value) if value is not None else "" for value in values)
+        if key not in self._series and len(self._series) >= MAX_SERIES:
+            # Model names come from the client; keep a flood of them from growing memory.
+            key = (OVERFLOW_LABEL,) * len(self.labels)
+        return key
+
+    def snapshot(self):
+        with self._lock:
+            return {json.dumps(key): self._copy(value) for key, value in self._series.items()}
+
+    def _copy(self, value):
+        return value
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        if not self.registry.enabled:
+            return
+        with self._lock:
+            key = self._key(labels)
+            self._series[key] = self._series.get(key, 0) + amount
+
+    @staticmethod
+    def merge(total, value):
+        return (total or 0) + value
+
+    def render_series(self, key, value):
+        yield f"{self.name}{format_labels(self.labels, key)} {format_value(value)}"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, registry, name, help_text, labels=(), buckets=()):
+        super().__init__(registry, name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        if not self.registry.enabled:
+            return
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            key = self._key(labels)
+            series = self._series.get(key)
+            if series is None:
+                # Per-bucket counts (the last one is +Inf), then sum and count.
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def _copy(self, value):
+        return [list(value[0]), value[1], value[2]]
+
+    @staticmethod
+    def merge(total, value):
+        if total is None:
+            return [list(value[0]), value[1], value[2]]
+        total[0] = [a + b for a, b in zip(total[0], value[0])]
+        total[1] += value[1]
+        total[2] += value[2]
+        return total
+
+    def render_series(self, key, value):
+        counts, total, count = value
+        cumulative = 0
+        for bound, bucket_count in zip((*self.buckets, math.inf), counts):
+            cumulative += bucket_count
+            labels = format_labels(self.labels, key, (("le", format_value(bound)),))
+            yield f"{self.name}_bucket{labels} {cumulative}"
+        yield f"{self.name}_sum{format_labels(self.labels, key)} {format_value(total)}"
+        yield f"{self.name}_count{format_labels(self.labels, key)} {count}"
+
+
+class Registry:
+    def __init__(self, enabled=True, directory=None, flush_interval=5.0):
+        self.enabled = enabled
+        self.directory = directory if enabled else None
+        self.flush_interval = flush_interval
+        self._metrics = []
+        self._gauges = []
+        self._flusher = None
+        self._flusher_pid = None
+
+    def counter(self, name, help_text, labels=()):
+        metric = Counter(self, name, help_text, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labels=(), buckets=()):
+        metric = Histogram(self, name, help_text, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help_text, read):
+        """A value read when the metrics are rendered, e.g. a count from the shared store."""
+        self._gauges.append((name, help_text, read))
+
+    def snapshot(self):
+        return {metric.name: metric.snapshot() for metric in self._metrics}
+
+    def start(self):
+        """Begin writing this process's snapshot to ``directory`` (no-op without one).
+
+        Safe to call again after a fork: the child starts its own writer.
+        """
+        if not self.directory or self._flusher_pid == os.getpid():
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._flusher_pid = os.getpid()
+        self._flusher = threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True)
+        self._flusher.start()
+        atexit.register(self.flush)
+
+    def flush(self):
+        if not self.directory:
+            return
+        path = os.path.join(self.directory, f"metrics-{os.getpid()}.json")
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(temp_path, path)
+
+    def _flush_loop(self):
+        stop = threading.Event()
+        while not stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except OSError as exc:
+                print(f"[WARN] Could not write metrics snapshot: {exc}")
+
+    def _snapshots(self):
+        yield self.snapshot()
+        if not self.directory:
+            return
+        own = os.path.join(self.directory, f"metrics-{os.getpid()}.json")
+        for path in glob.glob(os.path.join(self.directory, "metrics-*.json")):
+            if path == own:
+                continue
+            try:
+                with open(path, "r") as f:
+                    yield json.load(f)
+            except (OSError, ValueError):
+                continue
+
+    def render(self):
+        merged = {metric.name: {} for metric in self._metrics}
+        for snapshot in self._snapshots():
+            for metric in self._metrics:
+                series = merged[metric.name]
+                for key, value in snapshot.get(metric.name, {}).items():
+                    series[key] = metric.merge(series.get(key), value)
+
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for key, value in sorted(merged[metric.name].items()):
+                lines.extend(metric.render_series(json.loads(key), value))
+        for name, help_text, read in self._gauges:
+            try:
+                value = read()
+            except Exception as exc:
+                print(f"[WARN] Could not read metric {name}: {exc}")
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {format_value(value)}")
+        return "\n".join(lines) + "\n"
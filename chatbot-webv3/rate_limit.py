@@ -0,0 +1,233 @@
+"""Client-side admission control for provider calls.
+
+Each configured key (``"openai"`` for a whole provider, ``"openai:gpt-4o"`` for
+one model) gets token buckets for requests per minute and tokens per minute,
+each holding up to ten seconds' worth of its rate. A
+call is admitted when every bucket that applies to it has room: the request
+bucket is charged on admission, the token bucket afterwards with the usage the
+provider reported (so it may run into debt and hold back later calls).
+
+Callers that cannot be admitted wait, up to ``max_wait`` seconds and at most
+``max_queue`` at a time per provider/model; beyond that ``RateLimited`` is
+raised at once with the time after which a retry should succeed.
+
+An upstream 429 puts the provider/model into a cool-down for the advertised
+Retry-After (or an exponential backoff), plus jitter, so the requests queued
+behind it do not all retry at the same moment.
+
+Buckets are per process: with several workers, divide the quota between them.
+"""
+import asyncio
+import random
+import threading
+import time
+
+BURST_SECONDS = 10
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+JITTER = 0.2
+
+
+class RateLimited(Exception):
+    status_code = 429
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_rate_limits(value):
+    """``{"openai": {"rpm": 500, "tpm": 200000}}`` (a TOML table) or ``"openai=500/200000,anthropic:claude-3-5-haiku-latest=50/0"``.
+
+    Returns ``{key: (rpm, tpm)}``; 0 or a missing value means no limit.
+    """
+    if not value:
+        return {}
+    if isinstance(value, str):
+        entries = {}
+        for item in value.split(","):
+            key, _, numbers = item.strip().partition("=")
+            rpm, _, tpm = numbers.partition("/")
+            entries[key.strip()] = {"rpm": rpm, "tpm": tpm}
+        value = entries
+    limits = {}
+    for key, entry in value.items():
+        try:
+            rpm = float(entry.get("rpm") or 0)
+            tpm = float(entry.get("tpm") or 0)
+        except (AttributeError, TypeError, ValueError):
+            print(f"[WARN] Ignoring invalid rate limit for {key!r}: {entry!r}")
+            continue
+        if key and (rpm > 0 or tpm > 0):
+            limits[key] = (rpm, tpm)
+    return limits
+
+
+def retry_after_seconds(exc):
+    """The delay an upstream error asked for, from Retry-After / retry-after-ms headers."""
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            # An HTTP date; email.utils is slow to import and rarely needed.
+            from email.utils import parsedate_to_datetime
+
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, retry_after=None):
+    """Jittered wait before retry number ``attempt`` (0-based); never shorter than ``retry_after``."""
+    if retry_after is not None:
+        return retry_after * (1 + random.random() * JITTER)
+    base = min(BACKOFF_CAP, BACKOFF_BASE * 2**attempt)
+    return random.uniform(base / 2, base)
+
+
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60.0
+        # Providers enforce quotas over windows shorter than a minute; allow ten seconds' worth at once.
+        self.capacity = max(1.0, self.rate * BURST_SECONDS)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        self.refill(now)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+
+class RateLimiter:
+    def __init__(self, enabled=False, limits=None, max_wait=10.0, max_queue=32, retries=2):
+        self.enabled = enabled
+        self.limits = dict(limits or {})
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.retries = retries
+        self.stats = {"admitted": 0, "queued": 0, "rejected": 0, "throttled": 0}
+        self._buckets = {
+            key: (TokenBucket(rpm) if rpm else None, TokenBucket(tpm) if tpm else None)
+            for key, (rpm, tpm) in self.limits.items()
+        }
+        self._cooldowns = {}
+        self._waiting = {}
+        self._lock = threading.Lock()
+
+    def _buckets_for(self, provider, model):
+        keys = (provider, f"{provider}:{model}")
+        return [self._buckets[key] for key in keys if key in self._buckets]
+
+    def _wait(self, provider, model, now):
+        wait = self._cooldowns.get(f"{provider}:{model}", 0.0) - now
+        for requests, tokens in self._buckets_for(provider, model):
+            if requests:
+                wait = max(wait, requests.wait_time(1, now))
+            if tokens:
+                # Tokens are charged after the call; admit while the bucket is out of debt.
+                wait = max(wait, tokens.wait_time(0, now))
+        return max(0.0, wait)
+
+    def _reject(self, provider, model, wait, reason):
+        self.stats["rejected"] += 1
+        raise RateLimited(f"Rate limit for {provider}:{model} ({reason}); retry in {wait:.1f}s.", wait)
+
+    def check(self, provider, model):
+        """Raise ``RateLimited`` now if a call could not be admitted within ``max_wait``."""
+        if not self.enabled:
+            return
+        with self._lock:
+            wait = self._wait(provider, model, time.monotonic())
+            if wait > 0 and self._waiting.get(f"{provider}:{model}", 0) >= self.max_queue:
+                self._reject(provider, model, wait, "queue full")
+            if wait > self.max_wait:
+                self._reject(provider, model, wait, "wait too long")
+
+    def _poll(self, provider, model, deadline, queued):
+        """Admit the call (return 0) or return how long to sleep; raise when it cannot wait."""
+        key = f"{provider}:{model}"
+        with self._lock:
+            now = time.monotonic()
+            wait = self._wait(provider, model, now)
+            if wait <= 0:
+                for requests, _ in self._buckets_for(provider, model):
+                    if requests:
+                        requests.level -= 1
+                self.stats["admitted"] += 1
+                return 0.0
+            if not queued:
+                if self._waiting.get(key, 0) >= self.max_queue:
+                    self._reject(provider, model, wait, "queue full")
+                if now + wait > deadline:
+                    self._reject(provider, model, wait, "wait too long")
+                self._waiting[key] = self._waiting.get(key, 0) + 1
+                self.stats["queued"] += 1
+            elif now + wait > deadline:
+                self._reject(provider, model, wait, "wait too long")
+        # A little jitter so waiters released by the same refill do not wake together.
+        return wait * (1 + random.random() * JITTER)
+
+    def _leave(self, provider, model):
+        key = f"{provider}:{model}"
+        with self._lock:
+            self._waiting[key] -= 1
+            if not self._waiting[key]:
+                del self._waiting[key]
+
+    def acquire(self, provider, model, deadline):
+        queued = False
+        try:
+            while True:
+                wait = self._poll(provider, model, deadline, queued)
+                if not wait:
+                    return
+                queued = True
+                time.sleep(wait)
+        finally:
+            if queued:
+                self._leave(provider, model)
+
+    async def aacquire(self, provider, model, deadline):
+        queued = False
+        try:
+            while True:
+                wait = self._poll(provider, model, deadline, queued)
+                if not wait:
+                    return
+                queued = True
+                await asyncio.sleep(wait)
+        finally:
+            if queued:
+                self._leave(provider, model)
+
+    def charge(self, provider, model, tokens):
+        """Take the tokens a finished call used from its token-per-minute buckets."""
+        if not tokens:
+            return
+        with self._lock:
+            now = time.monotonic()
+            for _, bucket in self._buckets_for(provider, model):
+                if bucket:
+                    bucket.refill(now)
+                    bucket.level -= tokens
+
+    def throttled(self, provider, model, delay):
+        """Hold every call to ``provider:model`` back for ``delay`` seconds after an upstream 429."""
+        key = f"{provider}:{model}"
+        with self._lock:
+            now = time.monotonic()
+            self.stats["throttled"] += 1
+            self._cooldowns = {name: until for name, until in self._cooldowns.items() if until > now}
+            self._cooldowns[key] = max(self._cooldowns.get(key, 0.0), now + delay)
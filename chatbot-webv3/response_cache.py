@@ -0,0 +1,213 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """Storage interface for finished replies, keyed by a request hash.
+
+    Entries are ``(reply, usage)`` pairs. ``get`` returns ``None`` for missing
+    or expired keys and counts a hit or miss either way.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def put(self, key, reply, usage):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def _count(self, entry):
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+
+class MemoryResponseCache(ResponseCache):
+    """Process-local LRU with a per-entry expiry time."""
+
+    def __init__(self, max_entries=1000, ttl=86400):
+        super().__init__()
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] <= time.time():
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                entry = entry[:2]
+            return self._count(entry)
+
+    def put(self, key, reply, usage, expires_at=None):
+        with self._lock:
+            self._entries[key] = (reply, usage, expires_at or time.time() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteResponseCache(ResponseCache):
+    """SQLite-backed cache shared by worker processes and kept across restarts.
+
+    Expired rows are dropped on write, and rows beyond ``max_entries`` are
+    evicted least recently used first.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            reply TEXT NOT NULL,
+            usage TEXT,
+            expires_at REAL NOT NULL,
+            last_used REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses (last_used);
+    """
+
+    def __init__(self, path, max_entries=10000, ttl=86400):
+        super().__init__()
+        self.path = path
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self._local = threading.local()
+        self._connect().executescript(self.SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        return self._count(self.get_entry(key))
+
+    def get_entry(self, key):
+        """Return ``(reply, usage, expires_at)`` without touching the counters."""
+        now = time.time()
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT reply, usage, expires_at FROM responses WHERE key = ? AND expires_at > ?",
+            (key, now),
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+        return row[0], json.loads(row[1]) if row[1] else None, row[2]
+
+    def put(self, key, reply, usage, expires_at=None):
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, reply, usage, expires_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, reply, json.dumps(usage) if usage else None, expires_at or now + self.ttl, now),
+            )
+            conn.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+            conn.execute(
+                "DELETE FROM responses WHERE key IN "
+                "(SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def clear(self):
+        self._connect().execute("DELETE FROM responses")
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+
+class TieredResponseCache(ResponseCache):
+    """Memory LRU in front of the SQLite cache; SQLite hits are promoted to memory."""
+
+    def __init__(self, memory, disk):
+        super().__init__()
+        self.memory = memory
+        self.disk = disk
+
+    def get(self, key):
+        entry = self.memory.get(key)
+        if entry is None:
+            stored = self.disk.get_entry(key)
+            self.disk._count(stored)
+            if stored is not None:
+                self.memory.put(key, *stored)
+                entry = stored[:2]
+        return self._count(entry)
+
+    def put(self, key, reply, usage):
+        expires_at = time.time() + self.disk.ttl
+        self.disk.put(key, reply, usage, expires_at)
+        self.memory.put(key, reply, usage, expires_at)
+
+    def clear(self):
+        self.memory.clear()
+        self.disk.clear()
+
+    def __len__(self):
+        return len(self.disk)
+
+    def stats(self):
+        return {
+            **super().stats(),
+            "memory": self.memory.stats(),
+            "sqlite": self.disk.stats(),
+        }
+
+
+def open_response_cache(backend, path=None, max_entries=1000, ttl=86400):
+    """Return a cache for ``backend`` ("memory" or "sqlite"), or ``None`` when disabled."""
+    if not backend or backend == "off":
+        return None
+    if backend == "memory":
+        return MemoryResponseCache(max_entries, ttl)
+    if backend == "sqlite":
+        return TieredResponseCache(
+            MemoryResponseCache(max_entries, ttl),
+            SQLiteResponseCache(path or "response_cache.db", max_entries, ttl),
+        )
+    raise ValueError(f"Unknown response cache backend: {backend}")
@@ -0,0 +1,225 @@
+"""Ordered failover and hedged requests across provider backends.
+
+A ``Router`` runs one call against a list of candidates (the request's own
+provider/model first, then configured alternates) and returns the first
+success:
+
+* ``failover``: one attempt at a time; a retryable error or an attempt running
+  past ``timeout`` moves on to the next candidate;
+* ``hedge``: as failover, but if no attempt has finished ``hedge_after``
+  seconds after the last one started, the next candidate is started alongside
+  it. The first success wins and the others are cancelled.
+
+Async attempts are cancelled outright. Threaded attempts cannot be interrupted;
+their results are handed to ``discard`` (e.g. to close a stream) when they
+arrive, and callers should give the provider call its own timeout.
+"""
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+MODES = ("off", "failover", "hedge")
+RETRYABLE_STATUS = (408, 409, 429)
+MAX_THREADS = 32
+
+
+class AttemptTimeout(TimeoutError):
+    pass
+
+
+def parse_backends(value):
+    """``"openai:gpt-4o-mini, anthropic:claude-3-5-haiku-latest"`` (or a TOML list) -> [(provider, model)]."""
+    if not value:
+        return []
+    items = value.split(",") if isinstance(value, str) else value
+    backends = []
+    for item in items:
+        provider, _, model = str(item).strip().partition(":")
+        if provider:
+            backends.append((provider.strip(), model.strip()))
+    return backends
+
+
+def error_status(exc):
+    # openai/anthropic use status_code, google-genai uses code.
+    status = getattr(exc, "status_code", None) or getattr(exc, "code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_retryable(exc):
+    """Timeouts, connection failures, throttling and 5xx are worth another backend; bad requests are not."""
+    status = error_status(exc)
+    return status is None or status in RETRYABLE_STATUS or status >= 500
+
+
+class _Race:
+    """Bookkeeping shared by the threaded and async runners."""
+
+    def __init__(self, router, candidates):
+        self.router = router
+        self.queue = list(candidates)
+        self.pending = {}
+        self.last_started = None
+        self.errors = []
+
+    def next_wakeup(self, now):
+        deadlines = []
+        if self.router.timeout:
+            deadlines.extend(started + self.router.timeout for _, started in self.pending.values())
+        if self.router.mode == "hedge" and self.queue and self.router.hedge_after is not None:
+            deadlines.append(self.last_started + self.router.hedge_after)
+        return max(0.0, min(deadlines) - now) if deadlines else None
+
+    def launched(self, handle, candidate):
+        self.pending[handle] = (candidate, time.monotonic())
+        self.last_started = time.monotonic()
+        self.router.count("attempts")
+        if len(self.pending) > 1:
+            self.router.count("hedges")
+
+    def failed(self, candidate, exc):
+        self.errors.append(exc)
+        self.router.on_failure(candidate, exc)
+        if not is_retryable(exc):
+            raise exc
+
+    def expired(self, now):
+        timeout = self.router.timeout
+        if not timeout:
+            return []
+        late = [handle for handle, (_, started) in self.pending.items() if now - started >= timeout]
+        for handle in late:
+            candidate, _ = self.pending.pop(handle)
+            self.errors.append(AttemptTimeout(f"No response within {timeout:g}s"))
+            self.router.on_failure(candidate, self.errors[-1])
+        return late
+
+    def should_launch(self, now):
+        if not self.queue:
+            return False
+        if not self.pending:
+            return True
+        return (
+            self.router.mode == "hedge"
+            and self.router.hedge_after is not None
+            and now - self.last_started >= self.router.hedge_after
+        )
+
+    def exhausted(self):
+        if len(self.errors) == 1:
+            return self.errors[0]
+        if all(hasattr(exc, "retry_after") for exc in self.errors):
+            # Every backend is rate limited: report the one that frees up first.
+            return min(self.errors, key=lambda exc: exc.retry_after)
+        summary = "; ".join(f"{type(exc).__name__}: {exc}" for exc in self.errors)
+        return RuntimeError(f"All backends failed: {summary}")
+
+
+class Router:
+    def __init__(self, mode="off", timeout=None, hedge_after=None, on_failure=None):
+        self.mode = mode if mode in MODES else "off"
+        self.timeout = timeout or None
+        self.hedge_after = hedge_after
+        self.stats = {"attempts": 0, "hedges": 0, "failures": 0, "alternate_wins": 0}
+        self._on_failure = on_failure
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.mode != "off"
+
+    def count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def on_failure(self, candidate, exc):
+        self.count("failures")
+        if self._on_failure:
+            self._on_failure(candidate, exc)
+
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=MAX_THREADS, thread_name_prefix="router")
+            return self._executor
+
+    def run(self, candidates, call, discard=None):
+        """Return ``(candidate, call(candidate))`` for the first candidate that succeeds."""
+        if not self.enabled:
+            return candidates[0], call(candidates[0])
+        race = _Race(self, candidates)
+        try:
+            while race.queue or race.pending:
+                now = time.monotonic()
+                for handle in race.expired(now):
+                    self._abandon(handle, discard)
+                if race.should_launch(now):
+                    candidate = race.queue.pop(0)
+                    # Copy the context so tracing spans follow the call into the pool thread.
+                    context = contextvars.copy_context()
+                    race.launched(self.executor().submit(context.run, call, candidate), candidate)
+                    continue
+                if not race.pending:
+                    break
+                done, _ = wait(race.pending, timeout=race.next_wakeup(now), return_when=FIRST_COMPLETED)
+                for future in done:
+                    candidate, _ = race.pending.pop(future)
+                    exc = future.exception()
+                    if exc is None:
+                        return self._won(candidates, candidate), future.result()
+                    race.failed(candidate, exc)
+            raise race.exhausted()
+        finally:
+            for future in race.pending:
+                self._abandon(future, discard)
+
+    async def arun(self, candidates, call, discard=None):
+        """Async ``run``: ``call`` is a coroutine function and losing attempts are cancelled."""
+        if not self.enabled:
+            return candidates[0], await call(candidates[0])
+        race = _Race(self, candidates)
+        try:
+            while race.queue or race.pending:
+                now = time.monotonic()
+                for task in race.expired(now):
+                    task.cancel()
+                if race.should_launch(now):
+                    candidate = race.queue.pop(0)
+                    race.launched(asyncio.ensure_future(call(candidate)), candidate)
+                    continue
+                if not race.pending:
+                    break
+                done, _ = await asyncio.wait(
+                    race.pending, timeout=race.next_wakeup(now), return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    candidate, _ = race.pending.pop(task)
+                    exc = task.exception()
+                    if exc is None:
+                        return self._won(candidates, candidate), task.result()
+                    race.failed(candidate, exc)
+            raise race.exhausted()
+        finally:
+            for task in race.pending:
+                if task.done() and not task.cancelled() and task.exception() is None and discard:
+                    await discard(task.result())
+                task.cancel()
+
+    def _won(self, candidates, candidate):
+        if candidate is not candidates[0]:
+            self.count("alternate_wins")
+        return candidate
+
+    @staticmethod
+    def _abandon(future, discard):
+        if future.cancel() or not discard:
+            return
+
+        def discard_result(done):
+            if not done.cancelled() and done.exception() is None:
+                discard(done.result())
+
+        future.add_done_callback(discard_result)
@@ -0,0 +1,173 @@
+"""Streaming readers and writers for session archives.
+
+Two formats are supported:
+
+* v3 JSON: ``{"version": "v3", "sessions": [...]}`` (also a bare list of
+  sessions, or a single session object);
+* NDJSON: an optional ``{"version": "v3", "format": "ndjson"}`` header line
+  followed by one session object per line.
+
+Both are written one session at a time and read incrementally, so memory use is
+bounded by the largest single session rather than the archive; a value larger than
+``max_value_bytes`` (or malformed JSON that would be read to the end looking for
+the end of a value) fails with ``ArchiveError`` instead of being buffered.
+"""
+import codecs
+import json
+
+ARCHIVE_VERSION = "v3"
+READ_SIZE = 64 * 1024
+MAX_VALUE_BYTES = 64 * 1024 * 1024
+WHITESPACE = " \t\r\n"
+# A value cut off by the end of the buffer fails to decode within this many
+# characters of the end; an error earlier than that is a syntax error.
+INCOMPLETE_TAIL = 16
+
+_decoder = json.JSONDecoder()
+
+
+def export_ndjson(sessions):
+    yield json.dumps({"version": ARCHIVE_VERSION, "format": "ndjson"}) + "\n"
+    for session in sessions:
+        yield json.dumps(session) + "\n"
+
+
+def export_json(sessions):
+    yield f'{{"version": "{ARCHIVE_VERSION}", "sessions": ['
+    for index, session in enumerate(sessions):
+        yield ("," if index else "") + "\n" + json.dumps(session)
+    yield "\n]}\n"
+
+
+class ArchiveError(ValueError):
+    pass
+
+
+class _Reader:
+    """Text buffer over a binary stream that ``raw_decode`` can consume value by value."""
+
+    def __init__(self, stream, max_value_bytes=MAX_VALUE_BYTES):
+        self.stream = stream
+        self.max_value_bytes = max_value_bytes
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.bytes_read = 0
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+
+    def fill(self, size=READ_SIZE):
+        if self.eof:
+            return False
+        try:
+            chunk = self.stream.read(size)
+            self.eof = not chunk
+            self.bytes_read += len(chunk)
+            text = self._decoder.decode(chunk, final=self.eof)
+        except UnicodeDecodeError as exc:
+            raise ArchiveError(f"Archive is not UTF-8 text (near byte {self.bytes_read}).") from exc
+        except (OSError, ValueError) as exc:
+            raise ArchiveError(f"Failed to read file: {exc}") from exc
+        self.buffer = self.buffer[self.pos:] + text
+        self.pos = 0
+        return bool(chunk or text)
+
+    def peek(self):
+        """Next non-whitespace character, or ``""`` at the end of input."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ArchiveError(f"Expected {char!r} near byte {self.bytes_read}")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        read_size = READ_SIZE
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError as exc:
+                incomplete = (
+                    exc.msg.startswith("Unterminated string")
+                    or len(self.buffer) - exc.pos <= INCOMPLETE_TAIL
+                )
+                if not incomplete:
+                    raise ArchiveError(f"Invalid JSON near byte {self.bytes_read}: {exc.msg}") from exc
+                # UTF-8 is at least one byte per character, so this bounds the buffer in bytes too.
+                if len(self.buffer) - self.pos > self.max_value_bytes:
+                    raise ArchiveError(
+                        f"A value near byte {self.bytes_read} is larger than "
+                        f"{self.max_value_bytes // (1024 * 1024)} MB (or is not terminated)."
+                    ) from exc
+                # Incomplete value: read more and retry. Grow the reads so a very
+                # large session is not re-scanned once per 64 KB.
+                if not self.fill(read_size):
+                    raise ArchiveError(f"Invalid JSON: {exc}") from exc
+                read_size = min(read_size * 2, 16 * 1024 * 1024)
+                continue
+            except RecursionError as exc:
+                raise ArchiveError(f"JSON nested too deeply near byte {self.bytes_read}") from exc
+            # A number at the end of the buffer may continue in the next chunk.
+            if end == len(self.buffer) and not isinstance(value, (dict, list, str)) and self.fill():
+                continue
+            self.pos = end
+            return value
+
+
+def _iter_array(reader):
+    reader.expect("[")
+    if reader.peek() == "]":
+        reader.pos += 1
+        return
+    while True:
+        yield reader.value()
+        char = reader.peek()
+        reader.pos += 1
+        if char == "]":
+            return
+        if char != ",":
+            raise ArchiveError(f"Expected ',' or ']' near byte {reader.bytes_read}")
+
+
+def _iter_object(reader):
+    # Stream the "sessions" array of a v3 archive element by element; any other
+    # object is either an NDJSON header (skipped) or a session in its own right.
+    reader.expect("{")
+    fields = {}
+    while reader.peek() != "}":
+        key = reader.value()
+        reader.expect(":")
+        if key == "sessions" and reader.peek() == "[":
+            yield from _iter_array(reader)
+        else:
+            fields[key] = reader.value()
+        if reader.peek() == ",":
+            reader.pos += 1
+    reader.pos += 1
+    if "messages" in fields:
+        yield fields
+
+
+def iter_archive(stream, max_value_bytes=MAX_VALUE_BYTES):
+    """Yield session dicts from a binary stream holding either archive format.
+
+    The stream is read as a sequence of JSON values, which covers a v3 document,
+    a bare list of sessions and NDJSON alike.
+    """
+    reader = _Reader(stream, max_value_bytes)
+    while True:
+        char = reader.peek()
+        if not char:
+            return
+        if char == "[":
+            yield from _iter_array(reader)
+        elif char == "{":
+            yield from _iter_object(reader)
+        else:
+            raise ArchiveError(f"Unexpected {char!r} near byte {reader.bytes_read}")
@@ -0,0 +1,472 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+SUMMARY_FIELDS = ("id", "title", "provider", "model", "created_at", "updated_at")
+UPDATABLE_FIELDS = ("title", "provider", "model", "created_at", "updated_at")
+
+
+class SessionConflict(Exception):
+    """Raised when a write names an ``expected_revision`` the session has moved past."""
+
+
+class SessionStore:
+    """Storage interface used by the chat routes.
+
+    Sessions are plain dicts shaped like the v3 export format. ``get`` returns a
+    copy; callers persist changes through ``update``, ``append_messages`` and
+    ``clear_messages`` rather than by mutating the returned dict.
+
+    Every write bumps the session's ``revision``. Passing ``expected_revision``
+    to ``update`` or ``append_messages`` makes the write conditional: it raises
+    ``SessionConflict`` if another writer got there first, so the caller can
+    re-read the session and retry instead of overwriting that change.
+    """
+
+    def create(self, session):
+        raise NotImplementedError
+
+    def create_many(self, sessions):
+        """Insert several sessions at once; backends may batch them in one transaction."""
+        for session in sessions:
+            self.create(session)
+
+    def get(self, session_id):
+        raise NotImplementedError
+
+    def get_summary(self, session_id):
+        """Return the session header with ``message_count`` but no messages."""
+        raise NotImplementedError
+
+    def get_messages(self, session_id, before=None, since=None, limit=None):
+        """Return ``[(seq, message), ...]`` oldest first, or ``None`` if the session is gone.
+
+        Only messages with ``since <= seq < before`` are included. With ``limit``
+        the newest matching messages are returned, so paging backwards works.
+        """
+        raise NotImplementedError
+
+    def list_sessions(self):
+        """Return session summaries, most recently updated first."""
+        raise NotImplementedError
+
+    def count(self):
+        raise NotImplementedError
+
+    def create_if_empty(self, session):
+        """Create ``session`` only if the store holds none; return whether it did."""
+        raise NotImplementedError
+
+    def update(self, session_id, expected_revision=None, **fields):
+        raise NotImplementedError
+
+    def append_messages(self, session_id, messages, expected_revision=None, **fields):
+        """Append ``messages``; return the new message count, or ``None`` if the session is gone."""
+        raise NotImplementedError
+
+    def clear_messages(self, session_id, **fields):
+        raise NotImplementedError
+
+    def delete(self, session_id):
+        raise NotImplementedError
+
+    def try_lock(self, session_id, owner, lease):
+        """Take the session's turn lock for ``owner`` unless someone else holds it.
+
+        The lock lapses after ``lease`` seconds, or as soon as the process that
+        took it has exited, so a crashed worker cannot block a session for long.
+        """
+        raise NotImplementedError
+
+    def unlock(self, session_id, owner):
+        raise NotImplementedError
+
+
+def summarize(session, message_count):
+    summary = {key: session[key] for key in SUMMARY_FIELDS}
+    summary["message_count"] = message_count
+    return summary
+
+
+def check_revision(session_id, revision, expected_revision):
+    if expected_revision is not None and revision != expected_revision:
+        raise SessionConflict(f"Session {session_id} is at revision {revision}, expected {expected_revision}")
+
+
+def lock_is_free(pid, expires_at, now):
+    if expires_at <= now:
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+def pick_fields(fields):
+    unknown = set(fields) - set(UPDATABLE_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown session fields: {', '.join(sorted(unknown))}")
+    return fields
+
+
+class MemorySessionStore(SessionStore):
+    """Process-local store; contents are lost on restart."""
+
+    def __init__(self):
+        self._sessions = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def create(self, session):
+        with self._lock:
+            self._insert(session)
+        return self.get(session["id"])
+
+    def create_if_empty(self, session):
+        with self._lock:
+            if self._sessions:
+                return False
+            self._insert(session)
+            return True
+
+    def _insert(self, session):
+        self._sessions[session["id"]] = {**session, "messages": list(session.get("messages") or []), "revision": 0}
+
+    def get(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            return {**session, "messages": list(session["messages"])}
+
+    def get_summary(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            return dict(summarize(session, len(session["messages"])), revision=session["revision"])
+
+    def get_messages(self, session_id, before=None, since=None, limit=None):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            messages = session["messages"]
+            stop = len(messages) if before is None else max(0, min(before, len(messages)))
+            start = 0 if since is None else max(0, since)
+            if limit is not None:
+                start = max(start, stop - limit)
+            return [(seq, messages[seq]) for seq in range(start, stop)]
+
+    def list_sessions(self):
+        with self._lock:
+            items = sorted(self._sessions.values(), key=lambda item: item["updated_at"], reverse=True)
+            return [summarize(item, len(item["messages"])) for item in items]
+
+    def count(self):
+        return len(self._sessions)
+
+    def update(self, session_id, expected_revision=None, **fields):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return False
+            check_revision(session_id, session["revision"], expected_revision)
+            session.update(pick_fields(fields))
+            session["revision"] += 1
+            return True
+
+    def append_messages(self, session_id, messages, expected_revision=None, **fields):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            check_revision(session_id, session["revision"], expected_revision)
+            session["messages"].extend(messages)
+            session.update(pick_fields(fields))
+            session["revision"] += 1
+            return len(session["messages"])
+
+    def clear_messages(self, session_id, **fields):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return False
+            session["messages"] = []
+            session.update(pick_fields(fields))
+            session["revision"] += 1
+            return True
+
+    def delete(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def try_lock(self, session_id, owner, lease):
+        now = time.time()
+        with self._lock:
+            held = self._locks.get(session_id)
+            if held is not None and held[0] != owner and held[1] > now:
+                return False
+            self._locks[session_id] = (owner, now + lease)
+            return True
+
+    def unlock(self, session_id, owner):
+        with self._lock:
+            if self._locks.get(session_id, (None,))[0] == owner:
+                del self._locks[session_id]
+
+
+class SQLiteSessionStore(SessionStore):
+    """SQLite-backed store in WAL mode, safe to share between worker processes.
+
+    Each message is its own row keyed by (session_id, seq), so a chat turn is an
+    append of two rows plus a small update of the session header instead of a
+    rewrite of the whole conversation.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY,
+            title TEXT NOT NULL,
+            provider TEXT,
+            model TEXT,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            message_count INTEGER NOT NULL DEFAULT 0,
+            revision INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS idx_sessions_updated_at ON sessions (updated_at);
+        CREATE TABLE IF NOT EXISTS messages (
+            session_id TEXT NOT NULL REFERENCES sessions (id) ON DELETE CASCADE,
+            seq INTEGER NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (session_id, seq)
+        );
+        CREATE TABLE IF NOT EXISTS session_locks (
+            session_id TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            pid INTEGER NOT NULL,
+            expires_at REAL NOT NULL
+        );
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._connect().executescript(self.SCHEMA)
+        self._migrate()
+
+    def _connect(self):
+        # Connections are per thread and per process: one opened before a
+        # gunicorn fork must not be reused by the workers.
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _migrate(self):
+        # Databases created before sessions carried a revision.
+        with self._write() as conn:
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(sessions)")}
+            if "revision" not in columns:
+                conn.execute("ALTER TABLE sessions ADD COLUMN revision INTEGER NOT NULL DEFAULT 0")
+
+    def _write(self):
+        return _Transaction(self._connect())
+
+    def create(self, session):
+        with self._write() as conn:
+            self._insert_session(conn, session)
+        return self.get(session["id"])
+
+    def create_many(self, sessions):
+        with self._write() as conn:
+            for session in sessions:
+                self._insert_session(conn, session)
+
+    def create_if_empty(self, session):
+        with self._write() as conn:
+            if conn.execute("SELECT 1 FROM sessions LIMIT 1").fetchone() is not None:
+                return False
+            self._insert_session(conn, session)
+            return True
+
+    def get(self, session_id):
+        conn = self._connect()
+        row = conn.execute("SELECT * FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if row is None:
+            return None
+        session = {key: row[key] for key in SUMMARY_FIELDS}
+        session["revision"] = row["revision"]
+        session["messages"] = [
+            json.loads(item["data"])
+            for item in conn.execute(
+                "SELECT data FROM messages WHERE session_id = ? ORDER BY seq",
+                (session_id,),
+            )
+        ]
+        return session
+
+    def get_summary(self, session_id):
+        row = self._connect().execute(
+            "SELECT id, title, provider, model, created_at, updated_at, message_count, revision "
+            "FROM sessions WHERE id = ?",
+            (session_id,),
+        ).fetchone()
+        return dict(row) if row else None
+
+    def get_messages(self, session_id, before=None, since=None, limit=None):
+        conn = self._connect()
+        if conn.execute("SELECT 1 FROM sessions WHERE id = ?", (session_id,)).fetchone() is None:
+            return None
+        clauses = ["session_id = ?"]
+        params = [session_id]
+        if before is not None:
+            clauses.append("seq < ?")
+            params.append(before)
+        if since is not None:
+            clauses.append("seq >= ?")
+            params.append(since)
+        params.append(-1 if limit is None else limit)
+        rows = conn.execute(
+            f"SELECT seq, data FROM messages WHERE {' AND '.join(clauses)} ORDER BY seq DESC LIMIT ?",
+            params,
+        ).fetchall()
+        return [(row["seq"], json.loads(row["data"])) for row in reversed(rows)]
+
+    def list_sessions(self):
+        rows = self._connect().execute(
+            "SELECT id, title, provider, model, created_at, updated_at, message_count "
+            "FROM sessions ORDER BY updated_at DESC"
+        )
+        return [dict(row) for row in rows]
+
+    def count(self):
+        return self._connect().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def update(self, session_id, expected_revision=None, **fields):
+        with self._write() as conn:
+            row = conn.execute("SELECT revision FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            if row is None:
+                return False
+            check_revision(session_id, row["revision"], expected_revision)
+            return self._update_header(conn, session_id, pick_fields(fields))
+
+    def append_messages(self, session_id, messages, expected_revision=None, **fields):
+        with self._write() as conn:
+            row = conn.execute(
+                "SELECT message_count, revision FROM sessions WHERE id = ?",
+                (session_id,),
+            ).fetchone()
+            if row is None:
+                return None
+            check_revision(session_id, row["revision"], expected_revision)
+            start = row["message_count"]
+            self._insert_messages(conn, session_id, start, messages)
+            fields = dict(pick_fields(fields), message_count=start + len(messages))
+            self._update_header(conn, session_id, fields)
+            return fields["message_count"]
+
+    def clear_messages(self, session_id, **fields):
+        with self._write() as conn:
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            fields = dict(pick_fields(fields), message_count=0)
+            return self._update_header(conn, session_id, fields)
+
+    def delete(self, session_id):
+        with self._write() as conn:
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            return conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,)).rowcount > 0
+
+    def try_lock(self, session_id, owner, lease):
+        now = time.time()
+        with self._write() as conn:
+            row = conn.execute(
+                "SELECT owner, pid, expires_at FROM session_locks WHERE session_id = ?",
+                (session_id,),
+            ).fetchone()
+            if row is not None and row["owner"] != owner and not lock_is_free(row["pid"], row["expires_at"], now):
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO session_locks (session_id, owner, pid, expires_at) VALUES (?, ?, ?, ?)",
+                (session_id, owner, os.getpid(), now + lease),
+            )
+            return True
+
+    def unlock(self, session_id, owner):
+        self._connect().execute(
+            "DELETE FROM session_locks WHERE session_id = ? AND owner = ?",
+            (session_id, owner),
+        )
+
+    def _insert_session(self, conn, session):
+        messages = session.get("messages") or []
+        conn.execute(
+            "INSERT INTO sessions (id, title, provider, model, created_at, updated_at, message_count) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                session["id"],
+                session["title"],
+                session["provider"],
+                session["model"],
+                session["created_at"],
+                session["updated_at"],
+                len(messages),
+            ),
+        )
+        self._insert_messages(conn, session["id"], 0, messages)
+
+    def _insert_messages(self, conn, session_id, start, messages):
+        conn.executemany(
+            "INSERT INTO messages (session_id, seq, data) VALUES (?, ?, ?)",
+            [
+                (session_id, start + offset, json.dumps(message))
+                for offset, message in enumerate(messages)
+            ],
+        )
+
+    def _update_header(self, conn, session_id, fields):
+        assignments = "".join(f"{key} = ?, " for key in fields)
+        cursor = conn.execute(
+            f"UPDATE sessions SET {assignments}revision = revision + 1 WHERE id = ?",
+            (*fields.values(), session_id),
+        )
+        return cursor.rowcount > 0
+
+
+class _Transaction:
+    """``BEGIN IMMEDIATE`` ... ``COMMIT`` block so concurrent writers queue on the lock."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.conn.execute("COMMIT")
+        else:
+            self.conn.execute("ROLLBACK")
+        return False
+
+
+def open_session_store(backend, path=None):
+    if backend == "memory":
+        return MemorySessionStore()
+    if backend == "sqlite":
+        return SQLiteSessionStore(path or "sessions.db")
+    raise ValueError(f"Unknown session store backend: {backend}")
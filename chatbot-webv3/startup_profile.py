@@ -0,0 +1,47 @@
+"""Where start-up time goes: ``python -X importtime`` for one module, summarized.
+
+Used by ``python app.py --profile-startup``. The module is imported in a fresh
+interpreter, so nothing already loaded in this process hides its cost.
+"""
+import os
+import subprocess
+import sys
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def import_breakdown(module, env=None):
+    """Return ``(total_ms, [(dependency, cumulative_ms), ...])`` for importing ``module``."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=APP_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    children = []
+    for line in result.stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2][1:]
+        depth = (len(name) - len(name.lstrip())) // 2
+        cumulative_ms = int(parts[1]) / 1000
+        # Lines come children first; a module's direct imports are the depth-1 lines just before it.
+        if depth == 0:
+            if name.strip() == module:
+                return cumulative_ms, sorted(children, key=lambda item: item[1], reverse=True)
+            children = []
+        elif depth == 1:
+            children.append((name.strip(), cumulative_ms))
+    raise RuntimeError(f"Could not import {module}:\n{result.stderr[-2000:]}")
+
+
+def print_breakdown(module, phases=(), limit=12, env=None):
+    """Print the import breakdown, then ``phases``: (label, seconds) timed by the caller."""
+    total_ms, children = import_breakdown(module, env)
+    print(f"import {module}: {total_ms:8.1f} ms")
+    for name, cumulative_ms in children[:limit]:
+        print(f"  {name:<32}{cumulative_ms:8.1f} ms")
+    for label, seconds in phases:
+        print(f"{label}: {seconds * 1000:.1f} ms")
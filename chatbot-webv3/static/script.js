@@ -33,10 +33,16 @@ const loaderText = [
   "      /____/                                     "
 ].join("\n");
 
+const MESSAGE_PAGE_SIZE = 50;
+
 const state = {
   sessions: [],
   activeSessionId: null,
   activeSession: null,
+  version: 0,
+  oldestSeq: 0,
+  hasMore: false,
+  loadingOlder: false,
 };
 
 function setTheme(isDark) {
@@ -61,6 +67,7 @@ function loadSettings() {
   });
   const showTokens = localStorage.getItem("show_tokens") === "true";
   showTokensToggle.checked = showTokens;
+  syncTokenVisibility();
   updateValueSpans();
 }
 
@@ -98,8 +105,8 @@ function saveSettings() {
   if (element) {
     element.addEventListener("change", () => {
       saveSettings();
-      if (element === showTokensToggle && state.activeSession) {
-        renderMessages(state.activeSession.messages || []);
+      if (element === showTokensToggle) {
+        syncTokenVisibility();
       }
       if (element === providerSelect) {
         updateProviderFields();
@@ -171,10 +178,15 @@ function formatTokens(tokens) {
   const prompt = tokens.prompt ?? "-";
   const output = tokens.output ?? "-";
   const total = tokens.total ?? "-";
-  return `TOKENS P:${prompt} O:${output} T:${total}`;
+  const source = tokens.cached ? " (CACHED)" : "";
+  return `TOKENS P:${prompt} O:${output} T:${total}${source}`;
 }
 
-function appendMessage(message) {
+function syncTokenVisibility() {
+  chatBox.classList.toggle("hide-tokens", !showTokensToggle.checked);
+}
+
+function createMessageElement(message) {
   const div = document.createElement("div");
   div.className = `message ${message.role === "user" ? "user" : "bot"}`;
 
@@ -184,13 +196,28 @@ function appendMessage(message) {
   if (message.file) {
     content += `<span class="attachment">ATTACH ${message.file}</span>`;
   }
-  if (showTokensToggle.checked && message.tokens) {
+  if (message.tokens) {
     content += `<span class="msg-meta">${formatTokens(message.tokens)}</span>`;
   }
 
   div.innerHTML = content;
+  return div;
+}
+
+function appendMessage(message) {
+  const div = createMessageElement(message);
   chatBox.appendChild(div);
   chatBox.scrollTop = chatBox.scrollHeight;
+  return div;
+}
+
+function prependMessages(messages) {
+  const fragment = document.createDocumentFragment();
+  messages.forEach(msg => fragment.appendChild(createMessageElement(msg)));
+  const previousHeight = chatBox.scrollHeight;
+  chatBox.insertBefore(fragment, chatBox.firstChild);
+  // Keep the messages the user was reading in place.
+  chatBox.scrollTop += chatBox.scrollHeight - previousHeight;
 }
 
 function appendLoadingMessage() {
@@ -208,11 +235,19 @@ function appendLoadingMessage() {
 }
 
 function renderMessages(messages) {
-  chatBox.innerHTML = "";
-  messages.forEach(msg => appendMessage(msg));
+  const fragment = document.createDocumentFragment();
+  messages.forEach(msg => fragment.appendChild(createMessageElement(msg)));
+  chatBox.replaceChildren(fragment);
+  chatBox.scrollTop = chatBox.scrollHeight;
   syncEmptyState();
 }
 
+function setMessagePage(data) {
+  state.version = data.version;
+  state.oldestSeq = data.messages.length ? data.messages[0].seq : data.version;
+  state.hasMore = data.has_more;
+}
+
 function renderSessions() {
   sessionListEl.innerHTML = "";
   state.sessions.forEach(session => {
@@ -253,19 +288,45 @@ async function loadSessions() {
 }
 
 async function loadSession(sessionId) {
-  const res = await fetch(`/sessions/${sessionId}`);
+  const res = await fetch(`/sessions/${sessionId}/messages?limit=${MESSAGE_PAGE_SIZE}`);
   if (!res.ok) return;
-  const session = await res.json();
+  const data = await res.json();
+  const session = data.session;
   state.activeSessionId = session.id;
   state.activeSession = session;
+  setMessagePage(data);
   sessionTitleInput.value = session.title || "";
   providerSelect.value = session.provider || providerSelect.value;
   modelInput.value = session.model || modelInput.value;
-  renderMessages(session.messages || []);
+  renderMessages(data.messages);
   renderSessions();
   updateProviderFields();
 }
 
+async function loadOlderMessages() {
+  if (!state.hasMore || state.loadingOlder || !state.activeSessionId) return;
+  const sessionId = state.activeSessionId;
+  state.loadingOlder = true;
+  try {
+    const res = await fetch(`/sessions/${sessionId}/messages?before=${state.oldestSeq}&limit=${MESSAGE_PAGE_SIZE}`);
+    if (!res.ok || sessionId !== state.activeSessionId) return;
+    const data = await res.json();
+    if (data.messages.length) {
+      state.oldestSeq = data.messages[0].seq;
+      prependMessages(data.messages);
+    }
+    state.hasMore = data.has_more;
+  } finally {
+    state.loadingOlder = false;
+  }
+}
+
+chatBox.addEventListener("scroll", () => {
+  if (chatBox.scrollTop < 80) {
+    loadOlderMessages();
+  }
+});
+
 async function createSession() {
   const res = await fetch("/sessions", {
     method: "POST",
@@ -306,7 +367,10 @@ async function clearSession() {
   if (res.ok) {
     const session = await res.json();
     state.activeSession = session;
-    renderMessages(session.messages || []);
+    state.version = 0;
+    state.oldestSeq = 0;
+    state.hasMore = false;
+    renderMessages([]);
   }
 }
 
@@ -317,10 +381,12 @@ async function exportSession() {
   downloadJson(data, `chat-session-${state.activeSessionId}.json`);
 }
 
-async function exportAllSessions() {
-  const res = await fetch("/sessions/export");
-  const data = await res.json();
-  downloadJson(data, "chat-sessions.json");
+function exportAllSessions() {
+  // Let the browser stream the archive straight to disk.
+  const link = document.createElement("a");
+  link.href = "/sessions/export?format=ndjson";
+  link.download = "chat-sessions.ndjson";
+  link.click();
 }
 
 function downloadJson(data, filename) {
@@ -336,15 +402,36 @@ function downloadJson(data, filename) {
 async function importSessions(file) {
   const formData = new FormData();
   formData.append("file", file);
-  const res = await fetch("/sessions/import", {
-    method: "POST",
-    body: formData,
-  });
-  const data = await res.json();
-  if (!res.ok) {
-    appendMessage({ role: "assistant", content: data.error || "Import failed." });
+  const statusEl = appendMessage({ role: "assistant", content: `Importing ${file.name}...` });
+  const statusText = statusEl.querySelector(".msg-text");
+  let data = null;
+  let errorText = null;
+  try {
+    const res = await fetch("/sessions/import?progress=1", {
+      method: "POST",
+      body: formData,
+    });
+    if (!res.ok) {
+      errorText = `Import failed (${res.status}).`;
+    } else {
+      await readNdjson(res, event => {
+        if (event.type === "progress") {
+          statusText.textContent = `Importing ${file.name}... ${event.imported} sessions`;
+        } else if (event.type === "done") {
+          data = event;
+        } else if (event.type === "error") {
+          errorText = event.error;
+        }
+      });
+    }
+  } catch (err) {
+    errorText = `Import failed: ${err.message}`;
+  }
+  if (errorText || !data) {
+    statusText.textContent = errorText || "Import failed.";
     return;
   }
+  statusEl.remove();
   state.sessions = data.sessions || [];
   state.activeSessionId = data.imported?.[0] || state.activeSessionId;
   renderSessions();
@@ -365,7 +452,7 @@ async function sendMessage() {
     await createSession();
   }
 
-  appendMessage({ role: "user", content: message, file: file?.name });
+  const pendingEls = [appendMessage({ role: "user", content: message, file: file?.name })];
 
   userInput.value = "";
   fileInput.value = "";
@@ -388,6 +475,8 @@ async function sendMessage() {
     }
   });
 
+  formData.append("stream", "1");
+
   const loadingEl = appendLoadingMessage();
 
   try {
@@ -396,40 +485,128 @@ async function sendMessage() {
       body: formData,
     });
 
-    let data = {};
-    try {
-      data = await res.json();
-    } catch (err) {
-      data.reply = "Invalid server response.";
-    }
-
-    loadingEl.remove();
-
-    if (!res.ok) {
-      appendMessage({ role: "assistant", content: data.reply || "Request failed." });
+    const contentType = res.headers.get("Content-Type") || "";
+    if (!res.ok || !contentType.includes("application/x-ndjson")) {
+      let data = {};
+      try {
+        data = await res.json();
+      } catch (err) {
+        data.reply = "Invalid server response.";
+      }
+      loadingEl.remove();
+      if (!res.ok) {
+        appendMessage({ role: "assistant", content: data.reply || "Request failed." });
+        return;
+      }
+      applyChatResult(data, pendingEls);
       return;
     }
 
-    if (data.session) {
-      state.activeSessionId = data.session.id;
-      state.activeSession = data.session;
-      const idx = state.sessions.findIndex(item => item.id === data.session.id);
-      if (idx >= 0) {
-        state.sessions[idx] = data.session;
-      } else {
-        state.sessions.unshift(data.session);
+    let streamedText = "";
+    let streamEl = null;
+    let result = null;
+    let errorReply = null;
+
+    await readNdjson(res, event => {
+      if (event.type === "delta") {
+        if (!streamEl) {
+          loadingEl.remove();
+          streamEl = appendMessage({ role: "assistant", content: "" });
+          pendingEls.push(streamEl);
+        }
+        streamedText += event.text;
+        streamEl.querySelector(".msg-text").innerHTML = formatText(streamedText);
+        chatBox.scrollTop = chatBox.scrollHeight;
+      } else if (event.type === "done") {
+        result = event;
+      } else if (event.type === "error") {
+        errorReply = event.reply;
       }
-      renderSessions();
-      renderMessages(data.session.messages || []);
-    } else {
-      appendMessage({ role: "assistant", content: data.reply || "No response generated.", tokens: data.usage });
+    });
+
+    loadingEl.remove();
+    if (errorReply || !result) {
+      appendMessage({ role: "assistant", content: errorReply || "Stream ended unexpectedly." });
+      return;
     }
+    applyChatResult(result, pendingEls);
   } catch (err) {
     loadingEl.remove();
     appendMessage({ role: "assistant", content: `Connection error: ${err.message}` });
   }
 }
 
+async function readNdjson(res, onEvent) {
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let newline = buffer.indexOf("\n");
+    while (newline >= 0) {
+      const line = buffer.slice(0, newline).trim();
+      buffer = buffer.slice(newline + 1);
+      if (line) {
+        onEvent(JSON.parse(line));
+      }
+      newline = buffer.indexOf("\n");
+    }
+  }
+  buffer += decoder.decode();
+  if (buffer.trim()) {
+    onEvent(JSON.parse(buffer));
+  }
+}
+
+async function fetchMessageRange(sessionId, since, before) {
+  // Each page holds the newest messages of the range, so page back from `before`
+  // until the range is covered; a single page would skip the oldest ones.
+  const pages = [];
+  while (before > since) {
+    const res = await fetch(`/sessions/${sessionId}/messages?since=${since}&before=${before}&limit=${MESSAGE_PAGE_SIZE}`);
+    if (!res.ok) return null;
+    const data = await res.json();
+    if (!data.messages.length) break;
+    pages.unshift(data.messages);
+    if (!data.has_more) break;
+    before = data.messages[0].seq;
+  }
+  return pages.flat();
+}
+
+async function applyChatResult(data, pendingEls = []) {
+  if (!data.session) {
+    appendMessage({ role: "assistant", content: data.reply || "No response generated.", tokens: data.usage });
+    return;
+  }
+
+  const idx = state.sessions.findIndex(item => item.id === data.session.id);
+  if (idx >= 0) {
+    state.sessions.splice(idx, 1);
+  }
+  state.sessions.unshift(data.session);
+  renderSessions();
+  if (data.session.id !== state.activeSessionId) return;
+  state.activeSession = data.session;
+
+  // Swap the optimistic user/stream bubbles for the committed messages. If another
+  // tab wrote to this session meanwhile, fetch everything since our last version.
+  // A coalesced duplicate submit returns messages that are already on screen.
+  pendingEls.forEach(el => el.remove());
+  let messages = data.messages.filter(msg => msg.seq >= state.version);
+  if (data.version > state.version && (!messages.length || messages[0].seq !== state.version)) {
+    const missed = await fetchMessageRange(data.session.id, state.version, data.version);
+    if (missed) {
+      messages = missed;
+    }
+  }
+  messages.forEach(msg => appendMessage(msg));
+  state.version = data.version;
+  syncEmptyState();
+}
+
 chatForm.addEventListener("submit", (event) => {
   event.preventDefault();
   sendMessage();
@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+# app.py reads its configuration at import time: keep it in memory and off the network.
+os.environ.update(
+    SESSION_STORE="memory",
+    ATTACHMENT_CACHE="off",
+    RESPONSE_CACHE="off",
+    WARM_UP="off",
+    TRACING="off",
+)
+for key in ("GOOGLE_API_KEY", "OPENAI_API_KEY", "ANTHROPIC_API_KEY", "TRACE_ADMIN_TOKEN"):
+    os.environ.pop(key, None)
+
+
+@pytest.fixture
+def webapp():
+    import app
+
+    return app
+
+
+@pytest.fixture
+def client(webapp):
+    return webapp.app.test_client()
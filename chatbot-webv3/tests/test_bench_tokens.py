@@ -0,0 +1,33 @@
+import json
+import os
+import sys
+
+BENCH_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bench")
+sys.path.insert(0, BENCH_DIR)
+
+import bench_tokens  # noqa: E402
+from token_counter import PROFILES, count_text  # noqa: E402
+
+
+def test_zero_token_fixtures_are_skipped(tmp_path, capsys):
+    path = tmp_path / "fixtures.jsonl"
+    path.write_text(
+        json.dumps({"provider": "openai", "text": "", "tokens": 0}) + "\n"
+        + json.dumps({"provider": "openai", "text": "Hello there", "tokens": 2}) + "\n"
+    )
+    bench_tokens.report_accuracy(bench_tokens.load_fixtures(str(path)), fit=True)
+    out = capsys.readouterr().out
+    assert "Skipped 1 fixture" in out
+    assert "openai" in out
+
+
+def test_openai_profile_matches_the_labelled_fixtures():
+    records = bench_tokens.load_fixtures(os.path.join(BENCH_DIR, "fixtures", "openai_o200k.jsonl"))
+    assert len(records) >= 50
+
+    def mean_error(estimate):
+        return sum(abs(estimate(text) - actual) / actual for _, text, actual in records) / len(records)
+
+    error = mean_error(lambda text: count_text(text, PROFILES["openai"]))
+    assert error < 0.12
+    assert error < mean_error(bench_tokens.word_split_estimate)
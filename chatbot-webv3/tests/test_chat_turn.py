@@ -0,0 +1,180 @@
+import json
+
+import pytest
+from starlette.testclient import TestClient
+
+
+@pytest.fixture
+def provider(webapp, monkeypatch):
+    """A fake provider behind both the sync and async generation calls."""
+    calls = []
+
+    def reply_for(turn, history):
+        calls.append((turn["message"], len(history)))
+        if turn["message"] == "fail":
+            raise RuntimeError("provider is down")
+        return f"echo: {turn['message']}", {"prompt": 3, "output": 2, "total": 5}
+
+    def stream_reply(turn, history):
+        reply, usage = reply_for(turn, history)
+        for word in reply.split(" "):
+            yield "delta", word + " "
+        yield "usage", usage
+
+    async def agenerate_reply(turn, history):
+        return reply_for(turn, history)
+
+    async def astream_reply(turn, history):
+        for event in stream_reply(turn, history):
+            yield event
+
+    monkeypatch.setattr(webapp, "generate_reply", reply_for)
+    monkeypatch.setattr(webapp, "stream_reply", stream_reply)
+    monkeypatch.setattr(webapp, "agenerate_reply", agenerate_reply)
+    monkeypatch.setattr(webapp, "astream_reply", astream_reply)
+    return calls
+
+
+@pytest.fixture(params=["flask", "asgi"])
+def post_chat(request, webapp):
+    if request.param == "flask":
+        http = webapp.app.test_client()
+    else:
+        import asgi
+
+        http = TestClient(asgi.create_app())
+    session_id = webapp.create_session(provider="openai", model="gpt-test")["id"]
+
+    def post(message, stream=False):
+        data = {"session_id": session_id, "message": message, "stream": "1" if stream else "0"}
+        response = http.post("/chat", data=data)
+        if not stream:
+            return response.status_code, response.get_json() if request.param == "flask" else response.json()
+        body = response.data if request.param == "flask" else response.content
+        return response.status_code, [json.loads(line) for line in body.decode().splitlines()]
+
+    post.session_id = session_id
+    return post
+
+
+def test_blocking_turn_is_committed(webapp, provider, post_chat):
+    status, payload = post_chat("hello")
+    assert status == 200
+    assert payload["reply"] == "echo: hello"
+    status, payload = post_chat("again")
+    assert payload["reply"] == "echo: again"
+    # The second call saw the first turn as history.
+    assert provider == [("hello", 0), ("again", 2)]
+    messages = webapp.store.get(post_chat.session_id)["messages"]
+    assert [msg["content"] for msg in messages] == ["hello", "echo: hello", "again", "echo: again"]
+
+
+def test_streamed_turn_is_committed(webapp, provider, post_chat):
+    status, events = post_chat("hello", stream=True)
+    assert status == 200
+    assert "".join(event["text"] for event in events if event["type"] == "delta") == "echo: hello "
+    assert events[-1]["type"] == "done"
+    assert events[-1]["reply"] == "echo: hello"
+    messages = webapp.store.get(post_chat.session_id)["messages"]
+    assert [msg["content"] for msg in messages] == ["hello", "echo: hello"]
+
+
+def test_provider_failure_is_reported_and_not_saved(webapp, provider, post_chat):
+    status, payload = post_chat("fail")
+    assert status == 500
+    assert "provider is down" in payload["reply"]
+    status, events = post_chat("fail", stream=True)
+    assert events[-1]["type"] == "error"
+    assert webapp.store.get(post_chat.session_id)["messages"] == []
+    # The session lock was released both times.
+    assert post_chat("hello")[1]["reply"] == "echo: hello"
+
+
+def test_disconnect_mid_stream_releases_the_session_lock(webapp, monkeypatch):
+    import asyncio
+
+    import asgi
+
+    async def astream_reply(turn, history):
+        yield "delta", "first words"
+        await asyncio.sleep(30)
+        yield "usage", None
+
+    monkeypatch.setattr(webapp, "astream_reply", astream_reply)
+    session_id = webapp.create_session(provider="openai", model="gpt-test")["id"]
+    body = f"session_id={session_id}&message=hello&stream=1".encode()
+    scope = {
+        "type": "http",
+        # Before 2.4, Starlette cancels a streaming response when the client goes away.
+        "asgi": {"version": "3.0", "spec_version": "2.3"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/chat",
+        "raw_path": b"/chat",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [
+            (b"content-type", b"application/x-www-form-urlencoded"),
+            (b"content-length", str(len(body)).encode()),
+        ],
+        "client": ("127.0.0.1", 1234),
+        "server": ("testserver", 80),
+    }
+
+    async def main():
+        first_line = asyncio.Event()
+        requested = False
+        sent = []
+
+        async def receive():
+            nonlocal requested
+            if not requested:
+                requested = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await first_line.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            sent.append(message)
+            if message["type"] == "http.response.body" and message.get("body"):
+                first_line.set()
+
+        await asyncio.wait_for(asgi.create_app()(scope, receive, send), 5)
+        return sent
+
+    sent = asyncio.run(main())
+    assert b"first words" in b"".join(message.get("body", b"") for message in sent)
+    assert webapp.store.try_lock(session_id, "next-turn", 30)
+
+
+def test_replies_from_an_alternate_backend_are_not_cached(webapp, provider, monkeypatch):
+    from response_cache import open_response_cache
+
+    monkeypatch.setattr(webapp, "response_cache", open_response_cache("memory"))
+    served_by = {}
+
+    def routed_reply(turn, history):
+        reply, usage = webapp.generate_reply(turn, history)
+        if served_by:
+            turn["served_by"] = served_by
+        return reply, usage
+
+    monkeypatch.setattr(webapp, "routed_reply", routed_reply)
+    client = webapp.app.test_client()
+
+    def ask():
+        # A new session each time, so the cache key (which covers the history) is the same.
+        session_id = webapp.create_session(provider="openai", model="gpt-test")["id"]
+        data = {"session_id": session_id, "message": "hello", "temperature": "0"}
+        return client.post("/chat", data=data).get_json()
+
+    served_by.update(provider="anthropic", model="claude-test")
+    assert ask()["served_by"] == served_by
+    assert len(provider) == 1
+    served_by.clear()
+    assert not ask()["usage"].get("cached")
+    assert len(provider) == 2
+    # The primary's own reply is cached.
+    assert ask()["usage"]["cached"] is True
+    assert len(provider) == 2
@@ -0,0 +1,76 @@
+import threading
+import time
+
+from client_pool import ClientPool
+
+
+class FakeClient:
+    def __init__(self, name):
+        self.name = name
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_slow_factory_does_not_block_other_keys():
+    pool = ClientPool()
+    building = threading.Event()
+    release = threading.Event()
+
+    def slow_factory():
+        building.set()
+        release.wait(5)
+        return FakeClient("slow")
+
+    thread = threading.Thread(target=pool.get, args=("google", slow_factory))
+    thread.start()
+    assert building.wait(5)
+    fast = []
+    lookup = threading.Thread(target=lambda: fast.append(pool.get("openai", lambda: FakeClient("fast"))))
+    lookup.start()
+    lookup.join(1)
+    finished_first = bool(fast)
+    release.set()
+    lookup.join(5)
+    thread.join(5)
+    assert finished_first
+    assert len(pool) == 2
+
+
+def test_racing_builds_keep_one_client_and_close_the_other():
+    pool = ClientPool()
+    built = []
+    barrier = threading.Barrier(2)
+
+    def factory():
+        client = FakeClient(len(built))
+        built.append(client)
+        barrier.wait(5)
+        return client
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(pool.get("google", factory))) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert results[0] is results[1]
+    assert [client.closed for client in built].count(True) == 1
+    assert not results[0].closed
+
+
+def test_evicted_clients_are_closed_after_the_delay():
+    pool = ClientPool(max_size=1, close_delay=0.05)
+    first = pool.get("google", lambda: FakeClient("google"))
+    second = pool.get("openai", lambda: FakeClient("openai"))
+    assert not first.closed  # a request may still be using it
+
+    time.sleep(0.06)
+    pool.get("openai", lambda: FakeClient("unused"))
+    assert first.closed
+    assert not second.closed
+
+    pool.clear()
+    assert second.closed
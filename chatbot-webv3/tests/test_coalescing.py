@@ -0,0 +1,56 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def turn(webapp, monkeypatch):
+    monkeypatch.setitem(webapp.CONFIG, "coalesce", "on")
+    session = webapp.create_session()
+
+    def make(received_at):
+        return {
+            "session": webapp.store.get(session["id"]),
+            "message": "hello",
+            "file_name": None,
+            "received_at": received_at,
+            "provider": "google",
+            "model": "gemini",
+        }
+
+    def save(saved_at):
+        stamp = saved_at.isoformat() + "Z"
+        webapp.store.append_messages(session["id"], [
+            {"role": "user", "content": "hello", "timestamp": stamp, "file": None},
+            {"role": "assistant", "content": "hi there", "timestamp": stamp},
+        ])
+
+    return make, save
+
+
+def test_duplicate_in_flight_is_coalesced(webapp, turn):
+    make, save = turn
+    arrived = datetime.utcnow()
+    request = make(arrived)
+    # The first copy was still generating when this one arrived, and is saved afterwards.
+    save(arrived + timedelta(seconds=2))
+    payload = webapp.refresh_turn(request)
+    assert payload["coalesced"] is True
+    assert payload["reply"] == "hi there"
+
+
+def test_resend_after_the_reply_is_a_new_turn(webapp, turn):
+    make, save = turn
+    answered = datetime.utcnow()
+    save(answered)
+    # Sent again one second after the reply arrived: deliberate, not a double submit.
+    assert webapp.refresh_turn(make(answered + timedelta(seconds=1))) is None
+
+
+def test_coalescing_can_be_switched_off(webapp, turn, monkeypatch):
+    make, save = turn
+    arrived = datetime.utcnow()
+    request = make(arrived)
+    save(arrived + timedelta(seconds=2))
+    monkeypatch.setitem(webapp.CONFIG, "coalesce", "off")
+    assert webapp.refresh_turn(request) is None
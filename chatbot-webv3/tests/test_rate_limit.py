@@ -0,0 +1,115 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from rate_limit import RateLimited, RateLimiter, backoff_delay, parse_rate_limits, retry_after_seconds
+
+
+def test_parse_rate_limits_string_and_table(capsys):
+    assert parse_rate_limits("openai=60/1000, anthropic:claude=0/500") == {
+        "openai": (60.0, 1000.0),
+        "anthropic:claude": (0.0, 500.0),
+    }
+    assert parse_rate_limits({"google": {"rpm": 10}, "bad": {"rpm": "many"}, "none": {}}) == {"google": (10.0, 0.0)}
+    assert "Ignoring invalid rate limit for 'bad'" in capsys.readouterr().out
+    assert parse_rate_limits("") == {}
+
+
+def upstream_error(**headers):
+    return SimpleNamespace(response=SimpleNamespace(headers=headers))
+
+
+def test_retry_after_seconds():
+    assert retry_after_seconds(upstream_error(**{"retry-after-ms": "1500"})) == 1.5
+    assert retry_after_seconds(upstream_error(**{"retry-after": "3"})) == 3.0
+    assert retry_after_seconds(upstream_error(**{"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"})) == 0.0
+    assert retry_after_seconds(upstream_error(**{"retry-after": "soon"})) is None
+    assert retry_after_seconds(RuntimeError("no response")) is None
+
+
+def test_backoff_delay_bounds():
+    assert 2.0 <= backoff_delay(0, retry_after=2.0) <= 2.4
+    for attempt in range(12):
+        assert 0 < backoff_delay(attempt) <= 30.0
+
+
+def test_disabled_limiter_admits_everything():
+    limiter = RateLimiter(enabled=False, limits={"openai": (1, 0)})
+    for _ in range(100):
+        limiter.check("openai", "gpt")
+
+
+def test_burst_then_reject_when_the_wait_is_too_long():
+    # 6 per minute: a burst of one (ten seconds' worth), then one every ten seconds.
+    limiter = RateLimiter(enabled=True, limits={"openai": (6, 0)}, max_wait=1.0)
+    limiter.acquire("openai", "gpt", time.monotonic() + 1)
+    with pytest.raises(RateLimited) as caught:
+        limiter.check("openai", "gpt")
+    assert caught.value.retry_after == pytest.approx(10, abs=0.5)
+    with pytest.raises(RateLimited):
+        limiter.acquire("openai", "gpt", time.monotonic() + 1)
+    # Providers without a limit are not held back.
+    limiter.check("anthropic", "claude")
+    assert limiter.stats["admitted"] == 1
+    assert limiter.stats["rejected"] == 2
+
+
+def test_waiters_are_admitted_as_the_bucket_refills():
+    # 600 per minute: ten a second, with a burst of 100.
+    limiter = RateLimiter(enabled=True, limits={"openai:gpt": (600, 0)}, max_wait=2.0)
+    for _ in range(100):
+        limiter.acquire("openai", "gpt", time.monotonic())
+    started = time.monotonic()
+    limiter.acquire("openai", "gpt", time.monotonic() + 2)
+    assert 0.05 <= time.monotonic() - started < 1.0
+    assert limiter.stats["queued"] == 1
+    assert limiter._waiting == {}
+
+
+def test_queue_limit():
+    limiter = RateLimiter(enabled=True, limits={"openai": (60, 0)}, max_wait=5.0, max_queue=1)
+    limiter.acquire("openai", "gpt", time.monotonic())
+    for _ in range(9):
+        limiter.acquire("openai", "gpt", time.monotonic() + 5)
+    waiter = threading.Thread(target=limiter.acquire, args=("openai", "gpt", time.monotonic() + 5))
+    waiter.start()
+    time.sleep(0.05)
+    with pytest.raises(RateLimited, match="queue full"):
+        limiter.check("openai", "gpt")
+    waiter.join()
+
+
+def test_token_debt_holds_back_later_calls():
+    limiter = RateLimiter(enabled=True, limits={"openai": (0, 600)}, max_wait=0.5)
+    limiter.acquire("openai", "gpt", time.monotonic())
+    # 600 tokens a minute is 100 per ten-second burst; this call used 400.
+    limiter.charge("openai", "gpt", 400)
+    with pytest.raises(RateLimited) as caught:
+        limiter.check("openai", "gpt")
+    assert caught.value.retry_after == pytest.approx(30, abs=1)
+
+
+def test_upstream_throttle_cools_down_only_that_model():
+    limiter = RateLimiter(enabled=True, limits={}, max_wait=0.5)
+    limiter.throttled("openai", "gpt", 5)
+    with pytest.raises(RateLimited):
+        limiter.check("openai", "gpt")
+    limiter.check("openai", "other")
+    assert limiter.stats["throttled"] == 1
+
+
+def test_async_acquire_waits_on_the_loop():
+    limiter = RateLimiter(enabled=True, limits={"openai": (600, 0)}, max_wait=2.0)
+    for _ in range(100):
+        limiter.acquire("openai", "gpt", time.monotonic())
+
+    async def main():
+        started = time.monotonic()
+        await asyncio.gather(*(limiter.aacquire("openai", "gpt", time.monotonic() + 2) for _ in range(3)))
+        return time.monotonic() - started
+
+    assert 0.2 <= asyncio.run(main()) < 1.5
+    assert limiter._waiting == {}
@@ -0,0 +1,137 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from routing import AttemptTimeout, Router, is_retryable, parse_backends
+
+
+class ProviderError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class Throttled(Exception):
+    def __init__(self, retry_after):
+        super().__init__("throttled")
+        self.retry_after = retry_after
+
+
+def backend(outcomes):
+    """A fake call: ``outcomes`` maps a candidate to (delay, result or exception)."""
+    calls = []
+    lock = threading.Lock()
+
+    def call(candidate):
+        with lock:
+            calls.append(candidate)
+        delay, result = outcomes[candidate]
+        time.sleep(delay)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def acall(candidate):
+        calls.append(candidate)
+        delay, result = outcomes[candidate]
+        await asyncio.sleep(delay)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    return call, acall, calls
+
+
+def test_parse_backends_and_retryable():
+    assert parse_backends("openai:gpt-4o-mini, anthropic , :x") == [("openai", "gpt-4o-mini"), ("anthropic", "")]
+    assert parse_backends(["google:gemini"]) == [("google", "gemini")]
+    assert is_retryable(TimeoutError())
+    assert is_retryable(ProviderError(429)) and is_retryable(ProviderError(503))
+    assert not is_retryable(ProviderError(400))
+
+
+def test_off_calls_only_the_first_candidate():
+    call, _, calls = backend({"a": (0, ProviderError(503)), "b": (0, "b")})
+    with pytest.raises(ProviderError):
+        Router("off").run(["a", "b"], call)
+    assert calls == ["a"]
+
+
+def test_failover_moves_on_after_a_retryable_error():
+    failures = []
+    router = Router("failover", on_failure=lambda candidate, exc: failures.append(candidate))
+    call, _, calls = backend({"a": (0, ProviderError(503)), "b": (0, "from b")})
+    assert router.run(["a", "b"], call) == ("b", "from b")
+    assert calls == ["a", "b"]
+    assert failures == ["a"]
+    assert router.stats["alternate_wins"] == 1
+
+
+def test_failover_stops_at_a_bad_request():
+    call, _, calls = backend({"a": (0, ProviderError(400)), "b": (0, "from b")})
+    with pytest.raises(ProviderError):
+        Router("failover").run(["a", "b"], call)
+    assert calls == ["a"]
+
+
+def test_failover_after_a_timeout_discards_the_late_result():
+    discarded = []
+    call, _, _ = backend({"a": (0.3, "late"), "b": (0, "from b")})
+    router = Router("failover", timeout=0.1)
+    assert router.run(["a", "b"], call, discard=discarded.append) == ("b", "from b")
+    time.sleep(0.3)
+    assert discarded == ["late"]
+
+
+def test_all_failed():
+    call, _, _ = backend({"a": (0, ProviderError(503)), "b": (0, ProviderError(502))})
+    with pytest.raises(RuntimeError, match="All backends failed"):
+        Router("failover").run(["a", "b"], call)
+
+    call, _, _ = backend({"a": (0, Throttled(5)), "b": (0, Throttled(2))})
+    with pytest.raises(Throttled) as caught:
+        Router("failover").run(["a", "b"], call)
+    assert caught.value.retry_after == 2
+
+    call, _, _ = backend({"a": (0.3, "late")})
+    with pytest.raises(AttemptTimeout):
+        Router("failover", timeout=0.1).run(["a"], call)
+
+
+def test_hedge_starts_a_second_attempt_and_takes_the_first_success():
+    call, _, calls = backend({"a": (0.4, "from a"), "b": (0.05, "from b")})
+    router = Router("hedge", hedge_after=0.1)
+    started = time.monotonic()
+    assert router.run(["a", "b"], call) == ("b", "from b")
+    assert time.monotonic() - started < 0.35
+    assert calls == ["a", "b"]
+    assert router.stats["hedges"] == 1
+
+
+def test_hedge_is_not_needed_for_a_fast_reply():
+    call, _, calls = backend({"a": (0.01, "from a"), "b": (0, "from b")})
+    assert Router("hedge", hedge_after=0.2).run(["a", "b"], call) == ("a", "from a")
+    assert calls == ["a"]
+
+
+def test_async_hedge_cancels_the_loser():
+    _, acall, calls = backend({"a": (5, "from a"), "b": (0.05, "from b")})
+    router = Router("hedge", hedge_after=0.1)
+
+    async def main():
+        started = time.monotonic()
+        result = await router.arun(["a", "b"], acall)
+        return result, time.monotonic() - started
+
+    result, elapsed = asyncio.run(main())
+    assert result == ("b", "from b")
+    assert elapsed < 1
+    assert calls == ["a", "b"]
+
+
+def test_async_failover():
+    _, acall, calls = backend({"a": (0, ProviderError(500)), "b": (0, "from b")})
+    assert asyncio.run(Router("failover").arun(["a", "b"], acall)) == ("b", "from b")
+    assert calls == ["a", "b"]
@@ -0,0 +1,84 @@
+import io
+import json
+
+import pytest
+
+from session_archive import ArchiveError, export_json, export_ndjson, iter_archive
+
+
+def session(title, size=1):
+    return {"title": title, "messages": [{"role": "user", "content": "x" * size}]}
+
+
+def read(data, **kwargs):
+    return list(iter_archive(io.BytesIO(data), **kwargs))
+
+
+class FailingStream:
+    def __init__(self, data):
+        self.data = io.BytesIO(data)
+
+    def read(self, size):
+        chunk = self.data.read(size)
+        if not chunk:
+            raise OSError("connection reset")
+        return chunk
+
+
+def test_round_trip_both_formats():
+    sessions = [session(f"s{index}") for index in range(3)]
+    for export in (export_json, export_ndjson):
+        data = "".join(export(sessions)).encode()
+        assert read(data) == sessions
+
+
+def test_value_split_across_reads():
+    sessions = [session("big", 200_000), session("small")]
+    assert read("".join(export_ndjson(sessions)).encode()) == sessions
+
+
+def test_non_utf8_is_an_archive_error():
+    with pytest.raises(ArchiveError, match="UTF-8"):
+        read(b'{"sessions": [{"title": "\xff\xfe", "messages": []}]}')
+
+
+def test_read_error_is_an_archive_error():
+    with pytest.raises(ArchiveError, match="Failed to read file"):
+        list(iter_archive(FailingStream(b'{"sessions": [')))
+
+
+def test_syntax_error_fails_without_reading_to_the_end():
+    stream = io.BytesIO(b'[{"title": "a", "messages": [] "oops"}' + b" " * (10 * 1024 * 1024) + b"]")
+    with pytest.raises(ArchiveError, match="Invalid JSON"):
+        list(iter_archive(stream))
+    assert stream.tell() < 1024 * 1024
+
+
+def test_unterminated_value_stops_at_the_cap():
+    stream = io.BytesIO(b'[{"title": "' + b"a" * (8 * 1024 * 1024))
+    with pytest.raises(ArchiveError, match="larger than 1 MB"):
+        list(iter_archive(stream, max_value_bytes=1024 * 1024))
+    assert stream.tell() < 4 * 1024 * 1024
+
+
+def test_truncated_archive():
+    data = "".join(export_json([session("a"), session("b")])).encode()
+    with pytest.raises(ArchiveError):
+        read(data[:-20])
+
+
+def test_import_route_reports_bad_files(client):
+    response = client.post("/sessions/import", data=b"\xff\xfe not json")
+    assert response.status_code == 400
+    assert "UTF-8" in response.get_json()["error"]
+
+    response = client.post("/sessions/import?progress=1", data=b'[{"title": "\xff", "messages": []}]')
+    lines = [json.loads(line) for line in response.data.splitlines()]
+    assert lines[-1]["type"] == "error"
+
+
+def test_import_route_imports_ndjson(client):
+    data = "".join(export_ndjson([session("one"), session("two")])).encode()
+    response = client.post("/sessions/import", data=data)
+    assert response.status_code == 200
+    assert len(response.get_json()["imported"]) == 2
@@ -0,0 +1,29 @@
+def fetch_range(client, session_id, since, before, limit):
+    """The catch-up paging done by static/script.js (fetchMessageRange)."""
+    pages = []
+    while before > since:
+        data = client.get(f"/sessions/{session_id}/messages?since={since}&before={before}&limit={limit}").get_json()
+        if not data["messages"]:
+            break
+        pages.insert(0, data["messages"])
+        if not data["has_more"]:
+            break
+        before = data["messages"][0]["seq"]
+    return [msg for page in pages for msg in page]
+
+
+def test_catch_up_pages_cover_every_missed_message(webapp, client):
+    session_id = webapp.create_session()["id"]
+    webapp.store.append_messages(session_id, [{"role": "user", "content": str(seq)} for seq in range(130)])
+
+    missed = fetch_range(client, session_id, since=7, before=127, limit=50)
+    assert [msg["seq"] for msg in missed] == list(range(7, 127))
+
+    data = client.get(f"/sessions/{session_id}/messages?since=7&limit=50").get_json()
+    # A single page returns the newest rows only.
+    assert data["messages"][0]["seq"] == 80
+    assert data["has_more"] is True
+
+
+def test_messages_of_unknown_session(client):
+    assert client.get("/sessions/missing/messages").status_code == 404
@@ -0,0 +1,114 @@
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from session_store import MemorySessionStore, SessionConflict, SQLiteSessionStore
+
+
+def new_session(session_id="s1"):
+    return {
+        "id": session_id,
+        "title": "Chat",
+        "provider": "google",
+        "model": "gemini",
+        "created_at": "2024-01-01T00:00:00Z",
+        "updated_at": "2024-01-01T00:00:00Z",
+        "messages": [],
+    }
+
+
+def message(text):
+    return {"role": "user", "content": text}
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemorySessionStore()
+    return SQLiteSessionStore(str(tmp_path / "sessions.db"))
+
+
+def test_writes_bump_the_revision(store):
+    store.create(new_session())
+    revision = store.get_summary("s1")["revision"]
+    assert store.append_messages("s1", [message("a")], expected_revision=revision) == 1
+    assert store.get_summary("s1")["revision"] == revision + 1
+    assert store.update("s1", title="Renamed")
+    assert store.get_summary("s1")["revision"] == revision + 2
+
+
+def test_stale_revision_conflicts(store):
+    store.create(new_session())
+    revision = store.get_summary("s1")["revision"]
+    store.update("s1", title="Renamed elsewhere")
+    with pytest.raises(SessionConflict):
+        store.append_messages("s1", [message("lost?")], expected_revision=revision)
+    with pytest.raises(SessionConflict):
+        store.update("s1", expected_revision=revision, title="Mine")
+    assert store.get("s1")["messages"] == []
+    assert store.get("s1")["title"] == "Renamed elsewhere"
+
+
+def test_concurrent_appends_keep_every_message(store):
+    store.create(new_session())
+
+    def writer(name):
+        for index in range(10):
+            while True:
+                revision = store.get_summary("s1")["revision"]
+                try:
+                    store.append_messages("s1", [message(f"{name}-{index}")], expected_revision=revision)
+                    break
+                except SessionConflict:
+                    continue
+
+    threads = [threading.Thread(target=writer, args=(f"w{number}",)) for number in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    rows = store.get_messages("s1")
+    assert [seq for seq, _ in rows] == list(range(60))
+    assert len({msg["content"] for _, msg in rows}) == 60
+
+
+def test_get_messages_pages(store):
+    store.create(new_session())
+    store.append_messages("s1", [message(str(index)) for index in range(10)])
+    assert [seq for seq, _ in store.get_messages("s1", since=2, limit=3)] == [7, 8, 9]
+    assert [seq for seq, _ in store.get_messages("s1", before=5, limit=2)] == [3, 4]
+    assert store.get_messages("missing") is None
+
+
+def test_lock_excludes_other_owners(store):
+    store.create(new_session())
+    assert store.try_lock("s1", "a", 30)
+    assert store.try_lock("s1", "a", 30)
+    assert not store.try_lock("s1", "b", 30)
+    store.unlock("s1", "b")
+    assert not store.try_lock("s1", "b", 30)
+    store.unlock("s1", "a")
+    assert store.try_lock("s1", "b", 30)
+
+
+def test_expired_lease_is_taken_over(store):
+    store.create(new_session())
+    assert store.try_lock("s1", "a", 0.05)
+    time.sleep(0.1)
+    assert store.try_lock("s1", "b", 30)
+
+
+def test_lock_of_a_dead_process_is_taken_over(tmp_path):
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    store.create(new_session())
+    code = (
+        "import sys; sys.path.insert(0, sys.argv[1]);"
+        "from session_store import SQLiteSessionStore;"
+        "assert SQLiteSessionStore(sys.argv[2]).try_lock('s1', 'crashed', 3600)"
+    )
+    app_dir = str(__import__("pathlib").Path(__file__).resolve().parents[1])
+    subprocess.run([sys.executable, "-c", code, app_dir, str(tmp_path / "sessions.db")], check=True)
+    assert store.try_lock("s1", "b", 30)
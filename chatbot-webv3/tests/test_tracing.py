@@ -0,0 +1,55 @@
+import json
+
+from tracing import NULL_TRACE, Tracer, current, span
+
+
+def test_disabled_tracer_records_nothing():
+    tracer = Tracer(enabled=False)
+    trace = tracer.start("POST /chat")
+    assert trace is NULL_TRACE
+    with tracer.activate(trace), span("parse"):
+        assert current() is NULL_TRACE
+
+
+def test_spans_and_server_timing(tmp_path):
+    log = tmp_path / "trace.log"
+    tracer = Tracer(enabled=True, server_timing=True, log_file=str(log))
+    trace = tracer.start("POST /chat")
+    with tracer.activate(trace):
+        with span("parse"):
+            pass
+        with span("provider", provider="openai"):
+            pass
+    assert "parse;dur=" in trace.server_timing_header()
+    tracer.finish(trace, status=200)
+    line = json.loads(log.read_text())
+    assert [item["name"] for item in line["spans"]] == ["parse", "provider"]
+    assert line["status"] == 200
+
+
+def test_post_tracing_is_refused_without_a_token(client, webapp, monkeypatch):
+    monkeypatch.setitem(webapp.CONFIG, "trace_admin_token", None)
+    response = client.post("/tracing", json={"enabled": True})
+    assert response.status_code == 403
+    assert client.get("/tracing").status_code == 200
+
+
+def test_post_tracing_checks_the_token(client, webapp, monkeypatch, tmp_path):
+    monkeypatch.setitem(webapp.CONFIG, "trace_admin_token", "secret")
+    monkeypatch.setattr(webapp, "tracer", Tracer(control_file=str(tmp_path / "tracing.json")))
+    assert client.post("/tracing", json={"enabled": True}, headers={"X-Admin-Token": "wrong"}).status_code == 403
+    response = client.post("/tracing", json={"enabled": True}, headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 200
+    assert response.get_json()["enabled"] is True
+
+
+
+def test_post_tracing_rejects_unknown_or_non_boolean_settings(client, webapp, monkeypatch, tmp_path):
+    monkeypatch.setitem(webapp.CONFIG, "trace_admin_token", "secret")
+    monkeypatch.setattr(webapp, "tracer", Tracer(control_file=str(tmp_path / "tracing.json")))
+    headers = {"X-Admin-Token": "secret"}
+    for body in ({"enabled": True, "log_file": "/tmp/x"}, {"enabled": "yes"}, {"server_timing": 1}):
+        response = client.post("/tracing", json=body, headers=headers)
+        assert response.status_code == 400
+        assert "error" in response.get_json()
+    assert webapp.tracer.settings()["enabled"] is False
@@ -0,0 +1,86 @@
+import io
+import os
+import tempfile
+
+import pytest
+from starlette.testclient import TestClient
+
+pytestmark = pytest.mark.skipif(not os.path.isdir("/proc/self/fd"), reason="needs /proc to see open files")
+
+
+def files_open_in(directory):
+    """Paths of this process's open files under ``directory`` (unnamed temp files included)."""
+    paths = []
+    for fd in os.listdir("/proc/self/fd"):
+        try:
+            path = os.readlink(f"/proc/self/fd/{fd}")
+        except OSError:
+            continue
+        if path.startswith(str(directory)):
+            paths.append(path)
+    return paths
+
+
+@pytest.fixture
+def temp_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    return tmp_path
+
+
+def upload_on_disk(webapp, monkeypatch, temp_dir, spool_mb, size):
+    """Whether werkzeug's parsed upload of ``size`` bytes was written to a temp file."""
+    monkeypatch.setitem(webapp.CONFIG, "upload_spool_bytes", spool_mb * 1024 * 1024)
+    data = {"file": (io.BytesIO(b"x" * size), "notes.txt")}
+    with webapp.app.test_request_context("/chat", method="POST", data=data, content_type="multipart/form-data"):
+        stream = webapp.request.files["file"].stream
+        assert stream.read() == b"x" * size
+        return bool(files_open_in(temp_dir))
+
+
+def test_small_uploads_stay_in_memory(webapp, monkeypatch, temp_dir):
+    assert upload_on_disk(webapp, monkeypatch, temp_dir, 1, 1000) is False
+
+
+def test_large_uploads_roll_to_disk(webapp, monkeypatch, temp_dir):
+    assert upload_on_disk(webapp, monkeypatch, temp_dir, 1, 2 * 1024 * 1024) is True
+
+
+def test_zero_spool_always_uses_disk(webapp, monkeypatch, temp_dir):
+    assert upload_on_disk(webapp, monkeypatch, temp_dir, 0, 10) is True
+
+
+@pytest.mark.parametrize("spool_mb, on_disk", [(0, True), (1, False)])
+def test_asgi_upload_spooling_and_cleanup(webapp, monkeypatch, temp_dir, spool_mb, on_disk):
+    import asgi
+
+    monkeypatch.setitem(webapp.CONFIG, "upload_spool_bytes", spool_mb * 1024 * 1024)
+    seen = {}
+
+    def parse_chat_turn(form, file_name=None, file_stream=None, file_type=None):
+        seen["on_disk"] = bool(files_open_in(temp_dir))
+        seen["data"] = file_stream.read()
+        return None, ({"reply": "stop here"}, 400)
+
+    monkeypatch.setattr(webapp, "parse_chat_turn", parse_chat_turn)
+    response = TestClient(asgi.create_app()).post("/chat", files={"file": ("notes.txt", b"hello")})
+    assert response.status_code == 400
+    assert seen == {"on_disk": on_disk, "data": b"hello"}
+    # The form is closed with the request, not left for the garbage collector.
+    assert files_open_in(temp_dir) == []
+
+
+def test_global_multipart_parser_is_untouched(webapp):
+    import importlib
+
+    from starlette.formparsers import MultiPartParser
+
+    importlib.import_module("asgi")
+    assert MultiPartParser.spool_max_size == 1024 * 1024
+
+
+def test_stream_size_keeps_the_position(webapp):
+    stream = io.BytesIO(b"0123456789")
+    stream.seek(3)
+    assert webapp.stream_size(stream) == 10
+    assert stream.tell() == 3
+    assert webapp.stream_size(object()) is None
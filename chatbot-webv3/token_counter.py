@@ -0,0 +1,126 @@
+import hashlib
+import math
+import re
+import threading
+from collections import OrderedDict
+
+
+# Offline approximations of each provider's tokenizer. Text is split into runs
+# of one character class and every class has its own characters-per-token rate,
+# which tracks BPE/SentencePiece behaviour far better than a whitespace split
+# for code, numbers and non-Latin scripts. ``scale`` is the final correction
+# fitted from provider-reported usage (see bench/bench_tokens.py --fit).
+PROFILES = {
+    "openai": {
+        "word_chars": 6.0,
+        "digit_chars": 3.0,
+        "space_chars": 4.0,
+        "newline_chars": 2.0,
+        "punct_chars": 2.0,
+        "cjk_per_char": 0.9,
+        "other_chars": 3.0,
+        "scale": 0.9,
+    },
+    "google": {
+        "word_chars": 6.5,
+        "digit_chars": 1.0,
+        "space_chars": 8.0,
+        "newline_chars": 1.0,
+        "punct_chars": 2.0,
+        "cjk_per_char": 0.8,
+        "other_chars": 3.5,
+        "scale": 1.0,
+    },
+    "anthropic": {
+        "word_chars": 5.5,
+        "digit_chars": 3.0,
+        "space_chars": 4.0,
+        "newline_chars": 2.0,
+        "punct_chars": 1.7,
+        "cjk_per_char": 1.2,
+        "other_chars": 2.2,
+        "scale": 1.1,
+    },
+}
+DEFAULT_PROFILE = "openai"
+
+TOKEN_RUN = re.compile(
+    r"(?P<word>_?(?:[A-Z]?[a-z]+|[A-Z]+(?![a-z])))"
+    r"|(?P<digits>[0-9]+)"
+    r"|(?P<newline>(?:\r?\n)+)"
+    r"|(?P<space>[ \t]+)"
+    r"|(?P<cjk>[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]+)"
+    r"|(?P<other>[^\W\d_]+)"
+    r"|(?P<punct>[^\w\s]+|_+)"
+)
+
+
+def count_text(text, profile):
+    """Uncached token estimate for ``text`` under one profile."""
+    total = 0.0
+    for match in TOKEN_RUN.finditer(text):
+        kind = match.lastgroup
+        length = match.end() - match.start()
+        if kind == "word":
+            total += math.ceil(length / profile["word_chars"])
+        elif kind == "space":
+            # A single space is folded into the following token.
+            total += (length - 1) / profile["space_chars"]
+        elif kind == "digits":
+            total += math.ceil(length / profile["digit_chars"])
+        elif kind == "newline":
+            total += math.ceil(length / profile["newline_chars"])
+        elif kind == "cjk":
+            total += length * profile["cjk_per_char"]
+        elif kind == "other":
+            total += max(1.0, length / profile["other_chars"])
+        else:
+            total += math.ceil(length / profile["punct_chars"])
+    return max(1, round(total * profile["scale"]))
+
+
+class TokenCounter:
+    """Token estimator with an LRU cache keyed by content hash.
+
+    Short strings are cheaper to count than to hash, so only texts of at least
+    ``min_cached_length`` characters go through the cache.
+    """
+
+    def __init__(self, cache_size=4096, min_cached_length=64):
+        self.cache_size = cache_size
+        self.min_cached_length = min_cached_length
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def count(self, text, provider=None):
+        if not text:
+            return 0
+        name = provider if provider in PROFILES else DEFAULT_PROFILE
+        if len(text) < self.min_cached_length or not self.cache_size:
+            return count_text(text, PROFILES[name])
+
+        digest = hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+        key = (name, digest)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return cached
+
+        count = count_text(text, PROFILES[name])
+        with self._lock:
+            self.misses += 1
+            self._cache[key] = count
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return count
+
+
+counter = TokenCounter()
+
+
+def count_tokens(text, provider=None):
+    return counter.count(text, provider)
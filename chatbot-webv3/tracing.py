@@ -0,0 +1,198 @@
+"""Per-request timing spans, written as one JSON log line per traced request.
+
+A ``Trace`` collects named spans while a request runs. The active trace lives
+in a context variable, so code deep in the call stack (provider calls, context
+building) can time itself with ``span("name")`` without being handed the trace;
+the variable follows Flask's request thread, asyncio tasks, and Starlette's
+``run_in_threadpool``.
+
+Tracing is switched at runtime through a small JSON control file shared by all
+worker processes; each process re-reads it at most once per second.
+"""
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+REFRESH_SECONDS = 1.0
+
+_current = contextvars.ContextVar("chatbot_trace", default=None)
+
+
+class Trace:
+    def __init__(self, name, server_timing=False, **attrs):
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.server_timing = server_timing
+        self.attrs = attrs
+        self.spans = []
+        self.started_at = datetime.utcnow().isoformat() + "Z"
+        self._start = time.perf_counter()
+
+    def offset(self):
+        return time.perf_counter() - self._start
+
+    def annotate(self, **attrs):
+        """Attach request-level attributes (provider, outcome, ...) to the log line."""
+        self.attrs.update(attrs)
+
+    @contextmanager
+    def span(self, name, **attrs):
+        start = time.perf_counter()
+        try:
+            yield attrs
+        except BaseException as exc:
+            attrs["error"] = type(exc).__name__
+            raise
+        finally:
+            self.add(name, start, time.perf_counter(), **attrs)
+
+    def add(self, name, start, end, **attrs):
+        """Record a span timed by the caller with ``time.perf_counter`` values."""
+        self.spans.append({
+            "name": name,
+            "start_ms": round((start - self._start) * 1000, 3),
+            "duration_ms": round((end - start) * 1000, 3),
+            **attrs,
+        })
+
+    def server_timing_header(self):
+        """``Server-Timing`` value for the spans finished so far (same-name spans are summed)."""
+        totals = {}
+        for span in self.spans:
+            totals[span["name"]] = totals.get(span["name"], 0.0) + span["duration_ms"]
+        totals["total"] = round(self.offset() * 1000, 3)
+        return ", ".join(f"{name};dur={duration:.3f}" for name, duration in totals.items())
+
+    def record(self):
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "start": self.started_at,
+            "duration_ms": round(self.offset() * 1000, 3),
+            **self.attrs,
+            "spans": self.spans,
+        }
+
+
+class _NullSpan:
+    def __enter__(self):
+        return {}
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _NullTrace:
+    """Stand-in used when tracing is off; every method is a no-op."""
+
+    trace_id = None
+    server_timing = False
+
+    def annotate(self, **attrs):
+        pass
+
+    def span(self, name, **attrs):
+        return _NULL_SPAN
+
+    def add(self, name, start, end, **attrs):
+        pass
+
+    def offset(self):
+        return 0.0
+
+
+NULL_TRACE = _NullTrace()
+
+
+def current():
+    return _current.get() or NULL_TRACE
+
+
+def span(name, **attrs):
+    """Time a block against the active trace (a no-op when there is none)."""
+    return current().span(name, **attrs)
+
+
+class Tracer:
+    def __init__(self, enabled=False, server_timing=False, control_file=None, log_file=None):
+        self.defaults = {"enabled": bool(enabled), "server_timing": bool(server_timing)}
+        self.control_file = control_file
+        self.log_file = log_file
+        self._settings = dict(self.defaults)
+        self._checked_at = 0.0
+        self._mtime = None
+        self._write_lock = threading.Lock()
+
+    def settings(self):
+        now = time.monotonic()
+        if self.control_file and now - self._checked_at >= REFRESH_SECONDS:
+            self._checked_at = now
+            try:
+                mtime = os.stat(self.control_file).st_mtime
+            except OSError:
+                mtime = None
+            if mtime != self._mtime:
+                self._mtime = mtime
+                self._settings = {**self.defaults, **self._read_control_file()}
+        return self._settings
+
+    def _read_control_file(self):
+        try:
+            with open(self.control_file, "r") as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return {key: bool(stored[key]) for key in self.defaults if key in stored}
+
+    def configure(self, **changes):
+        """Change settings for every process sharing the control file; return the new settings."""
+        settings = {**self.settings(), **{key: bool(value) for key, value in changes.items() if key in self.defaults}}
+        if self.control_file:
+            temp_path = f"{self.control_file}.tmp"
+            with open(temp_path, "w") as f:
+                json.dump(settings, f)
+            os.replace(temp_path, self.control_file)
+        self._settings = settings
+        self._mtime = None
+        self._checked_at = time.monotonic()
+        return settings
+
+    def start(self, name, **attrs):
+        """Begin a trace for the current request, or return ``NULL_TRACE`` when tracing is off."""
+        settings = self.settings()
+        if not settings["enabled"] and not settings["server_timing"]:
+            return NULL_TRACE
+        return Trace(name, server_timing=settings["server_timing"], **attrs)
+
+    @contextmanager
+    def activate(self, trace):
+        token = _current.set(trace)
+        try:
+            yield trace
+        finally:
+            try:
+                _current.reset(token)
+            except ValueError:
+                # A streaming generator closed from another context; that context never saw the trace.
+                pass
+
+    def finish(self, trace, **attrs):
+        if trace is NULL_TRACE or not self.settings()["enabled"]:
+            return
+        trace.annotate(**attrs)
+        line = json.dumps(trace.record(), default=str)
+        with self._write_lock:
+            if self.log_file:
+                with open(self.log_file, "a") as f:
+                    f.write(line + "\n")
+            else:
+                print(line, file=sys.stderr, flush=True)
@@ -1,28 +1,190 @@
+import argparse
 import json
 import os
-from google import genai
-from google.genai import types
+import sys
+import threading
+import queue
+import time
+from collections import deque
+from chat_context import ContextBuilder
+from history_journal import HistoryJournal
 import toml
 
+
+def clamp(value, min_value, max_value):
+    return max(min_value, min(value, max_value))
+
+
+def env_number(name, default, min_value, max_value, cast=int):
+    """Environment variable ``name`` as a clamped number; ``default`` if unset or invalid."""
+    value = os.getenv(name)
+    if value is None or not value.strip():
+        return default
+    try:
+        return clamp(cast(value), min_value, max_value)
+    except ValueError:
+        # stderr: in batch mode stdout may carry the results.
+        print(f"[WARN] Ignoring invalid {name}={value!r}; using {default}.", file=sys.stderr)
+        return default
+
+
 # Configuration
 CONFIG_FILE = "config.toml"
-HISTORY_FILE = "chat_history.json"
+HISTORY_FILE = "chat_history.jsonl"
+LEGACY_HISTORY_FILE = "chat_history.json"
+HISTORY_FSYNC = os.getenv("HISTORY_FSYNC", "interval")
+HISTORY_MAX_MB = env_number("HISTORY_MAX_MB", 50, 0, 1024 * 1024, float)
+CONTEXT_TURNS = env_number("CONTEXT_TURNS", 5, 0, 1000)
+CONTEXT_TOKEN_BUDGET = env_number("CONTEXT_TOKEN_BUDGET", 8000, 1, 10_000_000)
 DEFAULT_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+BASE_URL = os.getenv("GOOGLE_BASE_URL")
+BATCH_CONCURRENCY = 8
 
 
-def clamp(value, min_value, max_value):
-    return max(min_value, min(value, max_value))
+def read_batch_items(stream):
+    """Yield ``(id, prompt)`` for each line: ``{"id": ..., "prompt": ...}`` or plain text.
+
+    Items without an id are numbered by line, so a resumed run sees the same ids.
+    """
+    for number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError:
+            item = None
+        if isinstance(item, dict):
+            item_id, prompt = item.get("id", number), item.get("prompt")
+        else:
+            item_id, prompt = number, line
+        if not isinstance(prompt, str) or not prompt.strip():
+            print(f"[WARN] Skipping line {number}: no prompt.", file=sys.stderr)
+            continue
+        yield item_id, prompt
+
+
+def open_batch_output(filename):
+    """Open ``filename`` for appending; return it and the ids that already have a result.
+
+    Failed items are retried, so their error lines are dropped first, along with a
+    line a crash cut short: the file keeps one line per id, its final outcome.
+    """
+    done = set()
+    if not os.path.exists(filename):
+        return open(filename, "a", encoding="utf-8"), done
+    dropped = 0
+    temp_name = f"{filename}.tmp"
+    with open(filename, "r", encoding="utf-8") as source, open(temp_name, "w", encoding="utf-8") as target:
+        for line in source:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            if not isinstance(record, dict) or "error" in record or str(record.get("id")) in done:
+                dropped += 1
+                continue
+            done.add(str(record.get("id")))
+            target.write(line if line.endswith("\n") else line + "\n")
+    if dropped:
+        os.replace(temp_name, filename)
+    else:
+        os.remove(temp_name)
+    return open(filename, "a", encoding="utf-8"), done
+
+
+class BatchWorkers:
+    """A fixed set of daemon threads running submitted calls.
+
+    ThreadPoolExecutor's threads are joined at interpreter exit, so a run stopped
+    with Ctrl-C would still wait for every provider call in flight; these are not.
+    """
+
+    def __init__(self, count):
+        self._jobs = queue.Queue()
+        self._count = count
+        for number in range(count):
+            threading.Thread(target=self._work, name=f"batch-{number}", daemon=True).start()
+
+    def submit(self, fn, *args):
+        from concurrent.futures import Future
+
+        future = Future()
+        self._jobs.put((future, fn, args))
+        return future
+
+    def _work(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            future, fn, args = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args))
+            except BaseException as exc:
+                future.set_exception(exc)
+
+    def shutdown(self, cancel_futures=False):
+        """Stop the workers once they finish their current call; never waits for it."""
+        if cancel_futures:
+            while True:
+                try:
+                    job = self._jobs.get_nowait()
+                except queue.Empty:
+                    break
+                if job is not None:
+                    job[0].cancel()
+        for _ in range(self._count):
+            self._jobs.put(None)
+        self._count = 0
+
+
+def create_client(api_key):
+    try:
+        from google import genai
+        from google.genai import types
+    except ImportError as exc:
+        raise RuntimeError("Google GenAI SDK not installed. Install google-genai in requirements.") from exc
+
+    http_options = types.HttpOptions(base_url=BASE_URL) if BASE_URL else None
+    return genai.Client(api_key=api_key, http_options=http_options)
+
+
+def response_usage(response):
+    usage_metadata = getattr(response, "usage_metadata", None)
+    if not usage_metadata:
+        return None
+    return {
+        "prompt": getattr(usage_metadata, "prompt_token_count", None),
+        "output": getattr(usage_metadata, "candidates_token_count", None),
+        "total": getattr(usage_metadata, "total_token_count", None),
+    }
 
 
 class ChatbotCLI:
-    def __init__(self):
+    def __init__(self, warm_up=True, interactive=True):
+        self.interactive = interactive
+        # Only the turns needed for context; the full history lives in the journal.
         self.chat_history = []
+        self.journal = HistoryJournal(HISTORY_FILE, HISTORY_FSYNC, int(HISTORY_MAX_MB * 1024 * 1024))
+        self.context = ContextBuilder(CONTEXT_TOKEN_BUDGET, CONTEXT_TURNS)
         self.api_key = self.load_or_request_api_key()
         self.client = None
+        self.client_lock = threading.Lock()
         self.model_name = DEFAULT_MODEL
         self.generation_config = None
-        self.setup_genai()
-        self.load_chat_history()
+        self.stream_replies = True
+        if interactive:
+            self.load_chat_history()
+        if warm_up:
+            # Importing google.genai takes longer than the rest of start-up; do it while the user types.
+            threading.Thread(target=self.warm_up, name="sdk-warm-up", daemon=True).start()
+
+    def log(self, message):
+        # In batch mode stdout may carry the results.
+        print(message, file=sys.stdout if self.interactive else sys.stderr)
 
     def load_or_request_api_key(self):
         """Load API key from config.toml, or ask user if not found."""
@@ -31,10 +193,15 @@ class ChatbotCLI:
                 config = toml.load(CONFIG_FILE)
                 api_key = config.get("GOOGLE_API_KEY")
                 if api_key:
-                    print(f"[OK] API key loaded from {CONFIG_FILE}")
+                    self.log(f"[OK] API key loaded from {CONFIG_FILE}")
                     return api_key
             except Exception as exc:
-                print(f"[WARN] Failed to read {CONFIG_FILE}: {exc}")
+                self.log(f"[WARN] Failed to read {CONFIG_FILE}: {exc}")
+
+        if not self.interactive:
+            # Batch input may be on stdin; do not read a key from it.
+            self.log(f"[ERROR] API key not found. Create {CONFIG_FILE} with GOOGLE_API_KEY first.")
+            raise SystemExit(1)
 
         print("[WARN] API key not found.")
         print("Please enter your Google API key")
@@ -55,14 +222,19 @@ class ChatbotCLI:
 
         return api_key
 
-    def setup_genai(self):
-        """Configure Google's GenAI client."""
+    def get_client(self):
+        """Google's GenAI client, created (and the SDK imported) on first use."""
+        with self.client_lock:
+            if self.client is None:
+                self.client = create_client(self.api_key)
+            return self.client
+
+    def warm_up(self):
         try:
-            self.client = genai.Client(api_key=self.api_key)
-            print("[OK] AI client is ready!\n")
-        except Exception as exc:
-            print(f"[ERROR] Failed to configure AI client: {exc}")
-            raise SystemExit(1)
+            self.get_client()
+        except Exception:
+            # The first message reports the error.
+            pass
 
     def build_generation_config(
         self,
@@ -71,6 +243,8 @@ class ChatbotCLI:
         top_k=40,
         max_output_tokens=1024,
     ):
+        from google.genai import types
+
         return types.GenerateContentConfig(
             temperature=clamp(float(temperature), 0.0, 2.0),
             top_p=clamp(float(top_p), 0.0, 1.0),
@@ -78,41 +252,237 @@ class ChatbotCLI:
             max_output_tokens=clamp(int(max_output_tokens), 1, 2048),
         )
 
+    def generation_request(self, user_input):
+        if self.generation_config is None:
+            self.generation_config = self.build_generation_config()
+        return {
+            "model": self.model_name,
+            "contents": self.context.build(self.chat_history, user_input),
+            "config": self.generation_config,
+        }
+
     def get_bot_response(self, user_input: str) -> str:
         """Generate response with context."""
         try:
-            context = ""
-            for msg in self.chat_history[-5:]:
-                context += f"User: {msg['user']}\nAssistant: {msg['bot']}\n"
+            client = self.get_client()
+            response = client.models.generate_content(**self.generation_request(user_input))
+            return response.text.strip() if response.text else "No response generated."
+        except Exception as exc:
+            return f"[ERROR] AI Error: {exc}"
+
+    def stream_bot_response(self, user_input):
+        """Print the reply as it arrives and return ``(reply, truncated)``.
+
+        Ctrl-C stops the generation and keeps what arrived so far as a truncated reply.
+        """
+        started = time.perf_counter()
+        first_token_at = None
+        parts = []
+        usage = None
+        stream = None
+        error = None
+        truncated = False
+        print("BOT: ", end="", flush=True)
+        try:
+            client = self.get_client()
+            stream = client.models.generate_content_stream(**self.generation_request(user_input))
+            for chunk in stream:
+                usage = response_usage(chunk) or usage
+                if chunk.text:
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    parts.append(chunk.text)
+                    print(chunk.text, end="", flush=True)
+        except KeyboardInterrupt:
+            truncated = True
+        except Exception as exc:
+            error = f"[ERROR] AI Error: {exc}"
+            truncated = bool(parts)
+        finally:
+            if stream is not None:
+                # Closes the HTTP response, so the provider stops generating.
+                stream.close()
+        finished = time.perf_counter()
+        reply = "".join(parts).strip()
 
-            full_prompt = f"{context}User: {user_input}\nAssistant:"
-            response = self.client.models.generate_content(
+        if error and not parts:
+            print(error)
+            return error, False
+        if not reply and not truncated:
+            reply = "No response generated."
+            print(reply, end="")
+        print(" [cancelled]" if truncated and not error else "")
+        if error:
+            print(error)
+        if first_token_at is not None:
+            self.print_stream_stats(started, first_token_at, finished, reply, usage, truncated)
+        return reply, truncated
+
+    def print_stream_stats(self, started, first_token_at, finished, reply, usage, truncated):
+        tokens = (usage or {}).get("output")
+        estimated = not tokens or truncated
+        if estimated:
+            # A cancelled stream never gets the final usage; about four characters per token.
+            tokens = max(1, len(reply) // 4)
+        generating = finished - first_token_at
+        rate = f"{tokens / generating:.1f} tokens/s" if generating > 0 else "all at once"
+        print(
+            f"[INFO] first token {first_token_at - started:.2f}s, "
+            f"{'~' if estimated else ''}{tokens} tokens, {rate}"
+        )
+
+    def batch_item(self, item_id, prompt):
+        """One stateless generation for batch mode; failures are recorded, not raised."""
+        record = {"id": item_id, "model": self.model_name}
+        started = time.perf_counter()
+        try:
+            response = self.get_client().models.generate_content(
                 model=self.model_name,
-                contents=full_prompt,
+                contents=prompt,
                 config=self.generation_config,
             )
-            return response.text.strip() if response.text else "No response generated."
+            record["reply"] = response.text.strip() if response.text else ""
+            record["usage"] = response_usage(response)
         except Exception as exc:
-            return f"[ERROR] AI Error: {exc}"
+            record["error"] = str(exc)
+        record["latency"] = round(time.perf_counter() - started, 3)
+        return record
+
+    def run_batch(self, source, output_file=None, concurrency=BATCH_CONCURRENCY):
+        """Answer every prompt in ``source`` with up to ``concurrency`` requests in flight.
+
+        Results are written as JSONL in input order. On Ctrl-C, items not yet started
+        are cancelled and the rest are written as they finish, in completion order.
+        A second Ctrl-C stops waiting for them. With ``output_file``, ids that already
+        have a result there are skipped, so an interrupted run can be resumed by running
+        it again; items that failed are retried and their old error lines dropped.
+        """
+        from concurrent.futures import as_completed
+
+        done = set()
+        output = sys.stdout
+        if output_file:
+            output, done = open_batch_output(output_file)
+        if self.generation_config is None:
+            self.generation_config = self.build_generation_config()
+        counts = {"ok": 0, "failed": 0, "skipped": 0}
+        started = time.perf_counter()
 
-    def load_chat_history(self, filename=HISTORY_FILE):
-        """Load previous chat."""
-        if os.path.exists(filename):
+        def write(record):
+            counts["failed" if "error" in record else "ok"] += 1
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            # Flushed per line so a crash loses at most the requests in flight.
+            output.flush()
+
+        pending = deque()
+        executor = BatchWorkers(concurrency)
+        try:
             try:
-                with open(filename, "r") as f:
-                    self.chat_history = json.load(f)
-                if not isinstance(self.chat_history, list):
-                    self.chat_history = []
-                print(f"[OK] Loaded {len(self.chat_history)} messages from history.\n")
-            except Exception as exc:
-                print(f"[WARN] Could not load chat history: {exc}")
+                for item_id, prompt in read_batch_items(source):
+                    if str(item_id) in done:
+                        counts["skipped"] += 1
+                        continue
+                    pending.append(executor.submit(self.batch_item, item_id, prompt))
+                    # Keep a few items queued per worker, so one slow reply holding up
+                    # the ordered output does not leave the other workers idle.
+                    while pending and (pending[0].done() or len(pending) >= concurrency * 4):
+                        # Popped only once written, so Ctrl-C during the wait keeps it in pending.
+                        write(pending[0].result())
+                        pending.popleft()
+                while pending:
+                    write(pending[0].result())
+                    pending.popleft()
+            except KeyboardInterrupt:
+                # Drop what has not started and keep everything that has: finished
+                # results now, the rest as they complete (every record carries its id).
+                executor.shutdown(cancel_futures=True)
+                running = []
+                for future in pending:
+                    if future.cancelled():
+                        continue
+                    if future.done():
+                        write(future.result())
+                    else:
+                        running.append(future)
+                if running:
+                    print(
+                        f"\n[INFO] Interrupted; saving {len(running)} replies in flight (Ctrl-C again to drop them).",
+                        file=sys.stderr,
+                    )
+                try:
+                    for future in as_completed(running):
+                        write(future.result())
+                except KeyboardInterrupt:
+                    pass
+                print("\n[INFO] Interrupted; run again with the same --output to resume.", file=sys.stderr)
+        finally:
+            executor.shutdown(cancel_futures=True)
+            if output is not sys.stdout:
+                output.close()
+        print(
+            f"[OK] {counts['ok']} answered, {counts['failed']} failed, {counts['skipped']} already done "
+            f"in {time.perf_counter() - started:.1f}s",
+            file=sys.stderr,
+        )
+        return counts
+
+    def import_legacy_history(self):
+        """Copy a chat_history.json from older versions into the journal, once."""
+        try:
+            with open(LEGACY_HISTORY_FILE, "r") as f:
+                turns = json.load(f)
+            if not isinstance(turns, list):
+                turns = []
+            self.journal.extend(turns)
+            print(f"[OK] Imported {len(turns)} messages from {LEGACY_HISTORY_FILE} into {HISTORY_FILE}")
+        except Exception as exc:
+            print(f"[WARN] Could not import {LEGACY_HISTORY_FILE}: {exc}")
+
+    def load_chat_history(self):
+        """Load the last turns of the previous chat, as many as the context uses."""
+        if not self.journal.exists() and os.path.exists(LEGACY_HISTORY_FILE):
+            self.import_legacy_history()
+        if not self.journal.exists():
+            return
+        try:
+            self.chat_history = self.journal.tail(CONTEXT_TURNS)
+            print(f"[OK] Loaded the last {len(self.chat_history)} messages from history.\n")
+            # Drop turns cleared in an earlier session while they are cheap to skip.
+            self.journal.compact()
+        except Exception as exc:
+            print(f"[WARN] Could not load chat history: {exc}")
+
+    def record_turn(self, user_input, bot_response, truncated=False):
+        turn = {"user": user_input, "bot": bot_response, "ts": time.time()}
+        if truncated:
+            turn["truncated"] = True
+        self.chat_history.append(turn)
+        del self.chat_history[:-CONTEXT_TURNS]
+        try:
+            self.journal.append(turn)
+        except Exception as exc:
+            print(f"[ERROR] Could not write to {HISTORY_FILE}: {exc}")
+
+    def clear_chat_history(self):
+        self.chat_history.clear()
+        try:
+            self.journal.clear()
+        except Exception as exc:
+            print(f"[ERROR] Could not write to {HISTORY_FILE}: {exc}")
 
-    def save_chat_history(self, filename=HISTORY_FILE):
-        """Save chat to file."""
+    def save_chat_history(self):
+        """Sync the journal to disk; every turn is already written as it happens."""
         try:
-            with open(filename, "w") as f:
-                json.dump(self.chat_history, f, indent=2)
-            print(f"\n[OK] Chat saved to {filename}")
+            self.journal.sync()
+            print(f"\n[OK] Chat saved to {HISTORY_FILE}")
+        except Exception as exc:
+            print(f"[ERROR] Save failed: {exc}")
+
+    def close_chat_history(self):
+        try:
+            self.journal.close()
+            self.journal.compact()
+            print(f"\n[OK] Chat saved to {HISTORY_FILE}")
         except Exception as exc:
             print(f"[ERROR] Save failed: {exc}")
 
@@ -157,7 +527,6 @@ class ChatbotCLI:
 
     def run(self):
         """Main loop."""
-        self.generation_config = self.build_generation_config()
         self.display_menu()
 
         print("Start chatting! Type a message or a command.\n")
@@ -167,14 +536,14 @@ class ChatbotCLI:
                 user_input = input("YOU: ").strip()
             except (EOFError, KeyboardInterrupt):
                 print("\n[INFO] Exiting...")
-                self.save_chat_history()
+                self.close_chat_history()
                 break
 
             if not user_input:
                 continue
 
             if user_input.lower() == "/exit":
-                self.save_chat_history()
+                self.close_chat_history()
                 print("Goodbye!")
                 break
 
@@ -183,7 +552,7 @@ class ChatbotCLI:
                 continue
 
             if user_input.lower() == "/clear":
-                self.chat_history.clear()
+                self.clear_chat_history()
                 print("[OK] Chat cleared.")
                 continue
 
@@ -195,11 +564,57 @@ class ChatbotCLI:
                 self.configure_model_name()
                 continue
 
-            bot_response = self.get_bot_response(user_input)
-            print(f"BOT: {bot_response}")
-            self.chat_history.append({"user": user_input, "bot": bot_response})
+            if self.stream_replies:
+                bot_response, truncated = self.stream_bot_response(user_input)
+            else:
+                bot_response, truncated = self.get_bot_response(user_input), False
+                print(f"BOT: {bot_response}")
+            self.record_turn(user_input, bot_response, truncated)
+
+
+def profile_startup():
+    """Print an import-time breakdown of this module, then what the first client costs.
+
+    No ChatbotCLI is built, so this never asks for a key or touches the history file.
+    """
+    from startup_profile import print_breakdown
+
+    started = time.perf_counter()
+    try:
+        # The client does not check the key until the first request.
+        create_client(os.getenv("GOOGLE_API_KEY") or "profile-startup")
+        phases = [("first client (SDK import + client)", time.perf_counter() - started)]
+    except Exception as exc:
+        print(f"[WARN] Could not create the AI client: {exc}")
+        phases = []
+    print_breakdown("app", phases)
 
 
 if __name__ == "__main__":
-    app = ChatbotCLI()
+    parser = argparse.ArgumentParser(description="AI Chatbot (CLI).")
+    parser.add_argument("--profile-startup", action="store_true", help="print an import-time breakdown and exit")
+    parser.add_argument("--no-warm-up", action="store_true", help="do not load the SDK in the background at start-up")
+    parser.add_argument("--model", help=f"model name (default {DEFAULT_MODEL})")
+    parser.add_argument("--no-stream", action="store_true", help="print each reply only once it is complete")
+    parser.add_argument("--batch", metavar="FILE", help="answer the prompts in FILE (JSONL or one per line; - for stdin) and exit")
+    parser.add_argument("--output", metavar="FILE", help="batch results as JSONL (default stdout); resumes if it exists")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="batch requests in flight")
+    args = parser.parse_args()
+    if args.profile_startup:
+        profile_startup()
+        sys.exit(0)
+    if args.batch:
+        app = ChatbotCLI(warm_up=False, interactive=False)
+        if args.model:
+            app.model_name = args.model
+        if args.batch == "-":
+            counts = app.run_batch(sys.stdin, args.output, max(1, args.concurrency))
+        else:
+            with open(args.batch, "r", encoding="utf-8") as source:
+                counts = app.run_batch(source, args.output, max(1, args.concurrency))
+        sys.exit(1 if counts["failed"] else 0)
+    app = ChatbotCLI(warm_up=not args.no_warm_up)
+    if args.model:
+        app.model_name = args.model
+    app.stream_replies = not args.no_stream
     app.run()
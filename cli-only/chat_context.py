@@ -0,0 +1,62 @@
+"""Role-tagged Gemini ``contents`` for a chat history, within a token budget.
+
+Used by ``streamlit_app_v2.py`` and ``cli-only/app.py`` (each folder is run on its
+own, so each keeps a copy of this file). History turns are ``{"user": ..., "bot": ...}``
+dicts; each becomes a user and a model ``types.Content`` instead of one
+"User: ...\\nAssistant: ..." string, so no framing text is sent and the provider sees
+the real roles. Converted turns are remembered, so each call only converts turns it
+has not seen before (normally just the newest one).
+"""
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text):
+    # About four characters per token for English; enough to keep a budget.
+    return len(text) // 4 + MESSAGE_OVERHEAD_TOKENS
+
+
+class ContextBuilder:
+    def __init__(self, token_budget=8000, max_turns=0):
+        self.token_budget = token_budget
+        self.max_turns = max_turns
+        # (user, bot) -> (contents, tokens) for the turns used by the last call.
+        self._converted = {}
+
+    def _convert(self, turn):
+        user, bot = turn.get("user") or "", turn.get("bot") or ""
+        key = (user, bot)
+        cached = self._converted.get(key)
+        if cached is None:
+            from google.genai import types
+
+            contents = [
+                types.Content(role="user", parts=[types.Part.from_text(text=user)]),
+                types.Content(role="model", parts=[types.Part.from_text(text=bot)]),
+            ]
+            cached = (contents, estimate_tokens(user) + estimate_tokens(bot))
+        return key, cached
+
+    def build(self, history, user_input):
+        """The newest turns that fit in the budget, oldest first, then ``user_input``."""
+        from google.genai import types
+
+        budget = self.token_budget - estimate_tokens(user_input)
+        turns = history[-self.max_turns:] if self.max_turns else history
+        selected = []
+        used = {}
+        for turn in reversed(turns):
+            if not turn.get("user") or not turn.get("bot"):
+                # A reply cancelled before any text arrived; an empty part is rejected.
+                continue
+            key, (contents, tokens) = self._convert(turn)
+            if tokens > budget:
+                break
+            budget -= tokens
+            selected.append(contents)
+            used[key] = (contents, tokens)
+        # Keep only what this call used, so the memo stays the size of the window.
+        self._converted = used
+
+        messages = [content for contents in reversed(selected) for content in contents]
+        messages.append(types.Content(role="user", parts=[types.Part.from_text(text=user_input)]))
+        return messages
@@ -0,0 +1,187 @@
+"""Append-only chat history: one JSON line per turn.
+
+Each turn is appended (and flushed) as soon as it completes, so saving never rewrites
+the file and a crash loses at most the line being written; a torn last line is skipped
+on load. ``/clear`` appends a marker instead of deleting anything, and compaction later
+rewrites the file without the turns before it. With ``max_bytes`` set, a file that grows
+past it is compacted the same way down to its newest turns (about half of ``max_bytes``),
+so a long session without /clear does not grow without bound. Loading reads the file backwards from
+the end and stops once it has the turns it needs, so start-up does not depend on how
+long the history is.
+
+fsync policies: ``always`` syncs every turn, ``interval`` (default) at most once a
+second plus on /save and exit, ``never`` leaves it to the OS. Every turn is flushed to
+the OS either way, so only a power loss or OS crash can lose synced-later turns.
+"""
+import json
+import os
+import time
+
+FSYNC_POLICIES = ("always", "interval", "never")
+FSYNC_INTERVAL = 1.0
+BLOCK_SIZE = 64 * 1024
+
+
+def reverse_lines(f):
+    """Yield ``(offset, line)`` for every line of binary file ``f``, last line first."""
+    position = f.seek(0, os.SEEK_END)
+    carry = b""
+    while position > 0:
+        size = min(BLOCK_SIZE, position)
+        position -= size
+        f.seek(position)
+        lines = (f.read(size) + carry).split(b"\n")
+        # The first piece may continue in the previous block; finish it on the next pass.
+        carry = lines.pop(0)
+        offset = position + len(carry) + 1
+        starts = []
+        for line in lines:
+            starts.append(offset)
+            offset += len(line) + 1
+        yield from zip(reversed(starts), reversed(lines))
+    yield 0, carry
+
+
+class HistoryJournal:
+    def __init__(self, filename, fsync="interval", max_bytes=0):
+        self.filename = filename
+        self.fsync = fsync if fsync in FSYNC_POLICIES else "interval"
+        self.max_bytes = max_bytes
+        # Offset just past the last clear marker (0: nothing to drop, None: not known).
+        self.live_from = None
+        self._file = None
+        self._synced_at = 0.0
+
+    def exists(self):
+        return os.path.exists(self.filename)
+
+    def tail(self, count):
+        """The last ``count`` turns since the most recent /clear, oldest first."""
+        turns = []
+        if count <= 0 or not self.exists():
+            return turns
+        with open(self.filename, "rb") as f:
+            for offset, line in reverse_lines(f):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A line torn by a crash.
+                    continue
+                if not isinstance(record, dict):
+                    continue
+                if record.get("clear"):
+                    self.live_from = offset + len(line) + 1
+                    break
+                turns.append(record)
+                if len(turns) == count:
+                    break
+            else:
+                self.live_from = 0
+        turns.reverse()
+        return turns
+
+    def _open(self):
+        if self._file is None:
+            torn = False
+            if self.exists() and os.path.getsize(self.filename):
+                with open(self.filename, "rb") as f:
+                    f.seek(-1, os.SEEK_END)
+                    torn = f.read(1) != b"\n"
+            self._file = open(self.filename, "ab")
+            if torn:
+                self._file.write(b"\n")
+        return self._file
+
+    def append(self, record):
+        self._write(record)
+        self._trim_if_full()
+
+    def _write(self, record):
+        """Write and flush one record; return the offset just past it."""
+        f = self._open()
+        f.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+        f.flush()
+        now = time.monotonic()
+        if self.fsync == "always" or (self.fsync == "interval" and now - self._synced_at >= FSYNC_INTERVAL):
+            os.fsync(f.fileno())
+            self._synced_at = now
+        return f.tell()
+
+    def extend(self, records):
+        """Append many records with a single sync (used to import the old JSON history)."""
+        f = self._open()
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+        self.sync()
+        self._trim_if_full()
+
+    def clear(self):
+        # Note where the marker ends before a trim can compact (and close) the file.
+        self.live_from = self._write({"clear": True, "ts": time.time()})
+        self._trim_if_full()
+
+    def sync(self):
+        if self._file is not None:
+            self._file.flush()
+            if self.fsync != "never":
+                os.fsync(self._file.fileno())
+            self._synced_at = time.monotonic()
+
+    def close(self):
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+
+    def _trim_if_full(self):
+        if self.max_bytes and self._file is not None and self._file.tell() > self.max_bytes:
+            self.trim(self.max_bytes // 2)
+
+    def trim(self, keep_bytes):
+        """Compact away the oldest turns, keeping the newest ``keep_bytes`` (at least one turn)."""
+        if not self.exists():
+            return 0
+        self.close()
+        start = None
+        with open(self.filename, "rb") as f:
+            end = f.seek(0, os.SEEK_END)
+            for offset, line in reverse_lines(f):
+                if not line.strip():
+                    continue
+                if start is not None and end - offset > keep_bytes:
+                    break
+                start = offset
+        if start:
+            self.live_from = max(self.live_from or 0, start)
+        return self.compact()
+
+    def compact(self):
+        """Rewrite the file without what precedes the last clear marker; return the bytes dropped."""
+        if not self.live_from or not self.exists():
+            return 0
+        self.close()
+        dropped = self.live_from
+        temp_name = f"{self.filename}.tmp"
+        with open(self.filename, "rb") as source, open(temp_name, "wb") as target:
+            source.seek(self.live_from)
+            while True:
+                block = source.read(BLOCK_SIZE)
+                if not block:
+                    break
+                target.write(block)
+            target.flush()
+            os.fsync(target.fileno())
+        os.replace(temp_name, self.filename)
+        try:
+            # Make the rename itself durable (not possible on Windows).
+            directory = os.open(os.path.dirname(os.path.abspath(self.filename)), os.O_RDONLY)
+            try:
+                os.fsync(directory)
+            finally:
+                os.close(directory)
+        except OSError:
+            pass
+        self.live_from = 0
+        return dropped
@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+
+@pytest.fixture
+def cli():
+    import app
+
+    # Skip __init__: it asks for an API key and loads the chat history.
+    chatbot = app.ChatbotCLI.__new__(app.ChatbotCLI)
+    chatbot.interactive = False
+    chatbot.model_name = "test-model"
+    chatbot.generation_config = object()
+    return chatbot
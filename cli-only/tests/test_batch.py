@@ -0,0 +1,115 @@
+import json
+import threading
+import time
+
+
+def interrupted_source(count, wait=0.0):
+    """Batch input whose reader gets Ctrl-C after ``count`` lines."""
+    for number in range(count):
+        yield json.dumps({"id": number, "prompt": f"prompt {number}"}) + "\n"
+    time.sleep(wait)
+    raise KeyboardInterrupt
+
+
+def read_records(path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def test_interrupt_keeps_results_finished_behind_a_slow_item(cli, tmp_path):
+    def batch_item(item_id, prompt):
+        time.sleep(0.3 if item_id == 0 else 0.01)
+        return {"id": item_id, "reply": prompt}
+
+    cli.batch_item = batch_item
+    output = tmp_path / "out.jsonl"
+    counts = cli.run_batch(interrupted_source(4, wait=0.1), str(output), concurrency=4)
+
+    assert counts["ok"] == 4
+    records = read_records(output)
+    # Finished items are written first; the slow one when it completes.
+    assert [record["id"] for record in records] == [1, 2, 3, 0]
+
+
+def test_interrupt_cancels_items_not_yet_started(cli, tmp_path):
+    calls = []
+    lock = threading.Lock()
+
+    def batch_item(item_id, prompt):
+        with lock:
+            calls.append(item_id)
+        time.sleep(0.2)
+        return {"id": item_id, "reply": prompt}
+
+    cli.batch_item = batch_item
+    output = tmp_path / "out.jsonl"
+    cli.run_batch(interrupted_source(3), str(output), concurrency=1)
+
+    assert calls == [0]
+    assert [record["id"] for record in read_records(output)] == [0]
+
+
+def test_resume_skips_completed_ids(cli, tmp_path):
+    output = tmp_path / "out.jsonl"
+    output.write_text(json.dumps({"id": 0, "reply": "done"}) + "\n" + json.dumps({"id": 1, "error": "boom"}) + "\n")
+    cli.batch_item = lambda item_id, prompt: {"id": item_id, "reply": prompt}
+
+    source = [json.dumps({"id": number, "prompt": "p"}) + "\n" for number in range(3)]
+    counts = cli.run_batch(source, str(output), concurrency=2)
+
+    assert counts == {"ok": 2, "failed": 0, "skipped": 1}
+    # One line per id: the old error line for 1 is replaced by its retry.
+    assert [record["id"] for record in read_records(output)] == [0, 1, 2]
+    assert all("error" not in record for record in read_records(output))
+
+
+def test_resume_drops_a_line_cut_short(cli, tmp_path):
+    output = tmp_path / "out.jsonl"
+    output.write_text(json.dumps({"id": 0, "reply": "done"}) + '\n{"id": 1, "rep')
+    cli.batch_item = lambda item_id, prompt: {"id": item_id, "reply": prompt}
+
+    source = [json.dumps({"id": number, "prompt": "p"}) + "\n" for number in range(2)]
+    cli.run_batch(source, str(output), concurrency=1)
+
+    assert [record["id"] for record in read_records(output)] == [0, 1]
+
+
+def test_second_interrupt_leaves_calls_that_do_not_hold_up_exit(cli, tmp_path, monkeypatch):
+    import concurrent.futures
+
+    release = threading.Event()
+
+    def batch_item(item_id, prompt):
+        release.wait(5)
+        return {"id": item_id, "reply": prompt}
+
+    def second_interrupt(futures):
+        raise KeyboardInterrupt
+
+    cli.batch_item = batch_item
+    # The second Ctrl-C arrives while waiting for the reply in flight.
+    monkeypatch.setattr(concurrent.futures, "as_completed", second_interrupt)
+    try:
+        counts = cli.run_batch(interrupted_source(1, wait=0.05), str(tmp_path / "out.jsonl"), concurrency=2)
+        assert counts["ok"] == 0
+        workers = [thread for thread in threading.enumerate() if thread.name.startswith("batch-")]
+        assert workers and all(thread.daemon for thread in workers)
+    finally:
+        release.set()
+
+
+def test_interrupt_while_waiting_for_the_oldest_item_keeps_it(cli, tmp_path):
+    import _thread
+
+    def batch_item(item_id, prompt):
+        time.sleep(0.4 if item_id == 0 else 0.01)
+        return {"id": item_id, "reply": prompt}
+
+    cli.batch_item = batch_item
+    output = tmp_path / "out.jsonl"
+    source = [json.dumps({"id": number, "prompt": "p"}) + "\n" for number in range(3)]
+    # Ctrl-C while run_batch is blocked on item 0's result.
+    threading.Timer(0.15, _thread.interrupt_main).start()
+    counts = cli.run_batch(source, str(output), concurrency=3)
+
+    assert counts["ok"] == 3
+    assert sorted(record["id"] for record in read_records(output)) == [0, 1, 2]
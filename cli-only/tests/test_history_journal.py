@@ -0,0 +1,93 @@
+import io
+import json
+
+import pytest
+
+import history_journal
+from history_journal import HistoryJournal, reverse_lines
+
+
+def turn(number, size=10):
+    return {"user": f"question {number}", "bot": "x" * size}
+
+
+@pytest.fixture
+def journal(tmp_path):
+    journal = HistoryJournal(str(tmp_path / "history.jsonl"), fsync="never")
+    yield journal
+    journal.close()
+
+
+def test_reverse_lines_across_blocks(monkeypatch):
+    monkeypatch.setattr(history_journal, "BLOCK_SIZE", 7)
+    data = b"first line\nsecond\n\nthird one here\nlast"
+    lines = list(reverse_lines(io.BytesIO(data)))
+    assert [line for _, line in lines] == [b"last", b"third one here", b"", b"second", b"first line"]
+    for offset, line in lines:
+        assert data[offset:offset + len(line)] == line
+
+
+def test_tail_returns_newest_turns_oldest_first(journal):
+    for number in range(10):
+        journal.append(turn(number))
+    assert [record["user"] for record in journal.tail(3)] == ["question 7", "question 8", "question 9"]
+    assert journal.tail(0) == []
+
+
+def test_torn_last_line_is_skipped_and_repaired(journal):
+    journal.append(turn(0))
+    journal.close()
+    with open(journal.filename, "ab") as f:
+        f.write(b'{"user": "cut sh')
+    assert [record["user"] for record in journal.tail(5)] == ["question 0"]
+    journal.append(turn(1))
+    assert [record["user"] for record in journal.tail(5)] == ["question 0", "question 1"]
+
+
+def test_clear_hides_and_compaction_drops_earlier_turns(journal):
+    for number in range(3):
+        journal.append(turn(number))
+    journal.clear()
+    journal.append(turn(3))
+    assert [record["user"] for record in journal.tail(5)] == ["question 3"]
+    assert journal.compact() > 0
+    with open(journal.filename, encoding="utf-8") as f:
+        assert [json.loads(line)["user"] for line in f] == ["question 3"]
+
+
+def test_size_limit_keeps_the_newest_turns(tmp_path):
+    journal = HistoryJournal(str(tmp_path / "history.jsonl"), fsync="never", max_bytes=4096)
+    for number in range(500):
+        journal.append(turn(number, size=100))
+    journal.close()
+    size = (tmp_path / "history.jsonl").stat().st_size
+    assert size <= 4096
+    with open(journal.filename, encoding="utf-8") as f:
+        users = [json.loads(line)["user"] for line in f]
+    assert users[-1] == "question 499"
+    assert users == [f"question {number}" for number in range(500 - len(users), 500)]
+    assert len(users) >= 10
+
+
+def test_size_limit_keeps_a_turn_larger_than_the_limit(tmp_path):
+    journal = HistoryJournal(str(tmp_path / "history.jsonl"), fsync="never", max_bytes=1024)
+    journal.append(turn(0))
+    journal.append(turn(1, size=5000))
+    assert [record["user"] for record in journal.tail(5)] == ["question 1"]
+    journal.close()
+
+
+def test_clear_near_the_size_limit(tmp_path):
+    path = tmp_path / "history.jsonl"
+    journal = HistoryJournal(str(path), fsync="never")
+    for number in range(20):
+        journal.append(turn(number))
+    journal.close()
+    # The clear marker itself takes the file past the limit.
+    journal = HistoryJournal(str(path), fsync="never", max_bytes=path.stat().st_size + 10)
+    journal.clear()
+    assert journal.tail(5) == []
+    journal.append(turn(20))
+    assert [record["user"] for record in journal.tail(5)] == ["question 20"]
+    journal.close()
+    assert path.stat().st_size < 100
@@ -1,9 +1,13 @@
 import streamlit as st
+import argparse
+import importlib
 import json
 import os
-from google import genai
-from google.genai import types
+import sys
+import threading
+import time
 from typing import List, Dict
+from chat_context import ContextBuilder
 
 
 st.set_page_config(
@@ -13,26 +17,69 @@ st.set_page_config(
 )
 
 
+RECENT_TURNS = 20
+HISTORY_CHUNK_TURNS = 50
+
+
+@st.cache_resource
+def get_genai_client(api_key):
+    """One client per API key for the whole server process, shared by every session and rerun."""
+    from google import genai
+
+    return genai.Client(api_key=api_key)
+
+
+def chunk_markdown(turns):
+    return "\n\n---\n\n".join(f"**You:** {turn['user']}\n\n**Assistant:** {turn['bot']}" for turn in turns)
+
+
+def env_number(name, default, min_value, max_value, cast=int):
+    """Environment variable ``name`` as a clamped number; ``default`` if unset or invalid."""
+    value = os.getenv(name)
+    if value is None or not value.strip():
+        return default
+    try:
+        return max(min_value, min(cast(value), max_value))
+    except ValueError:
+        print(f"[WARN] Ignoring invalid {name}={value!r}; using {default}.")
+        return default
+
+
+def import_sdk():
+    importlib.import_module("google.genai")
+
+
+def start_warm_up():
+    """Import the SDK in the background once per server process, while the first page renders."""
+    if os.getenv("WARM_UP", "on") == "off":
+        return
+    # Streamlit re-runs this script on every interaction; the thread only needs starting once.
+    if any(thread.name == "sdk-warm-up" for thread in threading.enumerate()) or "google.genai" in sys.modules:
+        return
+    threading.Thread(target=import_sdk, name="sdk-warm-up", daemon=True).start()
+
+
 class ChatbotApp:
     def __init__(self):
-        self.client = None
+        self.api_key = None
         self.setup_genai()
         self.initialize_session_state()
 
     def setup_genai(self):
-        """Configure Google's GenAI client."""
-        api_key = st.secrets.get("GOOGLE_API_KEY") or os.getenv("GOOGLE_API_KEY")
+        """Check for the API key; the client itself is created when the first message is sent."""
+        self.api_key = st.secrets.get("GOOGLE_API_KEY") or os.getenv("GOOGLE_API_KEY")
 
-        if not api_key:
+        if not self.api_key:
             st.error("Please set your Google API Key in secrets.toml or as an environment variable")
             st.stop()
 
-        self.client = genai.Client(api_key=api_key)
+    def get_client(self):
+        return get_genai_client(self.api_key)
 
     def initialize_session_state(self):
         """Initialize session state variables."""
         if "chat_history" not in st.session_state:
-            st.session_state.chat_history = []
+            self.set_history([])
 
         if "generation_config" not in st.session_state:
             st.session_state.generation_config = None
@@ -40,8 +87,16 @@ class ChatbotApp:
         if "model_name" not in st.session_state:
             st.session_state.model_name = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
 
+        if "context_builder" not in st.session_state:
+            st.session_state.context_builder = ContextBuilder(
+                token_budget=env_number("CONTEXT_TOKEN_BUDGET", 8000, 1, 10_000_000),
+                max_turns=env_number("CONTEXT_TURNS", 5, 0, 1000),
+            )
+
     def build_generation_config(self, temperature: float, top_p: float, top_k: int, max_output_tokens: int):
         """Create a generation config with specified parameters."""
+        from google.genai import types
+
         return types.GenerateContentConfig(
             temperature=temperature,
             top_p=top_p,
@@ -49,23 +104,43 @@ class ChatbotApp:
             max_output_tokens=max_output_tokens,
         )
 
+    def generation_request(self, user_input: str, chat_history: List[Dict]) -> Dict:
+        if st.session_state.generation_config is None:
+            st.session_state.generation_config = self.build_generation_config(*st.session_state.last_config)
+        return {
+            "model": st.session_state.model_name,
+            "contents": st.session_state.context_builder.build(chat_history, user_input),
+            "config": st.session_state.generation_config,
+        }
+
     def get_bot_response(self, user_input: str, chat_history: List[Dict]) -> str:
         """Generate bot response using the model."""
         try:
-            context = ""
-            for message in chat_history[-5:]:
-                context += f"User: {message['user']}\nAssistant: {message['bot']}\n"
-
-            full_prompt = f"{context}User: {user_input}\nAssistant:"
-            response = self.client.models.generate_content(
-                model=st.session_state.model_name,
-                contents=full_prompt,
-                config=st.session_state.generation_config,
-            )
+            response = self.get_client().models.generate_content(**self.generation_request(user_input, chat_history))
             return response.text.strip() if response.text else "No response generated."
         except Exception as exc:
             return f"Error generating response: {exc}"
 
+    def stream_bot_response(self, user_input: str, chat_history: List[Dict]):
+        """Yield the reply text as the model produces it, for ``st.write_stream``."""
+        stream = None
+        produced = False
+        try:
+            stream = self.get_client().models.generate_content_stream(**self.generation_request(user_input, chat_history))
+            for chunk in stream:
+                if chunk.text:
+                    produced = True
+                    yield chunk.text
+            if not produced:
+                yield "No response generated."
+        except Exception as exc:
+            separator = "\n\n" if produced else ""
+            yield f"{separator}Error generating response: {exc}"
+        finally:
+            if stream is not None:
+                # Also reached when a new interaction stops this run mid-reply.
+                stream.close()
+
     def save_chat_history(self, chat_history: List[Dict], filename: str = "chat_history.json"):
         """Save chat history to a JSON file."""
         try:
@@ -88,6 +163,58 @@ class ChatbotApp:
             st.error(f"Error loading chat history: {exc}")
             return []
 
+    def set_history(self, history: List[Dict]):
+        """Replace the history, resetting what is derived from it."""
+        st.session_state.chat_history = history
+        st.session_state.history_stats = {
+            "count": len(history),
+            "user_chars": sum(len(turn["user"]) for turn in history),
+        }
+        st.session_state.rendered_chunks = {}
+
+    def append_turn(self, turn: Dict):
+        st.session_state.chat_history.append(turn)
+        stats = st.session_state.history_stats
+        stats["count"] += 1
+        stats["user_chars"] += len(turn["user"])
+
+    def render_stats(self, placeholder):
+        stats = st.session_state.history_stats
+        with placeholder.container():
+            st.write(f"Total messages: {stats['count']}")
+            if stats["count"]:
+                # Kept up to date as turns are added, not summed over the history on every rerun.
+                st.write(f"Avg message length: {stats['user_chars'] / stats['count']:.1f} chars")
+
+    def render_history(self, history: List[Dict]):
+        """Show the latest turns as chat messages and older ones one page at a time.
+
+        Every rerun re-sends what is rendered, so long chats would otherwise send every
+        message again on each keystroke. Older turns are grouped in pages of
+        ``HISTORY_CHUNK_TURNS`` whose markdown is built once and kept in the session.
+        """
+        older = len(history) - RECENT_TURNS
+        if older > 0:
+            pages = (older + HISTORY_CHUNK_TURNS - 1) // HISTORY_CHUNK_TURNS
+            with st.expander(f"Earlier messages ({older})"):
+                page = st.number_input("Page", min_value=1, max_value=pages, value=pages) if pages > 1 else 1
+                start = (page - 1) * HISTORY_CHUNK_TURNS
+                end = min(start + HISTORY_CHUNK_TURNS, older)
+                rendered = st.session_state.rendered_chunks
+                if (start, end) not in rendered:
+                    # The last page grows as turns scroll out of the recent ones; drop its stale versions.
+                    for key in [key for key in rendered if key[0] == start]:
+                        del rendered[key]
+                    rendered[(start, end)] = chunk_markdown(history[start:end])
+                st.markdown(rendered[(start, end)])
+
+        for message in history[max(older, 0):]:
+            with st.chat_message("user"):
+                st.write(message["user"])
+
+            with st.chat_message("assistant"):
+                st.write(message["bot"])
+
     def run(self):
         """Main application logic."""
         st.title("AI Chatbot with Google GenAI")
@@ -136,7 +263,7 @@ class ChatbotApp:
             col1, col2 = st.columns(2)
             with col1:
                 if st.button("Clear History"):
-                    st.session_state.chat_history = []
+                    self.set_history([])
                     st.rerun()
 
             with col2:
@@ -147,41 +274,31 @@ class ChatbotApp:
             if st.button("Load History"):
                 loaded_history = self.load_chat_history()
                 if loaded_history:
-                    st.session_state.chat_history = loaded_history
+                    self.set_history(loaded_history)
                     st.success("History loaded!")
                     st.rerun()
 
             st.header("Chat Statistics")
-            st.write(f"Total messages: {len(st.session_state.chat_history)}")
-            if st.session_state.chat_history:
-                avg_user_length = (
-                    sum(len(msg["user"]) for msg in st.session_state.chat_history)
-                    / len(st.session_state.chat_history)
-                )
-                st.write(f"Avg message length: {avg_user_length:.1f} chars")
+            stats_placeholder = st.empty()
+            self.render_stats(stats_placeholder)
 
             st.header("Model")
             model_name = st.text_input("Model name", value=st.session_state.model_name)
             if model_name and model_name != st.session_state.model_name:
                 st.session_state.model_name = model_name
+            stream_replies = st.toggle("Stream replies", value=True)
 
         current_config = (temperature, top_p, top_k, max_tokens)
-        if st.session_state.generation_config is None or getattr(st.session_state, "last_config", None) != current_config:
-            st.session_state.generation_config = self.build_generation_config(
-                temperature, top_p, top_k, max_tokens
-            )
+        if getattr(st.session_state, "last_config", None) != current_config:
+            # Built on the next message, so the first render does not wait for the SDK import.
+            st.session_state.generation_config = None
             st.session_state.last_config = current_config
 
         st.header("Chat")
 
         chat_container = st.container()
         with chat_container:
-            for message in st.session_state.chat_history:
-                with st.chat_message("user"):
-                    st.write(message["user"])
-
-                with st.chat_message("assistant"):
-                    st.write(message["bot"])
+            self.render_history(st.session_state.chat_history)
 
         user_input = st.chat_input("Type your message here...")
 
@@ -190,19 +307,25 @@ class ChatbotApp:
                 st.write(user_input)
 
             with st.chat_message("assistant"):
-                with st.spinner("Thinking..."):
-                    bot_response = self.get_bot_response(
-                        user_input,
-                        st.session_state.chat_history,
-                    )
-                st.write(bot_response)
-
-            st.session_state.chat_history.append({
+                if stream_replies:
+                    bot_response = st.write_stream(
+                        self.stream_bot_response(user_input, st.session_state.chat_history)
+                    ).strip()
+                else:
+                    with st.spinner("Thinking..."):
+                        bot_response = self.get_bot_response(
+                            user_input,
+                            st.session_state.chat_history,
+                        )
+                    st.write(bot_response)
+
+            self.append_turn({
                 "user": user_input,
                 "bot": bot_response,
             })
-
-            st.rerun()
+            # The new turn is already on screen; refresh the statistics in place rather
+            # than re-running the whole script.
+            self.render_stats(stats_placeholder)
 
         with st.expander("Current Model Configuration"):
             st.json({
@@ -214,6 +337,23 @@ class ChatbotApp:
             })
 
 
+def profile_startup():
+    """Print an import-time breakdown of this script, then what importing the SDK costs."""
+    from startup_profile import print_breakdown
+
+    started = time.perf_counter()
+    import_sdk()
+    print_breakdown("streamlit_app_v2", [("google.genai import", time.perf_counter() - started)])
+
+
 if __name__ == "__main__":
+    # python streamlit_app_v2.py --profile-startup (or streamlit run streamlit_app_v2.py -- --profile-startup)
+    parser = argparse.ArgumentParser(description="AI Chatbot (Streamlit).")
+    parser.add_argument("--profile-startup", action="store_true", help="print an import-time breakdown and exit")
+    args, _ = parser.parse_known_args()
+    if args.profile_startup:
+        profile_startup()
+        sys.exit(0)
+    start_warm_up()
     app = ChatbotApp()
     app.run()